@@ -9,6 +9,15 @@ from cbpi.api.dataclasses import Sensor, Kettle, Props
 from cbpi.api.config import ConfigType
 import numpy as np
 from .TelemetrixAioService import TelemetrixAioService
+from .adaptiveSampling import AdaptiveSampler
+from .boardProfiles import ANALOG, PinConflict, pin_options
+from .linkBudget import ANALOG_REPORT_BYTES
+from .burstCapture import run_burst
+from .controlScheduler import ControlScheduler
+from .loopMonitor import loop_monitor, monitored
+from .timeSeries import history
+from .totalizer import Totalizer, totalizers
+from .volumeTransfer import VolumeSource, VolumeTransfer, reset_volume_sensor, set_actor_output
 
 from .shared import flowmeter_data 
 
@@ -139,13 +148,16 @@ from cbpi.api import *
 logger = logging.getLogger(__name__)
 
 @parameters([
-    Property.Number(label="ADC Pin", configurable=True, description="The ADC pin number on the Arduino board"),
+    Property.Select(label="ADC Pin", options=pin_options(ANALOG), description="The analog input of the flow meter (A0 = 0)"),
     Property.Select(label="Sensor Mode", options=["Flow", "Volume"], description="The mode of the sensor"),
     Property.Select(label="Display", options=["Total volume", "Flow, unit/s"], description="What to display"),
     Property.Select(label="Simulation Mode", options=["True", "False"], description="Enable simulation mode"),
-    Property.Number(label="Alpha", configurable=True, description="Smoothing factor for EMA (0 < alpha <= 1)", default_value=0.2)
+    Property.Number(label="Alpha", configurable=True, description="Smoothing factor for EMA (0 < alpha <= 1)", default_value=0.2),
+    Property.Select(label="Adaptive Rate", options=["No", "Yes"], description="Sample faster than once a second while the flow is changing"),
+    Property.Number(label="Max Sample Rate", configurable=True, description="Highest sample rate in Hz with adaptive rate", default_value=5),
+    Property.Number(label="Rate Resolution", configurable=True, description="Flow change per sample in L/min the adaptive rate aims for", default_value=0.2)
 ])
-class ADCFlowVolumeSensor(CBPiSensor):
+class ADCFlowVolumeSensor(CBPiSensor, VolumeSource):
     def __init__(self, cbpi, id, props):
         super(ADCFlowVolumeSensor, self).__init__(cbpi, id, props)
 
@@ -155,7 +167,20 @@ class ADCFlowVolumeSensor(CBPiSensor):
         self.alpha = float(props.get("Alpha", 0.2))  # Smoothing factor for EMA
         self.unit_type = props.get("Unit Type", "L")  # Unit type selection
         self.ema_flow_rate = None
-        self.total_volume = 0
+        self.fault = None
+        with loop_monitor.measure("ADCFlowVolumeSensor.recover_total"):
+            self.totalizer = Totalizer(totalizers, f"sensor:{id}")
+            self.total_volume = self.totalizer.step
+        in_bytes = 0 if self.simulation_mode else ANALOG_REPORT_BYTES
+        self.sampler = None
+        self.link_claim = None
+        if str(props.get("Adaptive Rate", "No")) == "Yes":
+            self.sampler = AdaptiveSampler(f"sensor:{id}", 1.0, float(props.get("Max Sample Rate", 5)),
+                                           float(props.get("Rate Resolution", 0.2)), in_bytes=in_bytes)
+        else:
+            self.link_claim = TelemetrixAioService.claim_link(f"sensor:{id}", 1.0, in_bytes=in_bytes)
+        if self.total_volume:
+            logger.info(f"Recovered total volume {self.total_volume:.3f} of sensor {id} from the totalizer journal")
         self.last_time = time.time()
 
         # Zero offset and polynomial coefficients (initialized)
@@ -170,7 +195,8 @@ class ADCFlowVolumeSensor(CBPiSensor):
         logger.info(f"Calibration file will be saved at: {self.calibration_file}")
 
         # Load calibration data from JSON (or create default if not found)
-        self.load_calibration_data()
+        with loop_monitor.measure("ADCFlowVolumeSensor.load_calibration_data"):
+            self.load_calibration_data()
 
     def load_calibration_data(self):
         """
@@ -245,6 +271,9 @@ class ADCFlowVolumeSensor(CBPiSensor):
         In simulation mode, returns a fake ADC value.
         """
         if self.simulation_mode:
+            simulator = TelemetrixAioService.get_simulator()
+            if simulator is not None:
+                return TelemetrixAioService.get_arduino_instance().read_analog(self.adc_pin)
             return np.random.uniform(0, 1023)  # Simulate a 10-bit ADC range
         try:
             return self.current_adc_value  # Replace this with actual ADC reading logic
@@ -252,24 +281,46 @@ class ADCFlowVolumeSensor(CBPiSensor):
             logger.error("ADC value not set by callback yet")
             return 0
 
+    async def on_start(self):
+        if not self.simulation_mode:
+            try:
+                TelemetrixAioService.claim_pins(self.cbpi.config.get, f"sensor:{self.id}", [(self.adc_pin, ANALOG)], token=self)
+            except PinConflict as e:
+                self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"sensor:{self.id}", e, token=self)
+
+    @monitored
     async def run(self):
         """
         The main loop that reads ADC values and calculates the flow rate in real-time.
         """
+        try:
+            if self.fault:
+                # The pin carries another device's signal; neither sample nor totalize it
+                await ControlScheduler.get().park(self)
+            else:
+                await self._sample_loop()
+        finally:
+            if self.sampler is not None:
+                self.sampler.close()
+            if self.link_claim is not None:
+                self.link_claim.release()
+            TelemetrixAioService.release_pins(f"sensor:{self.id}", self)
+
+    async def _sample_loop(self):
         while self.running:
             adc_value = await self.read_adc()  # Read the ADC value
             flow_rate = self.adc_to_flow(adc_value)  # Calculate the flow rate using the polynomial
 
-            # Volume calculation using the raw flow rate (without smoothing)
             current_time = time.time()
             time_diff = current_time - self.last_time
-            volume_increment = flow_rate * (time_diff / 60)  # Convert to liters/minute
 
-            # Apply smoothing (EMA) to the total volume
-            self.update_ema(volume_increment)
+            # Smooth the rate, not the increment: the sample interval changes with the flow, and
+            # averaging increments of different lengths would gain or lose volume at every change
+            self.update_ema(flow_rate)
 
-            # Update total volume with the smoothed increment
-            self.total_volume += self.ema_flow_rate
+            # Update total volume with the smoothed rate over this sample's interval
+            self.totalizer.add(self.ema_flow_rate * (time_diff / 60))  # Convert from liters/minute
+            self.total_volume = self.totalizer.step
 
             # Set value to be displayed based on the mode (Flow or Volume)
             if self.sensor_mode == "Flow":
@@ -279,17 +330,51 @@ class ADCFlowVolumeSensor(CBPiSensor):
 
             # Push the updated value to the system
             self.push_update(self.value)
+            self.notify_volume(self.total_volume, flow_rate / 60)
+            history.record(f"sensor:{self.id}", self.value)
             self.last_time = current_time
-            await asyncio.sleep(1)
+            if self.sampler is not None:
+                self.sampler.update(current_time, flow_rate)
+            await asyncio.sleep(self.sampler.interval if self.sampler is not None else 1)
+
+    @action(key="ResetBatchTotal", parameters=[])
+    async def reset_batch_total(self, **kwargs):
+        """
+        Start a new batch: resets the batch and step totals, the lifetime total keeps counting.
+        """
+        self.totalizer.reset_batch()
+        self.reset()
+
+    @action(key="BurstCapture", parameters=[Property.Number(label="Seconds", configurable=True, default_value=5,
+                                                            description="Capture length at maximum report rate")])
+    async def burst_capture(self, Seconds=5, **kwargs):
+        """
+        Sample the ADC pin at the board's maximum rate and store statistics and PSD of the burst.
+        """
+        if self.fault:
+            logger.warning(f"Burst capture not started for sensor {self.id}: {self.fault}")
+            return
+        self._burst_task = asyncio.create_task(run_burst(self.cbpi, self.id, self.adc_pin, float(Seconds)))
+
+    def reset(self):
+        """
+        Reset the total volume to 0.
+        """
+        self.totalizer.reset_step()
+        self.total_volume = 0
+        self.ema_flow_rate = None
+        if self.sensor_mode != "Flow":
+            self.value = 0
+            self.push_update(self.value)
 
-    def update_ema(self, volume_increment):
+    def update_ema(self, flow_rate):
         """
-        Update the Exponential Moving Average (EMA) for volume smoothing.
+        Update the Exponential Moving Average (EMA) of the flow rate used for the volume.
         """
         if self.ema_flow_rate is None:
-            self.ema_flow_rate = volume_increment  # Initialize with the first value
+            self.ema_flow_rate = flow_rate  # Initialize with the first value
         else:
-            self.ema_flow_rate = self.alpha * volume_increment + (1 - self.alpha) * self.ema_flow_rate
+            self.ema_flow_rate = self.alpha * flow_rate + (1 - self.alpha) * self.ema_flow_rate
 
 
 @parameters([
@@ -298,7 +383,7 @@ class ADCFlowVolumeSensor(CBPiSensor):
     Property.Select(label="Volume Unit", options=['Liters', 'Gallons'], description="Select the unit of volume output."),
     Property.Number(label="Alpha", configurable=True, default_value=0.2, description="Smoothing factor for EMA (0 < Alpha <= 1)")
 ])
-class VolumeFromFlowSensor(CBPiSensor):
+class VolumeFromFlowSensor(CBPiSensor, VolumeSource):
 
     def __init__(self, cbpi, id, props):
         super(VolumeFromFlowSensor, self).__init__(cbpi, id, props)
@@ -308,10 +393,13 @@ class VolumeFromFlowSensor(CBPiSensor):
         self.volume_unit = self.props.get("Volume Unit", "Liters")
         self.alpha = float(self.props.get("Alpha", 0.2))  # Smoothing factor for EMA
         self.ema_flow_rate = None
-        self.total_volume = 0
+        with loop_monitor.measure("VolumeFromFlowSensor.recover_total"):
+            self.totalizer = Totalizer(totalizers, f"sensor:{id}")
+            self.total_volume = self.totalizer.step
         self.last_time = time.time()  # Initialize last time
         self.flow_conversion_factor = 3.78541 if self.flow_unit == 'Gallons' else 1
         self.volume_conversion_factor = 0.264172 if self.volume_unit == 'Gallons' else 1
+        self.value = round(self.total_volume * self.volume_conversion_factor, 2)
         
         logging.info(f"VolumeFromFlowSensor initialized with sensor: {self.sensor}, flow unit: {self.flow_unit}, volume unit: {self.volume_unit}, alpha: {self.alpha}")
 
@@ -326,14 +414,24 @@ class VolumeFromFlowSensor(CBPiSensor):
         self.reset()
         logging.info("Flow volume has been reset to 0.")
 
+    @action(key="ResetBatchTotal", parameters=[])
+    async def reset_batch_total(self, **kwargs):
+        """
+        Start a new batch: resets the batch and step totals, the lifetime total keeps counting.
+        """
+        self.totalizer.reset_batch()
+        self.reset()
+
     def reset(self):
         """
         Resets the volume to 0 and updates the state.
         """
+        self.totalizer.reset_step()
         self.total_volume = 0
         self.value = 0
         self.push_update(self.value)
 
+    @monitored
     async def run(self):
         while self.running:
             try:
@@ -349,10 +447,14 @@ class VolumeFromFlowSensor(CBPiSensor):
                         current_time = time.time()
                         time_diff = current_time - self.last_time
                         volume_increment = self.ema_flow_rate * (time_diff / 60)
-                        self.total_volume += volume_increment
+                        self.totalizer.add(volume_increment)
+                        self.total_volume = self.totalizer.step
                         self.last_time = current_time
 
                         self.value = round(self.total_volume * self.volume_conversion_factor, 2)  # Convert volume unit if necessary
+                        self.notify_volume(self.total_volume * self.volume_conversion_factor,
+                                           self.ema_flow_rate * self.volume_conversion_factor / 60)
+                        history.record(f"sensor:{self.id}", self.value)
                     else:
                         logging.info(f"No value fetched from the selected flow sensor (ID: {self.sensor}), check connection and setup")
                 else:
@@ -376,21 +478,29 @@ class VolumeFromFlowSensor(CBPiSensor):
     Property.Number(label="Volume", description="Volume limit for this step", configurable=True),
     Property.Actor(label="Actor", description="Actor to switch media flow on and off"),
     Property.Sensor(label="Sensor"),
-    Property.Select(label="Reset", options=["Yes", "No"], description="Reset Flowmeter when done")
+    Property.Select(label="Reset", options=["Yes", "No"], description="Reset Flowmeter when done"),
+    Property.Number(label="Trim Fraction", configurable=True, default_value=0, description="Fraction of the volume pumped at full speed before switching to the trim rate (0 = single stage)"),
+    Property.Number(label="Trim Output", configurable=True, default_value=60, description="Pump output during the trim stage [0-MaxOutput]")
 ])
 class FlowStep(CBPiStep):
-    async def on_timer_done(self, timer):
-        self.summary = ""
-        self.cbpi.notify(self.name, f'Step finished. Transferred {round(self.current_volume, 2)} {self.unit}.', NotificationType.SUCCESS)
-        if self.resetsensor == "Yes" and self.sensor and self.sensor.instance:
-            await self.sensor.instance.reset()
+    async def on_transfer_update(self, volume, flow):
+        self.current_volume = volume
+        self.summary = f"Volume: {round(volume, 2)}"
+        await self.push_update()
 
+    async def stop_flow(self):
         if self.actor is not None:
             await self.actor_off(self.actor)
-        await self.next()
 
-    async def on_timer_update(self, timer, seconds):
-        await self.push_update()
+    async def start_trim(self):
+        await set_actor_output(self.cbpi, self.actor, self.trim_output)
+
+    async def on_transfer_done(self, volume, overshoot):
+        self.summary = ""
+        self.cbpi.notify(self.name, f'Step finished. Transferred {round(volume, 2)} {self.unit}.', NotificationType.SUCCESS)
+        if self.resetsensor == "Yes" and self.sensor and self.sensor.instance:
+            await reset_volume_sensor(self.sensor.instance)
+        await self.next()
 
     async def on_start(self):
         self.unit = self.cbpi.config.get("flowunit", "L")
@@ -399,6 +509,10 @@ class FlowStep(CBPiStep):
         self.flowsensor = self.props.get("Sensor", None)
         self.sensor = self.get_sensor(self.flowsensor)
         self.resetsensor = self.props.get("Reset", "Yes")
+        self.trim_fraction = float(self.props.get("Trim Fraction", 0) or 0)
+        self.trim_output = float(self.props.get("Trim Output", 60) or 0)
+        self.current_volume = 0
+        self.transfer = None
 
         if not self.sensor:
             logger.error(f"Sensor {self.flowsensor} not found.")
@@ -407,40 +521,45 @@ class FlowStep(CBPiStep):
             return
 
         if self.sensor.instance:
-            await self.sensor.instance.reset()
-
-        if self.timer is None:
-            self.timer = Timer(1, on_update=self.on_timer_update, on_done=self.on_timer_done)
+            await reset_volume_sensor(self.sensor.instance)
 
     async def on_stop(self):
-        if self.timer is not None:
-            await self.timer.stop()
+        if self.transfer is not None:
+            self.transfer.cancel()
         self.summary = ""
         if self.actor is not None:
             await self.actor_off(self.actor)
         await self.push_update()
 
     async def reset(self):
-        self.timer = Timer(1, on_update=self.on_timer_update, on_done=self.on_timer_done)
+        if self.transfer is not None:
+            self.transfer.cancel()
         if self.actor is not None:
             await self.actor_off(self.actor)
         if self.resetsensor == "Yes" and self.sensor and self.sensor.instance:
-            await self.sensor.instance.reset()
+            await reset_volume_sensor(self.sensor.instance)
 
+    @monitored
     async def run(self):
         if self.actor is not None:
             await self.actor_on(self.actor)
         self.summary = ""
         await self.push_update()
-        while self.running:
-            self.current_volume = self.get_sensor_value(self.flowsensor).get("value")
-            self.summary = f"Volume: {self.current_volume}"
-            await self.push_update()
-
-            if self.current_volume >= self.target_volume and not self.timer.is_running:
-                self.timer.start()
-                self.timer.is_running = True
-
-            await asyncio.sleep(0.2)
+        two_stage = self.actor is not None and 0 < self.trim_fraction < 1
+        trim_ratio = 0.25
+        if two_stage:
+            # Fast stage runs the pump at its maximum output
+            instance = getattr(self.cbpi.actor.find_by_id(self.actor), "instance", None)
+            maxoutput = float(getattr(instance, "maxoutput", 100) or 100)
+            trim_ratio = min(self.trim_output / maxoutput, 1.0)
+            await set_actor_output(self.cbpi, self.actor, maxoutput)
+        # The cutoff is driven by the volume readings themselves, see VolumeTransfer
+        self.transfer = VolumeTransfer(self.cbpi, self.actor, self.flowsensor, self.target_volume,
+                                       self.stop_flow, self.on_transfer_done, self.on_transfer_update,
+                                       trim=self.start_trim if two_stage else None,
+                                       trim_fraction=self.trim_fraction, trim_ratio=trim_ratio)
+        self.transfer.start()
+        await ControlScheduler.get().park(self)
+        self.transfer.cancel()
 
         return StepResult.DONE
@@ -1,10 +1,25 @@
 import asyncio
 import logging
+import os
+import time
 from typing import Optional
 from telemetrix_aio import telemetrix_aio
+from cbpi.api.dataclasses import NotificationType
+
+from .boardProfiles import DEFAULT_BOARD, PinClaims, get_profile, select_options
+from .commandLanes import EMERGENCY, CommandLanes, classify, command_lane, lane_pin
+from .heartbeat import Heartbeat
+from .linkBudget import LOOP_BACK_BYTES, LinkBudget
+from .linkStats import LinkStats, command_key
+from .plantSimulator import PlantSimulator, SimulatedBoard, VirtualClock
+from .serialRecorder import ReplayBoard, SerialRecorder, SerialReplay
 
 logger = logging.getLogger(__name__)
 
+# Telemetrix4Arduino command identifiers used for raw batch writes
+DIGITAL_WRITE = 2
+ANALOG_WRITE = 3
+
 log_levels = {
     'DEBUG': logging.DEBUG,
     'INFO': logging.INFO,
@@ -18,6 +33,27 @@ class TelemetrixAioService:
     _initializing: bool = False
     _initialized: bool = False
     cbpi_instance = None
+    simulator: Optional[PlantSimulator] = None
+
+    # Default pin wiring of the simulated plant, matches the pins used on the test rig
+    simulator_wiring = {"pump": 9, "flow_adc": 0, "source_level_adc": 1, "destination_level_adc": 2,
+                        "source_temperature": 4, "outlet_temperature": 5}
+
+    # Observers of the raw serial traffic, see add_tap()
+    _taps = []
+    recorder: Optional[SerialRecorder] = None
+    link_stats = LinkStats()
+    lanes: Optional[CommandLanes] = None
+    heartbeat: Optional[Heartbeat] = None
+    link_budget = LinkBudget()
+    pin_claims: Optional[PinClaims] = None
+
+    # Safe output per pin, {pin: (analog, value)}, see register_failsafe()
+    failsafes = {}
+    # Devices that could not start because of a pin conflict, {owner: (token, message)}, see pin_fault()
+    pin_faults = {}
+    # Last value written to each output pin, {pin: ("digital" | "analog", value)}, see restore_outputs()
+    outputs = {}
 
     @staticmethod
     async def initialize(config_getter):
@@ -26,13 +62,31 @@ class TelemetrixAioService:
             log_level_str = config_getter('arduinogpio_log_level', 'Info')
             log_level = TelemetrixAioService.convert_log_level(log_level_str)
             logger.setLevel(log_level)
+            # Telemetrix4Arduino always runs its serial port at 115200 baud
+            TelemetrixAioService.link_budget.configure(
+                115200, float(config_getter('arduinogpio_link_headroom', 0.7)))
 
-            TelemetrixAioService.Arduino = telemetrix_aio.TelemetrixAIO(autostart=False)
+            if str(config_getter('arduinogpio_simulator', 'No')).lower() in ('yes', 'true'):
+                speed = float(config_getter('arduinogpio_simulator_speed', 100))
+                await TelemetrixAioService.attach_simulator(PlantSimulator(clock=VirtualClock(speed=speed)))
+                TelemetrixAioService._initializing = False
+                return
+
+            # An explicit port skips auto-detection, e.g. to point at a TelemetrixEmulator pty
+            com_port = config_getter('arduinogpio_com_port', None) or None
+            TelemetrixAioService.Arduino = telemetrix_aio.TelemetrixAIO(com_port=com_port, autostart=False,
+                                                                       close_loop_on_shutdown=False)
+            TelemetrixAioService._install_hooks(TelemetrixAioService.Arduino,
+                                                int(config_getter('arduinogpio_lane_depth', 32)))
+
+            if str(config_getter('arduinogpio_record', 'No')).lower() in ('yes', 'true'):
+                TelemetrixAioService.start_recording()
             try:
                 await TelemetrixAioService.Arduino.start_aio()
                 logger.info("Arduino GPIO initialized successfully.")
                 logger.info(f"Connected to Arduino on port: {TelemetrixAioService.Arduino.serial_port}")
                 TelemetrixAioService._initialized = True
+                await TelemetrixAioService.start_heartbeat(config_getter)
             except Exception as e:
                 logger.error(f"Error initializing Arduino GPIO: {e}")
                 TelemetrixAioService.Arduino = None
@@ -42,6 +96,302 @@ class TelemetrixAioService:
         else:
             logger.info("Arduino GPIO instance already exists or is initializing.")
 
+    @staticmethod
+    async def attach_simulator(plant, wiring=None):
+        """
+        Replace the serial board with a SimulatedBoard driven by `plant`. Actors and sensors keep
+        calling get_arduino_instance() and never notice the difference.
+        """
+        board = SimulatedBoard(plant, wiring or TelemetrixAioService.simulator_wiring)
+        await board.start_aio()
+        TelemetrixAioService.simulator = plant
+        TelemetrixAioService.Arduino = board
+        TelemetrixAioService._initialized = True
+        logger.info(f"Arduino GPIO running against the plant simulator at {plant.clock.speed}x real time.")
+        return board
+
+    @staticmethod
+    def _install_hooks(board, lane_depth=32):
+        """
+        Route every outbound command and every inbound report of a TelemetrixAIO instance through
+        the service so registered taps see the raw serial traffic. Must run before start_aio() so
+        the handshake is captured too.
+
+        Outbound commands are queued on the priority lanes of commandLanes.CommandLanes; taps see
+        them at the moment they are actually written, in wire order.
+        """
+        original_send = board._send_command
+        lanes = TelemetrixAioService.lanes = CommandLanes(lane_depth)
+
+        async def send_command(command):
+            stats = TelemetrixAioService.link_stats
+            key, size = command_key(command), len(command)
+
+            async def transmit():
+                for tap in TelemetrixAioService._taps:
+                    tap.on_command(command)
+                await original_send(command)
+                TelemetrixAioService._record_output(command)
+
+            started = stats.command_started()
+            try:
+                await lanes.submit(classify(command), transmit, lane_pin(command))
+            finally:
+                stats.command_finished(key, size, started)
+
+        def wrap_report(report, handler):
+            async def dispatch(data):
+                TelemetrixAioService.link_stats.on_report(report, data)
+                for tap in TelemetrixAioService._taps:
+                    tap.on_report(report, data)
+                await handler(data)
+            return dispatch
+
+        board._send_command = send_command
+        for report, handler in list(board.report_dispatch.items()):
+            board.report_dispatch[report] = wrap_report(report, handler)
+
+    @staticmethod
+    async def write_batch(writes):
+        """
+        Apply several pin writes as one burst. `writes` is a list of ("digital" | "analog", pin, value).
+
+        Telemetrix4Arduino has no multi-pin command, so on a serial board all commands are packed
+        into a single buffer and handed to the port in one write; the board then executes them
+        back to back within a few hundred microseconds instead of one round trip each. Other
+        boards (simulator, replay) get the writes one after the other.
+        """
+        board = TelemetrixAioService.Arduino
+        if board is None:
+            raise RuntimeError("Arduino service not available")
+
+        commands = []
+        for kind, pin, value in writes:
+            if kind == "analog":
+                commands.append([ANALOG_WRITE, pin, value >> 8, value & 0xff])
+            else:
+                commands.append([DIGITAL_WRITE, pin, value])
+
+        serial_port = getattr(board, "serial_port", None)
+        if not hasattr(serial_port, "write") or getattr(board, "ip_address", None):
+            for kind, pin, value in writes:
+                if kind == "analog":
+                    await board.analog_write(pin, value)
+                else:
+                    await board.digital_write(pin, value)
+            return len(commands)
+
+        stats = TelemetrixAioService.link_stats
+        lanes = TelemetrixAioService.lanes
+
+        async def transmit():
+            for command in commands:
+                for tap in TelemetrixAioService._taps:
+                    tap.on_command(command)
+            await serial_port.write(b"".join(bytes([len(command)] + command) for command in commands))
+            for command in commands:
+                TelemetrixAioService._record_output(command)
+
+        started = [stats.command_started() for _ in commands]
+        try:
+            if lanes is None:
+                await transmit()
+            else:
+                for _, pin, _ in writes:
+                    lanes.discard_control(pin)
+                # A batch travels on the most urgent lane of any command in it
+                await lanes.submit(min(classify(command) for command in commands), transmit)
+        finally:
+            for command, start in zip(commands, started):
+                stats.command_finished(command_key(command), len(command), start)
+        return len(commands)
+
+    @staticmethod
+    async def start_heartbeat(config_getter):
+        """Start the loop-back heartbeat; arduinogpio_heartbeat_interval 0 disables it."""
+        interval = float(config_getter('arduinogpio_heartbeat_interval', 1.0))
+        if interval <= 0:
+            return
+        TelemetrixAioService.heartbeat = Heartbeat(
+            TelemetrixAioService.Arduino, TelemetrixAioService.failsafes, interval,
+            timeout=float(config_getter('arduinogpio_failsafe_timeout', 3.0)),
+            failsafe_firmware=str(config_getter('arduinogpio_failsafe_firmware', 'No')).lower() in ('yes', 'true'),
+            on_restored=TelemetrixAioService.restore_outputs)
+        TelemetrixAioService.claim_link("heartbeat", 1.0 / interval, LOOP_BACK_BYTES, LOOP_BACK_BYTES)
+        try:
+            await TelemetrixAioService.heartbeat.start()
+        except Exception as e:
+            logger.error(f"Failed to start heartbeat: {e}")
+
+    @staticmethod
+    def _record_output(command):
+        if command[0] == DIGITAL_WRITE and len(command) > 2:
+            TelemetrixAioService.outputs[command[1]] = ("digital", command[2])
+        elif command[0] == ANALOG_WRITE and len(command) > 3:
+            TelemetrixAioService.outputs[command[1]] = ("analog", (command[2] << 8) + command[3])
+
+    @staticmethod
+    async def restore_outputs():
+        """
+        Write the last commanded value of every failsafe pin again. Called when heartbeats come
+        back after an outage: the board may have driven those pins to their safe values in the
+        meantime, while actors and ramps still hold (and skip re-writing) the values they sent.
+        """
+        writes = [(kind, pin, value) for pin, (kind, value) in TelemetrixAioService.outputs.items()
+                  if pin in TelemetrixAioService.failsafes]
+        if not writes:
+            return
+        try:
+            with command_lane(EMERGENCY):
+                await TelemetrixAioService.write_batch(writes)
+            logger.info(f"Restored {len(writes)} outputs after the link came back")
+        except Exception as e:
+            logger.error(f"Failed to restore outputs: {e}")
+
+    @staticmethod
+    def claim_link(name, rate, out_bytes=0, in_bytes=0, max_rate=None):
+        """
+        Reserve serial bandwidth for `rate` events per second of `out_bytes` sent and `in_bytes`
+        received; a claim with max_rate is elastic, see linkBudget.LinkBudget. Claiming an existing
+        name replaces that claim. Logs a warning when the link would be oversubscribed.
+        """
+        return TelemetrixAioService.link_budget.claim(name, rate, out_bytes, in_bytes, max_rate)
+
+    @staticmethod
+    def get_pin_claims(config_getter=None):
+        """
+        Claim table of the board selected by `arduinogpio_board`, created on first use. Selecting
+        the board also refills the pin dropdowns with the pins of that board.
+        """
+        if TelemetrixAioService.pin_claims is None:
+            name = config_getter('arduinogpio_board', DEFAULT_BOARD) if config_getter is not None else DEFAULT_BOARD
+            profile = get_profile(name or DEFAULT_BOARD)
+            select_options(profile)
+            TelemetrixAioService.pin_claims = PinClaims(profile)
+            logger.info(f"Using the {profile.name} pin map")
+        return TelemetrixAioService.pin_claims
+
+    @staticmethod
+    def claim_pins(config_getter, owner, pins, share=None, token=None):
+        """
+        Reserve `pins`, a list of (pin, capability), for `owner` before bringing a device up.
+        Raises boardProfiles.PinConflict, without reserving anything, when a pin does not exist
+        on the board, lacks the capability or is held by another device.
+        """
+        TelemetrixAioService.get_pin_claims(config_getter).claim(owner, pins, share, token)
+        TelemetrixAioService.pin_faults.pop(owner, None)
+
+    @staticmethod
+    def release_pins(owner, token=None):
+        fault = TelemetrixAioService.pin_faults.get(owner)
+        if fault is not None and (token is None or fault[0] is token):
+            del TelemetrixAioService.pin_faults[owner]
+        if TelemetrixAioService.pin_claims is not None:
+            TelemetrixAioService.pin_claims.release(owner, token)
+
+    @staticmethod
+    def pin_fault(cbpi, owner, error, token=None):
+        """
+        Record that `owner` ("actor:<id>" or "sensor:<id>") could not claim its pins and notify the
+        user. The device is expected to stay faulted: it writes no pin and does not sample until it
+        is started again. Returns the message to keep on the device.
+        """
+        message = f"Pin conflict: {error}"
+        TelemetrixAioService.pin_faults[owner] = (token, message)
+        logger.error(message)
+        kind, _, device_id = owner.partition(":")
+        manager = getattr(cbpi, kind, None)
+        device = manager.find_by_id(device_id) if manager is not None else None
+        cbpi.notify(device.name if device is not None else owner, f"{message}. The device was not started.",
+                    NotificationType.ERROR)
+        return message
+
+    @staticmethod
+    def pin_snapshot(config_getter=None):
+        """Pin map and claims of the board plus the devices that failed to claim their pins."""
+        snapshot = TelemetrixAioService.get_pin_claims(config_getter).snapshot()
+        snapshot["faults"] = {owner: message for owner, (_, message) in TelemetrixAioService.pin_faults.items()}
+        return snapshot
+
+    @staticmethod
+    async def register_failsafe(pin, value, analog=False):
+        """
+        Declare the safe output of `pin`. The board switches to it by itself when heartbeats stop
+        (failsafe firmware only) and shutdown() writes it on a clean stop.
+        """
+        TelemetrixAioService.failsafes[pin] = (analog, int(value))
+        heartbeat = TelemetrixAioService.heartbeat
+        if heartbeat is not None and heartbeat.active:
+            try:
+                await heartbeat.send_failsafe(pin)
+            except Exception as e:
+                logger.error(f"Failed to send failsafe for pin {pin}: {e}")
+
+    @staticmethod
+    def add_tap(tap):
+        """Register an object with on_command(command) and on_report(report, data) methods."""
+        if tap not in TelemetrixAioService._taps:
+            TelemetrixAioService._taps.append(tap)
+
+    @staticmethod
+    def remove_tap(tap):
+        if tap in TelemetrixAioService._taps:
+            TelemetrixAioService._taps.remove(tap)
+
+    @staticmethod
+    def start_recording(path=None):
+        """Start writing the serial traffic to `path`, default recordings/<timestamp>.tlx in the plugin."""
+        TelemetrixAioService.stop_recording()
+        if path is None:
+            directory = os.path.join(os.path.dirname(__file__), 'recordings')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, time.strftime('%Y%m%d-%H%M%S') + '.tlx')
+        TelemetrixAioService.recorder = SerialRecorder(path)
+        TelemetrixAioService.add_tap(TelemetrixAioService.recorder)
+        logger.info(f"Recording serial traffic to {path}")
+        return path
+
+    @staticmethod
+    def stop_recording():
+        recorder = TelemetrixAioService.recorder
+        if recorder is not None:
+            TelemetrixAioService.remove_tap(recorder)
+            recorder.close()
+            TelemetrixAioService.recorder = None
+
+    @staticmethod
+    async def attach_replay(path, speed=50.0):
+        """
+        Replace the board with a ReplayBoard and feed the reports recorded in `path` back into the
+        sensors. Returns the board, whose `commands` list holds what the actors sent during replay.
+        """
+        board = ReplayBoard()
+        TelemetrixAioService.Arduino = board
+        TelemetrixAioService._initialized = True
+        replay = SerialReplay(path, speed)
+        board.task = asyncio.create_task(replay.run(board))
+        logger.info(f"Replaying serial recording {path} at {speed}x.")
+        return board
+
+    @staticmethod
+    def get_link_stats():
+        """Snapshot of per-command latency, report ages, link throughput and transmit lane queues."""
+        snapshot = TelemetrixAioService.link_stats.snapshot()
+        if TelemetrixAioService.lanes is not None:
+            snapshot["lanes"] = TelemetrixAioService.lanes.snapshot()
+        if TelemetrixAioService.heartbeat is not None:
+            snapshot["heartbeat"] = TelemetrixAioService.heartbeat.snapshot()
+        snapshot["budget"] = TelemetrixAioService.link_budget.snapshot()
+        return snapshot
+
+    @staticmethod
+    def reset_link_stats():
+        TelemetrixAioService.link_stats = LinkStats()
+
+    @staticmethod
+    def get_simulator():
+        return TelemetrixAioService.simulator
+
     @staticmethod
     def is_initialized():
         return TelemetrixAioService._initialized
@@ -51,14 +401,39 @@ class TelemetrixAioService:
         return log_levels.get(log_level_str.upper(), logging.INFO)
 
     @staticmethod
-    async def shutdown():
+    async def shutdown(safe_writes=None, deadline=2.0):
+        """
+        Stop the board. `safe_writes` ([(kind, pin, value)], see write_batch()) are sent first as
+        one emergency batch; then the transmit lanes get until `deadline` seconds to drain before
+        the port is closed, so a hung link cannot block CraftBeerPi from stopping.
+        """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + deadline
+        if TelemetrixAioService.heartbeat is not None:
+            TelemetrixAioService.heartbeat.stop()
+            TelemetrixAioService.heartbeat = None
         if TelemetrixAioService.Arduino is not None:
+            if safe_writes:
+                try:
+                    with command_lane(EMERGENCY):
+                        await asyncio.wait_for(TelemetrixAioService.write_batch(safe_writes), end - loop.time())
+                    logger.info(f"Wrote safe values to {len(safe_writes)} pins.")
+                except Exception as e:
+                    logger.error(f"Failed to write safe values on shutdown: {e!r}")
+            lanes = TelemetrixAioService.lanes
+            if lanes is not None and not await lanes.drain(end - loop.time()):
+                logger.warning("Transmit queues not drained before the shutdown deadline.")
             try:
-                await TelemetrixAioService.Arduino.shutdown()
+                await asyncio.wait_for(TelemetrixAioService.Arduino.shutdown(), max(end - loop.time(), 0.5))
                 logger.info("Arduino GPIO shut down successfully.")
-                TelemetrixAioService._initialized = False
             except Exception as e:
-                logger.error(f"Error shutting down Arduino GPIO: {e}")
+                logger.error(f"Error shutting down Arduino GPIO: {e!r}")
+            finally:
+                if lanes is not None:
+                    lanes.stop()
+                TelemetrixAioService.outputs.clear()
+                TelemetrixAioService._initialized = False
+        TelemetrixAioService.stop_recording()
 
     @staticmethod
     def get_arduino_instance():
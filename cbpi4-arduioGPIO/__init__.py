@@ -1,14 +1,29 @@
 import asyncio
 import logging
-from cbpi.api import CBPiActor, CBPiExtension, Property, action, parameters
+from aiohttp import web
+from cbpi.api import CBPiActor, CBPiExtension, Property, action, parameters, request_mapping
+from cbpi.api.config import ConfigType
 from .TelemetrixAioService import TelemetrixAioService
+from .boardProfiles import BOARD_PROFILES, DEFAULT_BOARD, DIGITAL, PWM, PinConflict, pin_options
+from .actorUpdates import ActorUpdateCoalescer
+from .commandLanes import EMERGENCY, command_lane
+from .linkBudget import DIGITAL_WRITE_BYTES
+from .controlScheduler import ControlScheduler
+from .loopMonitor import loop_monitor, monitored
+from .outputRamp import OutputRamp
+from .historyQuery import history_service
+from .timeSeries import history
+from .totalizer import totalizers
+from .burstCapture import bursts, shutdown_executor
+from .actorGroup import ArduinoActorGroup
 from .FlowMeters import ADCFlowVolumeSensor, FlowStep, Flowmeter_Config ,VolumeFromFlowSensor # Import the flow meter classes
 
 from .arduinoPWMpump import PumpActor,ardunoPumpVolumeStep,arduinoPumpCoolStep,SimplePumpActor
 
 
 
-from .pressureSensor import PressureSensor ,FlowFromVolumeSensor
+from .pressureSensor import PressureSensor ,FlowFromVolumeSensor, ADS1115LevelSensor
+from .temperatureSensors import DS18B20Sensor, DHTSensor, temperatures
 
 
 
@@ -16,22 +31,109 @@ from .pressureSensor import PressureSensor ,FlowFromVolumeSensor
 
 logger = logging.getLogger(__name__)
 
-# Define Arduino types
-ArduinoTypes = {
-    "Uno": {"digital_pins": list(range(14)), "pwm_pins": [3, 5, 6, 9, 10, 11], "name": "Uno"},
-    "Nano": {"digital_pins": list(range(14)), "pwm_pins": [3, 5, 6, 9, 10, 11], "name": "Nano"},
-    "Mega": {"digital_pins": list(range(54)), "pwm_pins": [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13], "name": "Mega"}
-}
-
 class ArduinoTelemetrix(CBPiExtension):
     def __init__(self, cbpi):
         self.cbpi = cbpi
         self._task = asyncio.create_task(self.init_actor())
+        self.cbpi.register(self, "/arduinogpio")
 
     async def init_actor(self):
+        slow_ms = float(self.cbpi.config.get('arduinogpio_slow_callback_ms', 50))
+        loop_monitor.start(slow_threshold=slow_ms / 1000)
+        await self.board_config()
+        # Load the board profile and republish the plugin types with its pins in the dropdowns
+        TelemetrixAioService.get_pin_claims(self.cbpi.config.get)
+        for name, clazz in pin_types().items():
+            self.cbpi.plugin.register(name, clazz)
         await TelemetrixAioService.init_service(self.cbpi)
         await resave_and_reload_sensors_and_gpio_actors(self.cbpi)
 
+    async def board_config(self):
+        if self.cbpi.config.get("arduinogpio_board", None) is None:
+            logger.info("INIT arduinogpio_board")
+            try:
+                await self.cbpi.config.add("arduinogpio_board", DEFAULT_BOARD, type=ConfigType.SELECT,
+                                           description="Arduino board model, selects the pin map (restart required)",
+                                           source="cbpi4-arduinoGPIO",
+                                           options=[{"label": name, "value": name} for name in BOARD_PROFILES])
+            except:
+                logger.warning('Unable to update database: arduinogpio_board')
+
+    @request_mapping(path="/pins", method="GET", auth_required=False)
+    async def http_pins(self, request):
+        """Pin map of the selected board, the pins claimed by each device and devices with a pin conflict."""
+        return web.json_response(TelemetrixAioService.pin_snapshot(self.cbpi.config.get))
+
+    @request_mapping(path="/linkstats", method="GET", auth_required=False)
+    async def http_link_stats(self, request):
+        """Per-command latency histograms, throughput and report ages of the serial link."""
+        return web.json_response(TelemetrixAioService.get_link_stats())
+
+    @request_mapping(path="/loopstats", method="GET", auth_required=False)
+    async def http_loop_stats(self, request):
+        """Event-loop lag plus wakeups and CPU time of every instrumented run() loop."""
+        return web.json_response(loop_monitor.snapshot())
+
+    @request_mapping(path="/linkstats/reset", method="POST", auth_required=False)
+    async def http_reset_link_stats(self, request):
+        TelemetrixAioService.reset_link_stats()
+        return web.Response(status=204)
+
+    @request_mapping(path="/totalizers", method="GET", auth_required=False)
+    async def http_totalizers(self, request):
+        """Lifetime, batch and step totals of every volume sensor with a totalizer."""
+        totals = {}
+        for sensor in self.cbpi.sensor.data:
+            totalizer = getattr(sensor.instance, "totalizer", None)
+            if totalizer is not None:
+                totals[sensor.id] = totalizer.snapshot()
+        return web.json_response(totals)
+
+    @request_mapping(path="/temperatures", method="GET", auth_required=False)
+    async def http_temperatures(self, request):
+        """Cached board temperature readings with their age in seconds."""
+        return web.json_response(temperatures.snapshot())
+
+    @request_mapping(path="/bursts", method="GET", auth_required=False)
+    async def http_bursts(self, request):
+        """Stored burst captures; ?name=<burst> returns the statistics and PSD of one."""
+        name = request.query.get("name")
+        if name is None:
+            return web.json_response(bursts.list())
+        result = bursts.load(name)
+        if result is None:
+            return web.json_response({"error": "unknown burst"}, status=404)
+        return web.json_response(result)
+
+    @request_mapping(path="/history/sessions", method="GET", auth_required=False)
+    async def http_history_sessions(self, request):
+        """Recorded history sessions with the series index of each."""
+        sessions = {}
+        for name in history.sessions():
+            session = history.open_session(name)
+            if session is not None:
+                sessions[name] = session.index()["series"]
+        return web.json_response(sessions)
+
+    @request_mapping(path="/history/query", method="GET", auth_required=False)
+    async def http_history_query(self, request):
+        """
+        Downsampled series for charts: ?series=<name>&points=500[&session=<name>][&start=<t>][&end=<t>].
+        The session defaults to the one currently recording.
+        """
+        query = request.query
+        session = query.get("session") or (history.session.name if history.session is not None else None)
+        try:
+            start = float(query["start"]) if "start" in query else None
+            end = float(query["end"]) if "end" in query else None
+            points = int(query.get("points", 500))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        result = history_service.query(session, query.get("series"), start, end, points) if session else None
+        if result is None:
+            return web.json_response({"error": "unknown session or series"}, status=404)
+        return web.json_response(result)
+
 async def resave_and_reload_sensors_and_gpio_actors(cbpi):
     try:
         # Process GPIO Actors
@@ -63,9 +165,11 @@ async def resave_and_reload_sensors_and_gpio_actors(cbpi):
 
 
 @parameters([
-    Property.Select(label="GPIO", options=ArduinoTypes['Mega']['pwm_pins']),
+    Property.Select(label="GPIO", options=pin_options(PWM)),
     Property.Number(label="Initial Power", configurable=True, description="Initial PWM Power (0-255)", default_value=0),
-    Property.Number(label="MaxOutput", configurable=True, description="Max Output Value", default_value=255)
+    Property.Number(label="MaxOutput", configurable=True, description="Max Output Value", default_value=255),
+    Property.Number(label="Slew Rate", configurable=True, description="Maximum output change per second when ramping (0 = jump straight to target)", default_value=0),
+    Property.Select(label="Ramp Shape", options=["Linear", "S-Curve"], description="Profile of output ramps")
 ])
 class ArduinoGPIOPWMActor(CBPiActor):
     
@@ -77,6 +181,11 @@ class ArduinoGPIOPWMActor(CBPiActor):
         self.power = 0
         self.output = 0
         self.state = False
+        self.fault = None
+        self.ui_updates = ActorUpdateCoalescer.for_actor(self)
+        self.ramp = OutputRamp(self._write_output, float(self.props.get("Slew Rate", 0) or 0),
+                               s_curve=self.props.get("Ramp Shape", "Linear") == "S-Curve",
+                               name=f"ArduinoGPIOPWMActor:{self.id}:ramp")
         logger.debug(f"Initialized ArduinoGPIOPWMActor: gpio={self.gpio}, initial_power={self.initial_power}, maxoutput={self.maxoutput}")
 
    # Custom property which can be configured by the user
@@ -103,18 +212,28 @@ class ArduinoGPIOPWMActor(CBPiActor):
 
     async def on_start(self):
         board = TelemetrixAioService.get_arduino_instance()
+        try:
+            TelemetrixAioService.claim_pins(self.cbpi.config.get, f"actor:{self.id}", [(self.gpio, PWM)], token=self)
+        except PinConflict as e:
+            self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"actor:{self.id}", e, token=self)
+            return
         try:
             await board.set_pin_mode_analog_output(self.gpio)
+            await TelemetrixAioService.register_failsafe(self.gpio, 0, analog=True)
             self.power = self.initial_power
             self.output = round(self.maxoutput * self.power / 100)
             self.state = False
-            await self.cbpi.actor.actor_update(self.id, self.power)
+            await self.ui_updates.push(self.power, self.output, force=True)
             logger.info(f"PWM Actor {self.id} initialized successfully with initial power {self.initial_power}.")
         except Exception as e:
             logger.error(f"Failed to initialize PWM Actor {self.id}: {e}")
             
             
     async def on(self, power=None, output=None):
+        if self.fault:
+            logger.warning(f"PWM ACTOR {self.id} not switched on: {self.fault}")
+            return
+        was_on = self.state
         if power is not None:
             if power != self.power:
                 power = min(100, power)
@@ -128,29 +247,28 @@ class ArduinoGPIOPWMActor(CBPiActor):
         self.state = True
         pass            
         logger.info(f"PWM ACTOR {self.id} ON - GPIO {self.gpio} - Power {self.power}% - Output {self.output}")
-        board = TelemetrixAioService.get_arduino_instance()
         try:
-            await board.analog_write(self.gpio, self.output)
+            await self.ramp.move_to(self.output)
             self.state = True
-            await self.cbpi.actor.actor_update(self.id, self.power)
+            await self.ui_updates.push(self.power, self.output, force=not was_on)
         except Exception as e:
             logger.error(f"Failed to turn on PWM GPIO {self.gpio}: {e}")
 
     async def off(self):
         logger.info(f"PWM ACTOR {self.id} OFF - GPIO {self.gpio}")
-        board = TelemetrixAioService.get_arduino_instance()
         try:
-            await board.analog_write(self.gpio, 0)
+            # Stopping is never ramped
+            await self.ramp.jump_to(0)
             self.state = False
+            await self.ui_updates.push(self.power, self.output, force=True)
         except Exception as e:
             logger.error(f"Failed to turn off PWM GPIO {self.gpio}: {e}")
 
     async def set_power(self, output):
         logger.info(f"Setting power for PWM ACTOR {self.id} - GPIO {self.gpio} to {output}")
-        board = TelemetrixAioService.get_arduino_instance()
         try:
-            await board.analog_write(self.gpio, output)
-            await self.cbpi.actor.actor_update(self.id, round(100 * output / self.maxoutput))
+            await self.ramp.move_to(output)
+            await self.ui_updates.push(round(100 * output / self.maxoutput), output)
             logger.info(f"PWM Actor {self.id} power set to {output}.")
         except Exception as e:
             logger.error(f"Failed to set power for PWM GPIO {self.gpio}: {e}")
@@ -162,29 +280,60 @@ class ArduinoGPIOPWMActor(CBPiActor):
             await self.on(self.power, self.output)
         else:
             await self.off()
-        await self.cbpi.actor.actor_update(self.id,self.power, self.output)
+        await self.ui_updates.push(self.power, self.output)
         pass            
 
+    async def _write_output(self, value):
+        if self.fault:
+            # The pin belongs to another device
+            return
+        board = TelemetrixAioService.get_arduino_instance()
+        await board.analog_write(self.gpio, value)
+
     def get_state(self):
         logger.debug(f"get_state called, returning {self.state}")
         return self.state
 
+    def group_command(self, power):
+        """Pin write for ArduinoActorGroup; power is 0-100 and 0 switches the actor off."""
+        if self.fault:
+            return None
+        return ("analog", self.gpio, round(self.maxoutput * min(max(power, 0), 100) / 100))
+
+    async def group_applied(self, power):
+        was_on = self.state
+        self.state = power > 0
+        if self.state:
+            self.power = round(min(power, 100))
+            self.output = round(self.maxoutput * self.power / 100)
+        self.ramp.sync(self.output if self.state else 0)
+        await self.ui_updates.push(self.power, self.output, force=self.state != was_on)
+
+    @monitored
     async def run(self):
-        logger.debug("Entering run loop")
-        while self.running:
-            logger.debug(f"Running loop: state={self.state}, power={self.power}, output={self.output}")
-            await asyncio.sleep(1)
+        # Nothing to do periodically; park on the shared scheduler instead of waking every second
+        await ControlScheduler.get().park(self)
+        self.ramp.cancel()
+        TelemetrixAioService.release_pins(f"actor:{self.id}", self)
             
             
             
 @parameters([
-    Property.Select(label="GPIO", options=ArduinoTypes['Mega']['digital_pins']), 
-    Property.Select(label="Inverted", options=["Yes", "No"], description="No: Active on high; Yes: Active on low")
+    Property.Select(label="GPIO", options=pin_options(DIGITAL)),
+    Property.Select(label="Inverted", options=["Yes", "No"], description="No: Active on high; Yes: Active on low"),
+    Property.Select(label="Mode", options=["On/Off", "Time Proportioning"], description="Time Proportioning switches the pin on for Power% of every window"),
+    Property.Number(label="Window", configurable=True, default_value=5, description="Time proportioning window in seconds (2-10)")
 ])
 class ArduinoGPIOActor(CBPiActor):
+
+    # Pulses shorter than this are not worth switching an SSR or solenoid for
+    MIN_PULSE = 0.05
     
     async def setpower(self, Power=255, **kwargs):
-        self.power = min(max(int(Power), 0), 255)
+        if self.time_proportioning:
+            self.power = min(max(int(Power), 0), 100)
+        else:
+            self.power = min(max(int(Power), 0), 255)
         await self.set_power(self.power)
 
     def get_GPIO_state(self, state):
@@ -196,16 +345,76 @@ class ArduinoGPIOActor(CBPiActor):
     async def on_start(self):
         self.gpio = int(self.props['GPIO'])
         self.inverted = True if self.props.get("Inverted", "No") == "Yes" else False
-        self.power = 255
+        self.time_proportioning = self.props.get("Mode", "On/Off") == "Time Proportioning"
+        self.window = min(max(float(self.props.get("Window", 5)), 2), 10)
+        self.power = 100 if self.time_proportioning else 255
+        self._cycle_job = None
+        self._edge_job = None
+        self._level = None
+        self.state = False
+        self.fault = None
         board = TelemetrixAioService.get_arduino_instance()
+        try:
+            TelemetrixAioService.claim_pins(self.cbpi.config.get, f"actor:{self.id}", [(self.gpio, DIGITAL)], token=self)
+        except PinConflict as e:
+            self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"actor:{self.id}", e, token=self)
+            return
         try:
             await board.set_pin_mode_digital_output(self.gpio)
+            await TelemetrixAioService.register_failsafe(self.gpio, self.get_GPIO_state(0))
             self.state = False
             await self.cbpi.actor.actor_update(self.id, self.power)
         except Exception as e:
             logger.error(f"Failed to initialize GPIO Actor {self.id}: {e}")
 
-    async def on(self, power):
+    async def _write_level(self, level):
+        # Only touch the serial link on an actual edge
+        if level == self._level:
+            return
+        board = TelemetrixAioService.get_arduino_instance()
+        await board.digital_write(self.gpio, self.get_GPIO_state(level))
+        self._level = level
+
+    async def _window_start(self):
+        """Rising edge of a time-proportioning window; schedules the matching falling edge."""
+        start = self._cycle_job.when
+        on_time = self.window * min(max(self.power, 0), 100) / 100
+        if on_time < self.MIN_PULSE:
+            await self._write_level(0)
+            return
+        await self._write_level(1)
+        if on_time <= self.window - self.MIN_PULSE:
+            self._edge_job = ControlScheduler.get().call_at(start + on_time, self._window_end,
+                                                           name=f"ArduinoGPIOActor:{self.id}:edge")
+
+    async def _window_end(self):
+        self._edge_job = None
+        await self._write_level(0)
+
+    def _stop_cycle(self):
+        for job in (self._cycle_job, self._edge_job):
+            if job is not None:
+                job.cancel()
+        self._cycle_job = None
+        self._edge_job = None
+        TelemetrixAioService.link_budget.release_name(f"actor:{self.id}")
+
+    async def on(self, power=None):
+        if self.fault:
+            logger.warning(f"GPIO ACTOR {self.id} not switched on: {self.fault}")
+            return
+        if self.time_proportioning:
+            self.power = min(max(power if power is not None else 100, 0), 100)
+            logger.info(f"GPIO ACTOR {self.id} ON - GPIO {self.gpio} - {self.power}% of {self.window}s window")
+            self.state = True
+            if self._cycle_job is None:
+                self._cycle_job = ControlScheduler.get().every(self.window, self._window_start,
+                                                               name=f"ArduinoGPIOActor:{self.id}")
+                # One rising and one falling edge per window
+                TelemetrixAioService.claim_link(f"actor:{self.id}", 2.0 / self.window, DIGITAL_WRITE_BYTES)
+            await self.cbpi.actor.actor_update(self.id, self.power)
+            return
+
         if power is not None:
             self.power = power
         else:
@@ -220,15 +429,35 @@ class ArduinoGPIOActor(CBPiActor):
             logger.error(f"Failed to turn on GPIO GPIO {self.gpio}: {e}")
 
     async def off(self):
+        if self.fault:
+            return
         logger.info(f"GPIO ACTOR {self.id} OFF - GPIO {self.gpio}")
+        if self.time_proportioning:
+            self._stop_cycle()
+            try:
+                with command_lane(EMERGENCY):
+                    await self._write_level(0)
+            except Exception as e:
+                logger.error(f"Failed to turn off GPIO GPIO {self.gpio}: {e}")
+            self.state = False
+            return
         board = TelemetrixAioService.get_arduino_instance()
         try:
-            await board.digital_write(self.gpio, 0)
+            with command_lane(EMERGENCY):
+                await board.digital_write(self.gpio, 0)
             self.state = False
         except Exception as e:
             logger.error(f"Failed to turn off GPIO GPIO {self.gpio}: {e}")
 
     async def set_power(self, power):
+        if self.fault:
+            return
+        if self.time_proportioning:
+            # Takes effect at the start of the next window
+            self.power = min(max(int(power), 0), 100)
+            if self.state:
+                await self.cbpi.actor.actor_update(self.id, self.power)
+            return
         if self.state:
             board = TelemetrixAioService.get_arduino_instance()
             try:
@@ -240,13 +469,73 @@ class ArduinoGPIOActor(CBPiActor):
     def get_state(self):
         return self.state
 
+    def group_command(self, power):
+        """Pin write for ArduinoActorGroup, honouring Inverted; None in time proportioning mode."""
+        if self.time_proportioning or self.fault:
+            return None
+        return ("digital", self.gpio, self.get_GPIO_state(1 if power > 0 else 0))
+
+    async def group_applied(self, power):
+        if self.time_proportioning:
+            # Not batched in this mode, but keep the window cycle in step if a group applies it anyway
+            if power > 0:
+                await self.on(power)
+            else:
+                await self.off()
+                await self.cbpi.actor.actor_update(self.id, self.power)
+            return
+        self.state = power > 0
+        if self.state:
+            self.power = 255
+        await self.cbpi.actor.actor_update(self.id, self.power)
+
+    @monitored
     async def run(self):
-        while self.running:
-            await asyncio.sleep(1)
+        await ControlScheduler.get().park(self)
+        if self.time_proportioning:
+            self._stop_cycle()
+        TelemetrixAioService.release_pins(f"actor:{self.id}", self)
+
+async def shutdown_arduino(cbpi):
+    """
+    Drive every Arduino actor output to its safe state in one batch and close the board.
+    Control loops are stopped first so nothing writes a pin again after its safe value.
+    """
+    ControlScheduler.get().stop()
+    writes = {pin: ("analog" if analog else "digital", pin, value)
+              for pin, (analog, value) in TelemetrixAioService.failsafes.items()}
+    for actor in cbpi.actor.data:
+        group_command = getattr(actor.instance, "group_command", None)
+        try:
+            command = group_command(0) if group_command is not None else None
+        except AttributeError:
+            # Actor never got through on_start
+            continue
+        if command is not None:
+            writes[command[1]] = command
+    deadline = float(cbpi.config.get('arduinogpio_shutdown_deadline', 2.0))
+    await TelemetrixAioService.shutdown(list(writes.values()), deadline)
+    history.close()
+    totalizers.close()
+    shutdown_executor()
+
+def pin_types():
+    """Plugin types with pin dropdowns, registered again once the board profile is known."""
+    return {
+        "ArduinoGPIOActor": ArduinoGPIOActor,
+        "ArduinoGPIOPWMActor": ArduinoGPIOPWMActor,
+        "PumpActor": PumpActor,
+        "SimplePumpActor": SimplePumpActor,
+        "ADCFlowVolumeSensor": ADCFlowVolumeSensor,
+        "PressureSensor": PressureSensor,
+        "DS18B20Sensor": DS18B20Sensor,
+        "DHTSensor": DHTSensor,
+    }
 
 def setup(cbpi):
     cbpi.plugin.register("ArduinoGPIOActor", ArduinoGPIOActor)
     cbpi.plugin.register("ArduinoGPIOPWMActor", ArduinoGPIOPWMActor)
+    cbpi.plugin.register("ArduinoActorGroup", ArduinoActorGroup)
     cbpi.plugin.register("ArduinoTelemetrix", ArduinoTelemetrix)
     cbpi.plugin.register("Flowmeter_Config", Flowmeter_Config)  # Register Flowmeter Config
     cbpi.plugin.register("ADCFlowVolumeSensor", ADCFlowVolumeSensor)  # Register ADC Flow Volume Sensor
@@ -259,6 +548,9 @@ def setup(cbpi):
     cbpi.plugin.register("SimplePumpActor", SimplePumpActor)
     
     cbpi.plugin.register("PressureSensor", PressureSensor)
+    cbpi.plugin.register("ADS1115LevelSensor", ADS1115LevelSensor)
+    cbpi.plugin.register("DS18B20Sensor", DS18B20Sensor)
+    cbpi.plugin.register("DHTSensor", DHTSensor)
     
     cbpi.plugin.register("Volume From Flow Sensor", VolumeFromFlowSensor)
     cbpi.plugin.register("Flow From VolumeSensor", FlowFromVolumeSensor)
@@ -266,6 +558,7 @@ def setup(cbpi):
     
     
     cbpi.register_on_startup(lambda: asyncio.create_task(resave_and_reload_sensors_and_gpio_actors(cbpi)))
+    cbpi.app.on_shutdown.append(lambda app: shutdown_arduino(cbpi))
 
 
 
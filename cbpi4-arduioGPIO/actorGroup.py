@@ -0,0 +1,96 @@
+import logging
+
+from cbpi.api import CBPiActor, Property, action, parameters
+
+from .TelemetrixAioService import TelemetrixAioService
+from .commandLanes import EMERGENCY, command_lane
+from .controlScheduler import ControlScheduler
+from .loopMonitor import monitored
+
+logger = logging.getLogger(__name__)
+
+GROUP_SIZE = 6
+
+
+@parameters(
+    [Property.Actor(label=f"Actor {i}", description="Member actor of this group") for i in range(1, GROUP_SIZE + 1)]
+    + [Property.Number(label=f"Target {i}", configurable=True, default_value=100,
+                       description=f"Power [0-100] for Actor {i} when the group is on (0 = off)")
+       for i in range(1, GROUP_SIZE + 1)]
+)
+class ArduinoActorGroup(CBPiActor):
+    """
+    Switches a set of Arduino GPIO/PWM actors together.
+
+    Members that expose group_command() (ArduinoGPIOActor in On/Off mode, ArduinoGPIOPWMActor,
+    SimplePumpActor, PumpActor) are written to the board in one burst through
+    TelemetrixAioService.write_batch(), so a valve manifold changes state within a single serial
+    write instead of one round trip per actor. Any other member is switched through the actor
+    controller right after the batch.
+    """
+
+    async def on_start(self):
+        self.state = False
+        self.power = 100
+        self.members = []
+        for i in range(1, GROUP_SIZE + 1):
+            actor_id = self.props.get(f"Actor {i}")
+            if not actor_id or actor_id == self.id:
+                continue
+            self.members.append((actor_id, float(self.props.get(f"Target {i}", 100) or 0)))
+
+    async def apply(self, targets):
+        """Apply [(actor_id, power)] as one batch; power 0 switches a member off."""
+        batch, batched, others = [], [], []
+        for actor_id, power in targets:
+            actor = self.cbpi.actor.find_by_id(actor_id)
+            if actor is None or actor.instance is None:
+                logger.warning(f"Actor group {self.id}: member {actor_id} not found")
+                continue
+            group_command = getattr(actor.instance, "group_command", None)
+            command = group_command(power) if group_command is not None else None
+            if command is None:
+                others.append((actor_id, power))
+            else:
+                batch.append(command)
+                batched.append((actor.instance, power))
+
+        if batch:
+            try:
+                await TelemetrixAioService.write_batch(batch)
+            except Exception as e:
+                logger.error(f"Actor group {self.id}: batch write failed: {e}")
+                return
+            for instance, power in batched:
+                await instance.group_applied(power)
+
+        for actor_id, power in others:
+            try:
+                if power > 0:
+                    await self.cbpi.actor.on(actor_id, power)
+                else:
+                    await self.cbpi.actor.off(actor_id)
+            except Exception as e:
+                logger.error(f"Actor group {self.id}: failed to switch {actor_id}: {e}")
+        logger.info(f"Actor group {self.id}: {len(batch)} actors in one batch, {len(others)} switched individually")
+
+    @action("Apply Group", parameters=[])
+    async def apply_group(self, **kwargs):
+        await self.on()
+
+    async def on(self, power=None):
+        self.state = True
+        await self.apply(self.members)
+        await self.cbpi.actor.actor_update(self.id, self.power)
+
+    async def off(self):
+        self.state = False
+        with command_lane(EMERGENCY):
+            await self.apply([(actor_id, 0) for actor_id, _ in self.members])
+
+    def get_state(self):
+        return self.state
+
+    @monitored
+    async def run(self):
+        await ControlScheduler.get().park(self)
@@ -0,0 +1,92 @@
+import logging
+
+from .controlScheduler import ControlScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class ActorUpdateCoalescer:
+    """
+    Rate limiter for cbpi.actor.actor_update() of one actor.
+
+    Every actor_update fans out to all websocket clients and to persistence, so control loops
+    should not call it on every tick. push() sends at most one update per `min_interval` seconds
+    and drops updates whose power moved by less than `threshold` from the last one sent. The
+    newest suppressed value is flushed once the interval has passed, and force=True (used on
+    on/off transitions) sends immediately so the UI never shows a stale state.
+    """
+
+    def __init__(self, cbpi, actor_id, min_interval=1.0, threshold=1):
+        self.cbpi = cbpi
+        self.actor_id = actor_id
+        self.min_interval = min_interval
+        self.threshold = threshold
+        self.sent = 0
+        self.suppressed = 0
+        self._last_args = None
+        self._last_time = None
+        self._pending = None
+        self._flush_job = None
+
+    @classmethod
+    def for_actor(cls, actor):
+        """Build a coalescer for a CBPiActor using the plugin-wide UI update settings."""
+        config = actor.cbpi.config
+        return cls(actor.cbpi, actor.id,
+                   min_interval=float(config.get('arduinogpio_ui_update_interval', 1.0)),
+                   threshold=float(config.get('arduinogpio_ui_update_threshold', 1)))
+
+    def _changed(self, args):
+        if self._last_args is None:
+            return True
+        if len(args) != len(self._last_args):
+            return True
+        for new, old in zip(args, self._last_args):
+            if new is None or old is None:
+                if new is not old:
+                    return True
+            elif abs(new - old) >= self.threshold:
+                return True
+        return False
+
+    async def push(self, power, *extra, force=False):
+        """Queue actor_update(actor_id, power, *extra); see the class docstring for when it is sent."""
+        args = (power,) + extra
+        scheduler = ControlScheduler.get()
+        now = scheduler.time()
+
+        if not force and not self._changed(args):
+            # Back at what the UI already shows: a queued newer value would be wrong now
+            self._pending = None
+            if self._flush_job is not None:
+                self._flush_job.cancel()
+                self._flush_job = None
+            self.suppressed += 1
+            return
+        if force or self._last_time is None or now - self._last_time >= self.min_interval:
+            await self._send(args, now)
+            return
+
+        self._pending = args
+        self.suppressed += 1
+        if self._flush_job is None:
+            self._flush_job = scheduler.call_at(self._last_time + self.min_interval, self._flush,
+                                                name=f"actor_update:{self.actor_id}")
+
+    async def _flush(self):
+        self._flush_job = None
+        if self._pending is not None:
+            await self._send(self._pending, ControlScheduler.get().time())
+
+    async def _send(self, args, now):
+        self._pending = None
+        if self._flush_job is not None:
+            self._flush_job.cancel()
+            self._flush_job = None
+        self._last_args = args
+        self._last_time = now
+        self.sent += 1
+        try:
+            await self.cbpi.actor.actor_update(self.actor_id, *args)
+        except Exception as e:
+            logger.error(f"actor_update for {self.actor_id} failed: {e}")
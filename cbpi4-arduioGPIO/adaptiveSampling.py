@@ -0,0 +1,82 @@
+import logging
+import math
+
+from .TelemetrixAioService import TelemetrixAioService
+from .linkBudget import ANALOG_REPORT_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveSampler:
+    """
+    Sample rate of one sensor driven by how much its signal moves.
+
+    update() tracks exponentially weighted averages of the absolute rate of change and of the
+    standard deviation of the signal. The rate asked for is the one at which consecutive samples
+    differ by about `resolution`: |slope| / resolution, or std / resolution times the minimum rate
+    for a noisy signal that goes nowhere, clamped to [min_rate, max_rate]. Rises take effect on
+    the next sample; when the signal settles the rate decays by BACKOFF per sample, so a short
+    pause in a transfer does not drop the resolution straight away.
+
+    The rate is requested from an elastic claim on the board's LinkBudget, with `out_bytes` and
+    `in_bytes` the serial cost of one sample; the sensor samples at the rate actually granted.
+
+    For sensors that report on change, threshold() gives the matching differential: the base
+    differential at the minimum rate, shrinking in proportion as the rate goes up.
+    """
+
+    BACKOFF = 0.9
+
+    def __init__(self, name, min_rate, max_rate, resolution, out_bytes=0, in_bytes=ANALOG_REPORT_BYTES,
+                 alpha=0.3, budget=None):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.resolution = resolution
+        self.alpha = alpha
+        budget = budget if budget is not None else TelemetrixAioService.link_budget
+        self.claim = budget.claim(name, min_rate, out_bytes, in_bytes, max_rate=self.max_rate)
+        self.requested = min_rate
+        self.slope = 0.0
+        self.mean = None
+        self.variance = 0.0
+        self._last = None
+
+    def close(self):
+        self.claim.release()
+
+    def update(self, t, value):
+        if value is None:
+            return
+        value = float(value)
+        a = self.alpha
+        if self._last is not None and t > self._last[0]:
+            slope = abs(value - self._last[1]) / (t - self._last[0])
+            self.slope += a * (slope - self.slope)
+        self._last = (t, value)
+        if self.mean is None:
+            self.mean = value
+        else:
+            deviation = value - self.mean
+            self.mean += a * deviation
+            self.variance = (1 - a) * (self.variance + a * deviation * deviation)
+
+        if self.resolution > 0:
+            demand = max(self.slope / self.resolution, math.sqrt(self.variance) / self.resolution * self.min_rate)
+        else:
+            demand = self.max_rate
+        demand = min(max(demand, self.min_rate), self.max_rate)
+        self.requested = max(demand, self.requested * self.BACKOFF, self.min_rate)
+        self.claim.request(self.requested)
+
+    @property
+    def rate(self):
+        return self.claim.granted
+
+    @property
+    def interval(self):
+        return 1.0 / self.rate
+
+    def threshold(self, base):
+        """Report-on-change differential for `base` at the minimum rate, at least 1."""
+        return max(1, round(base * self.min_rate / self.rate))
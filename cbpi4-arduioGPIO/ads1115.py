@@ -0,0 +1,134 @@
+import asyncio
+import logging
+
+from .TelemetrixAioService import TelemetrixAioService
+from .controlScheduler import ControlScheduler
+from .linkBudget import I2C_READ_BYTES, I2C_REPORT_BYTES, I2C_WRITE_BYTES
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_REGISTER = 0x00
+CONFIG_REGISTER = 0x01
+
+# Full-scale range in volts -> PGA bits 11:9
+GAINS = {6.144: 0, 4.096: 1, 2.048: 2, 1.024: 3, 0.512: 4, 0.256: 5}
+# Samples per second -> DR bits 7:5
+DATA_RATES = {8: 0, 16: 1, 32: 2, 64: 3, 128: 4, 250: 5, 475: 6, 860: 7}
+
+
+def config_word(channel, gain=4.096, data_rate=128, continuous=False):
+    """ADS1115 config register for a single-ended conversion of `channel` (0-3), comparator off."""
+    word = 0x8000 if not continuous else 0x0000    # OS: start a single conversion
+    word |= (0b100 + channel) << 12                 # MUX: AINx against GND
+    word |= GAINS[gain] << 9
+    word |= (0 if continuous else 1) << 8           # MODE
+    word |= DATA_RATES[data_rate] << 5
+    word |= 0b11                                    # COMP_QUE: comparator disabled
+    return word
+
+
+class ADS1115:
+    """
+    One ADS1115 16-bit I2C ADC, shared by every sensor that reads one of its channels.
+
+    The chip has a single converter behind a 4-way input mux and its conversion register only
+    holds the latest result, so channels cannot be fetched together. With one subscribed channel
+    the chip runs in continuous mode and every poll is a single 2-byte read. With several, polling
+    is pipelined: each poll reads the result of the channel started on the previous poll and
+    immediately starts the next channel in single-shot mode, so conversions happen while the
+    host waits for the next poll and every poll costs one write and one read.
+
+    The poll rate is the sum of the subscribed channel rates, capped so every conversion has time
+    to finish, and is claimed on the board's link budget.
+    """
+
+    _chips = {}
+
+    def __init__(self, bus, address=0x48, data_rate=128):
+        self.bus = bus
+        self.address = address
+        self.data_rate = data_rate
+        self.channels = {}      # channel -> (gain, rate)
+        self.values = {}        # channel -> latest raw conversion
+        self._order = []
+        self._in_flight = None
+        self._configured = None
+        self._job = None
+        self._busy = False
+        self.errors = 0
+
+    @classmethod
+    def get(cls, bus, address=0x48, data_rate=128):
+        chip = cls._chips.get((id(bus), address))
+        if chip is None or chip.bus is not bus:
+            chip = cls._chips[(id(bus), address)] = cls(bus, address, data_rate)
+        return chip
+
+    @property
+    def name(self):
+        return f"ads1115:{self.bus.port}:0x{self.address:02x}"
+
+    def subscribe(self, channel, gain=4.096, rate=1.0):
+        self.channels[channel] = (gain, rate)
+        self._reschedule()
+
+    def unsubscribe(self, channel):
+        self.channels.pop(channel, None)
+        self.values.pop(channel, None)
+        self._reschedule()
+
+    def _reschedule(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        TelemetrixAioService.link_budget.release_name(self.name)
+        self._order = sorted(self.channels)
+        self._in_flight = None
+        self._configured = None
+        if not self._order:
+            return
+        # A conversion takes 1/data_rate; leave a margin for the round trip over the serial link
+        rate = min(sum(rate for _, rate in self.channels.values()), self.data_rate / 1.5)
+        single = len(self._order) == 1
+        TelemetrixAioService.claim_link(self.name, rate,
+                                        I2C_READ_BYTES + (0 if single else I2C_WRITE_BYTES + 3),
+                                        I2C_REPORT_BYTES + 2)
+        self._job = ControlScheduler.get().every(1.0 / rate, self._poll, name=self.name)
+
+    async def _write_config(self, channel, continuous):
+        gain, _ = self.channels[channel]
+        word = config_word(channel, gain, self.data_rate, continuous)
+        await self.bus.write(self.address, [CONFIG_REGISTER, word >> 8, word & 0xFF])
+
+    async def _read_conversion(self):
+        data = await self.bus.read(self.address, CONVERSION_REGISTER, 2)
+        raw = (data[0] << 8) | data[1]
+        return raw - 0x10000 if raw & 0x8000 else raw
+
+    async def _poll(self):
+        if self._busy or not self._order:
+            return
+        self._busy = True
+        try:
+            if len(self._order) == 1:
+                channel = self._order[0]
+                if self._configured != channel:
+                    await self._write_config(channel, continuous=True)
+                    self._configured = channel
+                    return
+                self.values[channel] = await self._read_conversion()
+            else:
+                if self._in_flight is not None:
+                    self.values[self._in_flight] = await self._read_conversion()
+                    index = (self._order.index(self._in_flight) + 1) % len(self._order)
+                else:
+                    index = 0
+                self._in_flight = self._order[index]
+                await self._write_config(self._in_flight, continuous=False)
+        except (asyncio.TimeoutError, IndexError) as e:
+            self.errors += 1
+            self._in_flight = None
+            self._configured = None
+            logger.warning(f"{self.name}: read failed ({e or 'timeout'})")
+        finally:
+            self._busy = False
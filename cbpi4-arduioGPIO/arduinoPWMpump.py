@@ -7,6 +7,16 @@ from cbpi.api.config import ConfigType
 from cbpi.api.dataclasses import NotificationAction, NotificationType
 from cbpi.api.dataclasses import Sensor, Kettle, Props
 from .TelemetrixAioService import TelemetrixAioService
+from .actorUpdates import ActorUpdateCoalescer
+from .boardProfiles import PWM, PinConflict, pin_options
+from .controlScheduler import ControlScheduler
+from .coolingModel import ExponentialFit
+from .linkBudget import ANALOG_WRITE_BYTES
+from .loopMonitor import monitored
+from .outputRamp import OutputRamp
+from .temperatureSensors import temperatures
+from .timeSeries import history
+from .volumeTransfer import VolumeTransfer, reset_volume_sensor, set_actor_output
 from .pid import PID  # Assuming pid.py is in the same directory or properly installed
 
 from .shared import flowmeter_data 
@@ -14,24 +24,21 @@ from .shared import flowmeter_data
 
 logger = logging.getLogger(__name__)
 
-ArduinoTypes = {
-    "Uno": {"digital_pins": list(range(14)), "pwm_pins": [3, 5, 6, 9, 10, 11], "name": "Uno"},
-    "Nano": {"digital_pins": list(range(14)), "pwm_pins": [3, 5, 6, 9, 10, 11], "name": "Nano"},
-    "Mega": {"digital_pins": list(range(54)), "pwm_pins": [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13], "name": "Mega"}
-}
 # Assuming the global dictionary is defined in the same module or imported
 # from your flowmeter module
 # from your_module import flowmeter_data
 
 @parameters([
-    Property.Select(label="GPIO", options=ArduinoTypes['Mega']['pwm_pins']),
+    Property.Select(label="GPIO", options=pin_options(PWM)),
     Property.Number(label="Initial Power", configurable=True, description="Initial PWM Power (0-255)", default_value=0),
     Property.Number(label="MaxOutput", configurable=True, description="Max Output Value", default_value=255),
     Property.Text(label="Flowmeter Sensor ID", configurable=True, description="Enter Flowmeter Sensor ID"),
     Property.Number("Kp", configurable=True, default_value=2.0),
     Property.Number("Ki", configurable=True, default_value=5.0),
     Property.Number("Kd", configurable=True, default_value=1.0),
-    Property.Number("Time Base", configurable=True, default_value=1.0)  # Time base in seconds
+    Property.Number("Time Base", configurable=True, default_value=1.0),  # Time base in seconds
+    Property.Number(label="Slew Rate", configurable=True, description="Maximum output change per second when ramping (0 = jump straight to target)", default_value=0),
+    Property.Select(label="Ramp Shape", options=["Linear", "S-Curve"], description="Profile of output ramps")
 ])
 class SimplePumpActor(CBPiActor):
     def __init__(self, cbpi, id, props):
@@ -48,6 +55,7 @@ class SimplePumpActor(CBPiActor):
         self.power = 0
         self.output = 0
         self.state = False
+        self.fault = None
         self.flowSet =2
         
 
@@ -57,6 +65,11 @@ class SimplePumpActor(CBPiActor):
         self.pid.setpoint = self.flowSet 
         self.pid.sample_time = self.time_base
         self.pid.output_limits = (0, self.maxoutput)
+        self._control_job = None
+        self.ui_updates = ActorUpdateCoalescer.for_actor(self)
+        self.ramp = OutputRamp(self._write_output, float(self.props.get("Slew Rate", 0) or 0),
+                               s_curve=self.props.get("Ramp Shape", "Linear") == "S-Curve",
+                               name=f"SimplePumpActor:{self.id}:ramp")
 
         logger.info(f" ******************  Initialized SimplePumpActor: gpio={self.gpio}, initial_power={self.initial_power}, maxoutput={self.maxoutput}, flowmeter_id={self.flowmeter_id}")
 
@@ -95,18 +108,28 @@ class SimplePumpActor(CBPiActor):
 
     async def on_start(self):
         board = TelemetrixAioService.get_arduino_instance()
+        try:
+            TelemetrixAioService.claim_pins(self.cbpi.config.get, f"actor:{self.id}", [(self.gpio, PWM)], token=self)
+        except PinConflict as e:
+            self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"actor:{self.id}", e, token=self)
+            return
         try:
             await board.set_pin_mode_analog_output(self.gpio)
+            await TelemetrixAioService.register_failsafe(self.gpio, 0, analog=True)
             self.power = self.initial_power
             self.output = round(self.maxoutput * self.power / 100)
             self.state = False
-            await self.cbpi.actor.actor_update(self.id, self.power)
+            await self.ui_updates.push(self.power, self.output, force=True)
             logger.info(f"PWM Actor {self.id} initialized successfully with initial power {self.initial_power}.")
         except Exception as e:
             logger.error(f"Failed to initialize PWM Actor {self.id}: {e}")
             
             
     async def on(self, power=None, output=None):
+        if self.fault:
+            logger.warning(f"PWM ACTOR {self.id} not switched on: {self.fault}")
+            return
+        was_on = self.state
         if power is not None:
             if power != self.power:
                 power = min(100, power)
@@ -120,29 +143,31 @@ class SimplePumpActor(CBPiActor):
         self.state = True
         pass            
         logger.info(f"PWM ACTOR {self.id} ON - GPIO {self.gpio} - Power {self.power}% - Output {self.output}")
-        board = TelemetrixAioService.get_arduino_instance()
         try:
-            await board.analog_write(self.gpio, self.output)
+            await self.ramp.move_to(self.output)
             self.state = True
-            await self.cbpi.actor.actor_update(self.id, self.power)
+            self._start_control()
+            # PID ticks come through here too; only the off->on transition forces an update
+            await self.ui_updates.push(self.power, self.output, force=not was_on)
         except Exception as e:
             logger.error(f"Failed to turn on PWM GPIO {self.gpio}: {e}")
 
     async def off(self):
         logger.info(f"PWM ACTOR {self.id} OFF - GPIO {self.gpio}")
-        board = TelemetrixAioService.get_arduino_instance()
+        self._stop_control()
         try:
-            await board.analog_write(self.gpio, 0)
+            # Stopping is never ramped
+            await self.ramp.jump_to(0)
             self.state = False
+            await self.ui_updates.push(self.power, self.output, force=True)
         except Exception as e:
             logger.error(f"Failed to turn off PWM GPIO {self.gpio}: {e}")
 
     async def set_power(self, output):
         logger.info(f"Setting power for PWM ACTOR {self.id} - GPIO {self.gpio} to {output}")
-        board = TelemetrixAioService.get_arduino_instance()
         try:
-            await board.analog_write(self.gpio, output)
-            await self.cbpi.actor.actor_update(self.id, round(100 * output / self.maxoutput))
+            await self.ramp.move_to(output)
+            await self.ui_updates.push(round(100 * output / self.maxoutput), output)
             logger.info(f"PWM Actor {self.id} power set to {output}.")
         except Exception as e:
             logger.error(f"Failed to set power for PWM GPIO {self.gpio}: {e}")
@@ -154,9 +179,31 @@ class SimplePumpActor(CBPiActor):
             await self.on(self.power, self.output)
         else:
             await self.off()
-        await self.cbpi.actor.actor_update(self.id,self.power, self.output)
+        await self.ui_updates.push(self.power, self.output)
         pass            
 
+    async def hold_output(self, output):
+        """Suspend the flow PID and hold a raw output until the pump is switched on or off again."""
+        if self.fault:
+            logger.warning(f"PWM ACTOR {self.id} not switched on: {self.fault}")
+            return
+        self._stop_control()
+        self.output = min(max(round(output), 0), self.maxoutput)
+        self.power = round(self.output / self.maxoutput * 100)
+        self.state = True
+        try:
+            await self.ramp.move_to(self.output)
+            await self.ui_updates.push(self.power, self.output)
+        except Exception as e:
+            logger.error(f"Failed to hold output for PWM GPIO {self.gpio}: {e}")
+
+    async def _write_output(self, value):
+        if self.fault:
+            # The pin belongs to another device
+            return
+        board = TelemetrixAioService.get_arduino_instance()
+        await board.analog_write(self.gpio, value)
+
     def get_state(self):
         logger.debug(f"get_state called, returning {self.state}")
         return self.state
@@ -187,39 +234,84 @@ class SimplePumpActor(CBPiActor):
         return output            
             
 
-    async def run(self):
-        logger.debug("Entering run loop")
+    def _start_control(self):
+        # The PID only needs ticks while the pump is on; the job is removed again in off()
+        if self._control_job is None or self._control_job.cancelled:
+            self._control_job = ControlScheduler.get().every(self.time_base, self._control_step,
+                                                             name=f"SimplePumpActor:{self.id}")
+            TelemetrixAioService.claim_link(f"actor:{self.id}", 1.0 / self.time_base, ANALOG_WRITE_BYTES)
+
+    def _stop_control(self):
+        if self._control_job is not None:
+            self._control_job.cancel()
+            self._control_job = None
+            TelemetrixAioService.link_budget.release_name(f"actor:{self.id}")
+
+    async def _control_step(self):
+        if not self.get_state():
+            return
+        setpoint = self.pid.setpoint
         flow_rate = flowmeter_data.get(self.flowmeter_id, None)
-        while self.running:
-
-            flow_rate = 5
-            setpoint = self.pid.setpoint 
-            if self.get_state():
-                flow_rate = flowmeter_data.get(self.flowmeter_id, None)
-                logger.debug(f" +++++++++++++++++++++++++++++++++++++++++++ Flow Rate--> {flow_rate} L/min")
-                pid_output = self.calculate_pid_output(float(flow_rate),float( setpoint) )
-                await self.set_output(pid_output)
-                logger.debug(f"Running loop: state={self.state}, power={self.power}, output={self.output}")
-                
-            await asyncio.sleep(1)
+        if flow_rate is None:
+            logger.warning(f"No data available for Sensor ID {self.flowmeter_id}")
+            return
+        logger.debug(f"Flow Rate--> {flow_rate} L/min")
+        pid_output = self.calculate_pid_output(float(flow_rate), float(setpoint))
+        await self.set_output(pid_output)
+        history.record(f"actor:{self.id}", flow_rate, self.output, self.pid.components)
+        logger.debug(f"Control step: state={self.state}, power={self.power}, output={self.output}")
+
+    def group_command(self, power):
+        """Pin write for ArduinoActorGroup; power is 0-100 and 0 switches the pump off."""
+        if self.fault:
+            return None
+        return ("analog", self.gpio, round(self.maxoutput * min(max(power, 0), 100) / 100))
+
+    async def group_applied(self, power):
+        was_on = self.state
+        self.state = power > 0
+        if self.state:
+            self.power = round(min(power, 100))
+            self.output = round(self.maxoutput * self.power / 100)
+            self._start_control()
+        else:
+            self._stop_control()
+        self.ramp.sync(self.output if self.state else 0)
+        await self.ui_updates.push(self.power, self.output, force=self.state != was_on)
+
+    @monitored
+    async def run(self):
+        await ControlScheduler.get().park(self)
+        self._stop_control()
+        self.ramp.cancel()
+        TelemetrixAioService.release_pins(f"actor:{self.id}", self)
             
             
 
  
 @parameters([
-    Property.Select(label="Power GPIO", options=ArduinoTypes['Mega']['digital_pins']),
+    Property.Select(label="Power GPIO", options=pin_options(PWM)),
     Property.Number("Initial Flow", configurable=True, default_value=0),
     Property.Number("Kp", configurable=True, default_value=2.0),
     Property.Number("Ki", configurable=True, default_value=5.0),
     Property.Number("Kd", configurable=True, default_value=1.0),
     Property.Number("Time Base", configurable=True, default_value=1.0),  # Time base in seconds
     Property.Number("MaxOutput", configurable=True, default_value=255),  # MaxOutput parameter for finer control
-    Property.Text(label="Flow Meter Sensor ID", configurable=True, description="Enter the ID of the Flow Meter sensor to use")  # Flow meter sensor ID
+    Property.Text(label="Flow Meter Sensor ID", configurable=True, description="Enter the ID of the Flow Meter sensor to use"),  # Flow meter sensor ID
+    Property.Number(label="Slew Rate", configurable=True, description="Maximum output change per second when ramping (0 = jump straight to target)", default_value=0),
+    Property.Select(label="Ramp Shape", options=["Linear", "S-Curve"], description="Profile of output ramps")
 ])
 class PumpActor(CBPiActor):
 
     async def on_start(self):
         self.initialized = False
+        self.state = False
+        self.fault = None
+        self._control_job = None
+        self.ui_updates = ActorUpdateCoalescer.for_actor(self)
+        self.ramp = OutputRamp(self._write_output, float(self.props.get("Slew Rate", 0) or 0),
+                               s_curve=self.props.get("Ramp Shape", "Linear") == "S-Curve",
+                               name=f"PumpActor:{self.id}:ramp")
         try:
             self.power_gpio = int(self.props.get('Power GPIO'))
             self.initial_flow = float(self.props.get('Initial Flow'))
@@ -229,12 +321,14 @@ class PumpActor(CBPiActor):
             self.time_base = float(self.props.get('Time Base'))
             self.maxoutput = int(self.props.get('MaxOutput', 255))  # Initialize MaxOutput
             self.flow_meter_sensor_id = self.props.get('Flow Meter Sensor ID')  # Get flow meter sensor ID from the text field
+            TelemetrixAioService.claim_pins(self.cbpi.config.get, f"actor:{self.id}", [(self.power_gpio, PWM)], token=self)
 
             board = TelemetrixAioService.get_arduino_instance()
             if not board:
                 raise Exception("Arduino service not available")
 
             await board.set_pin_mode_analog_output(self.power_gpio)
+            await TelemetrixAioService.register_failsafe(self.power_gpio, 0, analog=True)
 
             # Initialize the PID controller with the provided gains and setpoint
             #self.pid = PID(Kp=self.kp, Ki=self.ki, Kd=self.kd, sample_time=self.time_base, output_limits=(0, self.maxoutput))
@@ -242,10 +336,13 @@ class PumpActor(CBPiActor):
 
             self.state = False
             self.output = self.initial_flow
-            await self.cbpi.actor.actor_update(self.id, self.output)
+            await self.ui_updates.push(self.output, force=True)
 
             self.initialized = True
             logger.info(f"Pump Actor {self.id} initialized successfully on Power GPIO {self.power_gpio} with initial flow {self.initial_flow}.")
+        except PinConflict as e:
+            # Stays uninitialized, so it never writes the other device's pin
+            self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"actor:{self.id}", e, token=self)
         except Exception as e:
             logger.error(f"Failed to initialize Pump Actor {self.id}: {e}")
 
@@ -254,6 +351,7 @@ class PumpActor(CBPiActor):
             logger.error(f"Pump Actor {self.id} is not properly initialized.")
             return
 
+        was_on = self.state
         if output is not None:
             output = min(self.maxoutput, float(output))
             output = max(0, output)
@@ -264,12 +362,12 @@ class PumpActor(CBPiActor):
             self.power = round(power)
             self.output = int(self.power * self.maxoutput / 100)  # Convert power percentage to output value
 
-        board = TelemetrixAioService.get_arduino_instance()
         try:
-            # Set the PWM output to the desired level
-            await board.analog_write(self.power_gpio, self.output)
+            # Ramp the PWM output to the desired level
+            await self.ramp.move_to(self.output)
             self.state = True  # Set state to True when the pump is turned on
-            await self.cbpi.actor.actor_update(self.id, self.output)
+            self._start_control()
+            await self.ui_updates.push(self.output, force=not was_on)
             logger.info(f"Pump Actor {self.id} ON - Power GPIO {self.power_gpio} - Output {self.output}")
         except Exception as e:
             logger.error(f"Failed to turn on Pump Actor {self.id} - Power GPIO {self.power_gpio}: {e}")
@@ -280,12 +378,12 @@ class PumpActor(CBPiActor):
             return
 
         logger.info(f"Pump Actor {self.id} OFF - Power GPIO {self.power_gpio}")
-        board = TelemetrixAioService.get_arduino_instance()
+        self._stop_control()
         try:
-            # Set the PWM output to 0 to stop the pump
-            await board.analog_write(self.power_gpio, 0)
+            # Set the PWM output to 0 to stop the pump, never ramped
+            await self.ramp.jump_to(0)
             self.state = False  # Set state to False when the pump is turned off
-            await self.cbpi.actor.actor_update(self.id, 0)
+            await self.ui_updates.push(0, force=True)
         except Exception as e:
             logger.error(f"Failed to turn off Pump Actor {self.id} - Power GPIO {self.power_gpio}: {e}")
 
@@ -309,69 +407,131 @@ class PumpActor(CBPiActor):
             self.pid.setpoint = self.output  # Update PID setpoint
 
             logger.info(f"Pump Actor {self.id} Set Flow Rate - Power GPIO {self.power_gpio} - Output {self.output} / MaxOutput {self.maxoutput}")
-            board = TelemetrixAioService.get_arduino_instance()
-            
             output = self.pid(int(self.output))
-            await board.analog_write(self.power_gpio, int(self.output))
-            await self.cbpi.actor.actor_update(self.id, int(self.output))
+            await self.ramp.move_to(int(self.output))
+            await self.ui_updates.push(int(self.output))
         except Exception as e:
             logger.error(f"Failed to set flow rate for Pump Actor {self.id} - Power GPIO {self.power_gpio}: {e}")
 
+    async def hold_output(self, output):
+        """Suspend the flow PID and hold a raw output until the pump is switched on or off again."""
+        if not self.initialized:
+            logger.error(f"Pump Actor {self.id} is not properly initialized.")
+            return
+        self._stop_control()
+        self.output = min(max(int(output), 0), self.maxoutput)
+        self.state = True
+        try:
+            await self.ramp.move_to(self.output)
+            await self.ui_updates.push(self.output)
+        except Exception as e:
+            logger.error(f"Failed to hold output for Pump Actor {self.id} - Power GPIO {self.power_gpio}: {e}")
+
+    async def _write_output(self, value):
+        board = TelemetrixAioService.get_arduino_instance()
+        await board.analog_write(self.power_gpio, value)
+
     def get_state(self):
         return self.state
 
-    async def run(self):
-        while self.running:
-            if self.initialized and self.state:
-                # Access the flow rate data from the global dictionary using the flowmeter ID
-                try:
-                    current_flow = flowmeter_data.get(self.flow_meter_sensor_id, None)
-                    if current_flow is not None:
-                        # Calculate the new output using the PID controller
-                        self.output = self.pid(float(current_flow))
-                        self.output = max(0, min(int(self.output), self.maxoutput))  # Clamp output
-
-                        board = TelemetrixAioService.get_arduino_instance()
-                        await board.analog_write(self.power_gpio, self.output)
-                        await self.cbpi.actor.actor_update(self.id, self.output)
-                        logger.info(f"Pump Actor {self.id} adjusting output to {self.output} based on flow rate {current_flow}.")
-                    else:
-                        logger.warning(f"No data available for Sensor ID {self.flow_meter_sensor_id}")
-                except Exception as e:
-                    logger.error(f"Failed to adjust pump output based on flow meter input for Pump Actor {self.id}: {e}")
+    def group_command(self, power):
+        """Pin write for ArduinoActorGroup; power is 0-100 and 0 switches the pump off."""
+        if not self.initialized:
+            return None
+        return ("analog", self.power_gpio, int(min(max(power, 0), 100) * self.maxoutput / 100))
+
+    async def group_applied(self, power):
+        was_on = self.state
+        self.state = power > 0
+        if self.state:
+            self.power = round(min(power, 100))
+            self.output = int(self.power * self.maxoutput / 100)
+            self._start_control()
+        else:
+            self._stop_control()
+        self.ramp.sync(self.output if self.state else 0)
+        await self.ui_updates.push(self.output if self.state else 0, force=self.state != was_on)
+
+    def _start_control(self):
+        if self._control_job is None or self._control_job.cancelled:
+            self._control_job = ControlScheduler.get().every(self.time_base, self._control_step,
+                                                             name=f"PumpActor:{self.id}")
+            TelemetrixAioService.claim_link(f"actor:{self.id}", 1.0 / self.time_base, ANALOG_WRITE_BYTES)
+
+    def _stop_control(self):
+        if self._control_job is not None:
+            self._control_job.cancel()
+            self._control_job = None
+            TelemetrixAioService.link_budget.release_name(f"actor:{self.id}")
+
+    async def _control_step(self):
+        if not (self.initialized and self.state):
+            return
+        # Access the flow rate data from the global dictionary using the flowmeter ID
+        try:
+            current_flow = flowmeter_data.get(self.flow_meter_sensor_id, None)
+            if current_flow is not None:
+                # Calculate the new output using the PID controller
+                self.output = self.pid(float(current_flow))
+                self.output = max(0, min(int(self.output), self.maxoutput))  # Clamp output
+
+                await self.ramp.move_to(self.output)
+                await self.ui_updates.push(self.output)
+                history.record(f"actor:{self.id}", current_flow, self.output, self.pid.components)
+                logger.info(f"Pump Actor {self.id} adjusting output to {self.output} based on flow rate {current_flow}.")
             else:
-                logger.debug(f"Pump Actor {self.id} is not active (state={self.state}), skipping output adjustment.")
-        
-            await asyncio.sleep(self.time_base)
+                logger.warning(f"No data available for Sensor ID {self.flow_meter_sensor_id}")
+        except Exception as e:
+            logger.error(f"Failed to adjust pump output based on flow meter input for Pump Actor {self.id}: {e}")
+
+    @monitored
+    async def run(self):
+        await ControlScheduler.get().park(self)
+        self._stop_control()
+        self.ramp.cancel()
+        TelemetrixAioService.release_pins(f"actor:{self.id}", self)
 
 
 @parameters([
     Property.Number(label="Volume", description="Volume limit for this step", configurable=True),
     Property.Actor(label="Actor", description="Actor to switch media flow on and off"),
     Property.Sensor(label="Sensor"),
-    Property.Select(label="Reset", options=["Yes", "No"], description="Reset Flowmeter when done")
+    Property.Select(label="Reset", options=["Yes", "No"], description="Reset Flowmeter when done"),
+    Property.Number(label="Trim Fraction", configurable=True, default_value=0, description="Fraction of the volume pumped at full speed before switching to the trim rate (0 = single stage)"),
+    Property.Number(label="Trim Output", configurable=True, default_value=60, description="Pump output during the trim stage [0-MaxOutput]")
 ])
 class ardunoPumpVolumeStep(CBPiStep):
-    async def on_timer_done(self, timer):
-        self.summary = ""
-        self.cbpi.notify(self.name, f'Step finished. Transferred {round(self.current_volume, 2)} {self.unit}.', NotificationType.SUCCESS)
-        if self.resetsensor == "Yes" and self.sensor and self.sensor.instance:
-            await self.sensor.instance.reset()
+    async def on_transfer_update(self, volume, flow):
+        self.current_volume = volume
+        self.summary = f"Volume: {round(volume, 2)}"
+        await self.push_update()
 
+    async def stop_flow(self):
         if self.actor is not None:
             await self.actor_off(self.actor)
-        await self.next()
 
-    async def on_timer_update(self, timer, seconds):
-        await self.push_update()
+    async def start_trim(self):
+        await set_actor_output(self.cbpi, self.actor, self.trim_output)
+
+    async def on_transfer_done(self, volume, overshoot):
+        self.summary = ""
+        self.cbpi.notify(self.name, f'Step finished. Transferred {round(volume, 2)} {self.unit}.', NotificationType.SUCCESS)
+        if self.resetsensor == "Yes" and self.sensor and self.sensor.instance:
+            await reset_volume_sensor(self.sensor.instance)
+        await self.next()
 
     async def on_start(self):
+        history.start_session(self.name)
         self.unit = self.cbpi.config.get("flowunit", "L")
         self.actor = self.props.get("Actor", None)
         self.target_volume = float(self.props.get("Volume", 0))
         self.flowsensor = self.props.get("Sensor", None)
         self.sensor = self.get_sensor(self.flowsensor)
         self.resetsensor = self.props.get("Reset", "Yes")
+        self.trim_fraction = float(self.props.get("Trim Fraction", 0) or 0)
+        self.trim_output = float(self.props.get("Trim Output", 60) or 0)
+        self.current_volume = 0
+        self.transfer = None
 
         if not self.sensor:
             logger.error(f"Sensor {self.flowsensor} not found.")
@@ -380,48 +540,53 @@ class ardunoPumpVolumeStep(CBPiStep):
             return
 
         if self.sensor.instance:
-            await self.sensor.instance.reset()
-
-        if self.timer is None:
-            self.timer = Timer(1, on_update=self.on_timer_update, on_done=self.on_timer_done)
+            await reset_volume_sensor(self.sensor.instance)
 
     async def on_stop(self):
-        if self.timer is not None:
-            await self.timer.stop()
+        if self.transfer is not None:
+            self.transfer.cancel()
         self.summary = ""
         if self.actor is not None:
             await self.actor_off(self.actor)
         await self.push_update()
 
     async def reset(self):
-        self.timer = Timer(1, on_update=self.on_timer_update, on_done=self.on_timer_done)
+        if self.transfer is not None:
+            self.transfer.cancel()
         if self.actor is not None:
             await self.actor_off(self.actor)
         if self.resetsensor == "Yes" and self.sensor and self.sensor.instance:
-            await self.sensor.instance.reset()
+            await reset_volume_sensor(self.sensor.instance)
 
+    @monitored
     async def run(self):
         if self.actor is not None:
             await self.actor_on(self.actor)
         self.summary = ""
         await self.push_update()
-        while self.running:
-            self.current_volume = self.get_sensor_value(self.flowsensor).get("value", 0)
-            self.summary = f"Volume: {self.current_volume}"
-            await self.push_update()
-
-            if self.current_volume >= self.target_volume and not self.timer.is_running:
-                logger.info("Target volume reached, starting timer.")
-                self.timer.start()
-                self.timer.is_running = True
-
-            await asyncio.sleep(0.2)
+        two_stage = self.actor is not None and 0 < self.trim_fraction < 1
+        trim_ratio = 0.25
+        if two_stage:
+            # Fast stage runs the pump at its maximum output
+            instance = getattr(self.cbpi.actor.find_by_id(self.actor), "instance", None)
+            maxoutput = float(getattr(instance, "maxoutput", 100) or 100)
+            trim_ratio = min(self.trim_output / maxoutput, 1.0)
+            await set_actor_output(self.cbpi, self.actor, maxoutput)
+        # The cutoff is driven by the volume readings themselves, see VolumeTransfer
+        self.transfer = VolumeTransfer(self.cbpi, self.actor, self.flowsensor, self.target_volume,
+                                       self.stop_flow, self.on_transfer_done, self.on_transfer_update,
+                                       trim=self.start_trim if two_stage else None,
+                                       trim_fraction=self.trim_fraction, trim_ratio=trim_ratio)
+        self.transfer.start()
+        await ControlScheduler.get().park(self)
+        self.transfer.cancel()
 
         return StepResult.DONE
 
 
 @parameters([
-    Property.Number("Setpoint", configurable=True, default_value=18.0),
+    Property.Number("Setpoint", configurable=True, default_value=20.0, description="Maximum wort outlet temperature"),
+    Property.Number("Target Temperature", configurable=True, default_value=18.0, description="Step finishes when the wort has cooled to this temperature, below the Setpoint"),
     Property.Number("Kp", configurable=True, default_value=2.0),
     Property.Number("Ki", configurable=True, default_value=5.0),
     Property.Number("Kd", configurable=True, default_value=1.0),
@@ -436,60 +601,152 @@ class ardunoPumpVolumeStep(CBPiStep):
     Property.Number("Minimum Flow Threshold", configurable=True, default_value=1.0)
 ])
 class arduinoPumpCoolStep(CBPiStep):
+    """
+    Chiller controller: runs the wort pump as fast as the maximum outlet temperature allows.
+
+    More flow always removes more heat, so total cooling time is minimal when the outlet sits at
+    its limit. A PID on the outlet temperature (setpoint = maximum outlet temperature) sets the
+    pump output every Time Base seconds on the ControlScheduler; below the limit it integrates up
+    to full flow. Time to target is estimated from an exponential fit of the wort temperature at
+    the chiller inlet, or of the outlet temperature when no input sensor is set; while the PID
+    holds the outlet at its limit the outlet shows no decay to fit.
+    While the measured flow is below the minimum flow threshold the output is not reduced further,
+    so the wort keeps moving through the chiller. Temperatures of DS18B20/DHT sensors on the board
+    come from the shared temperature cache; a stale reading holds the output like a missing one.
+    """
+
+    SUMMARY_INTERVAL = 5.0
 
     async def on_start(self):
-        self.setpoint = self.props.get("Setpoint")
-        self.kp = self.props.get("Kp")
-        self.ki = self.props.get("Ki")
-        self.kd = self.props.get("Kd")
+        history.start_session(self.name)
+        self.setpoint = float(self.props.get("Setpoint", 20.0))
+        self.target_temperature = float(self.props.get("Target Temperature", 18.0) or 18.0)
+        self.kp = float(self.props.get("Kp", 2.0))
+        self.ki = float(self.props.get("Ki", 5.0))
+        self.kd = float(self.props.get("Kd", 1.0))
+        self.time_base = max(float(self.props.get("Time Base", 1.0) or 1.0), 0.5)
         self.unit = self.cbpi.config.get("flowunit", "L")
         self.input_temp_sensor_id = self.props.get("Input Sensor")
         self.output_temp_sensor_id = self.props.get("Output Sensor")
         self.flow_sensor_id = self.props.get("Flow Sensor")
         self.volume_sensor_id = self.props.get("Volume Sensor")
         self.pump_actor_id = self.props.get("Pump Actor")
-        self.min_flow_threshold = self.props.get("Minimum Flow Threshold")
+        self.min_flow_threshold = float(self.props.get("Minimum Flow Threshold", 1.0) or 0)
         self.maxoutput = int(self.props.get("MaxOutput", 255))  # Initialize MaxOutput
 
-        if not self.output_temp_sensor_id:
-            raise Exception("Output temperature sensor is required")
-
-        # Use the new PID class
-        self.pid = PID(Kp=self.kp, Ki=self.ki, Kd=self.kd, output_limits=(0, self.maxoutput))
-        self.pid.setpoint = self.setpoint
-
-        self.input_temp_sensor = self.api.cache.get("sensors").get(self.input_temp_sensor_id)
-        self.output_temp_sensor = self.api.cache.get("sensors").get(self.output_temp_sensor_id)
-        self.flow_sensor = self.api.cache.get("sensors").get(self.flow_sensor_id)
-        self.volume_sensor = self.api.cache.get("sensors").get(self.volume_sensor_id)
-        self.pump_actor = self.api.cache.get("actors").get(self.pump_actor_id)
+        self.pid = PID(Kp=self.kp, Ki=self.ki, Kd=self.kd, setpoint=self.setpoint, sample_time=None,
+                       output_limits=(0, self.maxoutput), starting_output=self.maxoutput)
+        self.fit = ExponentialFit()
+        self.output = None
+        self._control_job = None
+        self._last_summary = None
+        self._last_error = None
+        self._started = None
 
-    async def execute(self):
-        while self.is_running():
-            try:
-                output_temp = self.output_temp_sensor.instance.get_value()
-                current_flow = self.flow_sensor.instance.get_value()
-                current_volume = self.volume_sensor.instance.get_value()
-
-                if self.input_temp_sensor and self.input_temp_sensor.instance:
-                    input_temp = self.input_temp_sensor.instance.get_value()
-                    temp_diff = input_temp - output_temp
-                else:
-                    temp_diff = 0
+        if not self.output_temp_sensor_id:
+            self.cbpi.notify(self.name, 'Output temperature sensor is required', NotificationType.ERROR)
+            await self.next()
+        elif self.target_temperature >= self.setpoint:
+            # The outlet is held at the Setpoint, so the wort would never get down to the target
+            self.cbpi.notify(self.name, f'Target Temperature must be below the Setpoint ({self.setpoint})', NotificationType.ERROR)
+            await self.next()
 
-                pid_output = self.pid(temp_diff)
+    def _sensor_value(self, sensor_id):
+        if not sensor_id:
+            return None
+        if sensor_id in temperatures:
+            # Board temperature sensors: a stale reading counts as no reading
+            return temperatures.get(sensor_id)
+        value = self.get_sensor_value(sensor_id).get("value")
+        return float(value) if value is not None else None
+
+    async def _control_step(self):
+        scheduler = ControlScheduler.get()
+        now = scheduler.time()
+        try:
+            output_temp = self._sensor_value(self.output_temp_sensor_id)
+            if output_temp is None:
+                return
+            input_temp = self._sensor_value(self.input_temp_sensor_id)
+            current_flow = self._sensor_value(self.flow_sensor_id)
+
+            wort_temp = input_temp if input_temp is not None else output_temp
+            self.fit.add(now - self._started, wort_temp)
+            if wort_temp <= self.target_temperature and output_temp <= self.target_temperature:
+                await self._finish(output_temp)
+                return
+
+            output = self.pid(output_temp)
+            if current_flow is not None and current_flow < self.min_flow_threshold and self.output is not None:
+                output = max(output, self.output)
+            output = round(output)
+            if output != self.output:
+                await set_actor_output(self.cbpi, self.pump_actor_id, output)
+                self.output = output
+            history.record(f"step:{self.id}", output_temp, output, self.pid.components)
+            self._last_error = None
+
+            if self._last_summary is None or now - self._last_summary >= self.SUMMARY_INTERVAL:
+                self._last_summary = now
+                await self._update_summary(output_temp, input_temp, current_flow)
+        except Exception as e:
+            # One notification per distinct problem, not one per tick
+            if str(e) != self._last_error:
+                self._last_error = str(e)
+                logger.error(f"Cool step {self.id} control error: {e}")
+                self.cbpi.notify(self.name, f'Control error: {e}', NotificationType.ERROR)
+
+    async def _update_summary(self, output_temp, input_temp, current_flow):
+        self.fit.fit()
+        remaining = self.fit.time_to(self.target_temperature)
+        eta = f"{remaining / 60:.0f} min" if remaining is not None else "--"
+        parts = [f"Out {output_temp:.1f}"]
+        if input_temp is not None:
+            parts.append(f"In {input_temp:.1f}")
+        if current_flow is not None:
+            parts.append(f"Flow {current_flow:.1f} {self.unit}/min")
+        volume = self._sensor_value(self.volume_sensor_id)
+        if volume is not None:
+            parts.append(f"Vol {volume:.1f} {self.unit}")
+        parts.append(f"Pump {self.output}/{self.maxoutput}")
+        parts.append(f"ETA {eta}")
+        self.summary = " | ".join(parts)
+        await self.push_update()
 
-                if temp_diff < 0 and current_flow < self.min_flow_threshold:
-                    pump_power = self.min_flow_threshold
-                else:
-                    pump_power = pid_output
+    async def _finish(self, output_temp):
+        self._stop_control()
+        if self.pump_actor_id is not None:
+            await self.actor_off(self.pump_actor_id)
+        self.summary = ""
+        minutes = (ControlScheduler.get().time() - self._started) / 60
+        self.cbpi.notify(self.name, f'Wort cooled to {output_temp:.1f} in {minutes:.0f} min.', NotificationType.SUCCESS)
+        await self.next()
 
-                # Set pump power based on the PID output and MaxOutput
-                self.pump_actor.instance.set_power(pump_power)
+    def _stop_control(self):
+        if self._control_job is not None:
+            self._control_job.cancel()
+            self._control_job = None
 
-                self.api.notify(headline="PID Control", message=f"Output Temp: {output_temp}, Flow: {current_flow}, Volume: {current_volume}, PID Output: {pid_output}, Pump Power: {pump_power}", timeout=None)
+    async def on_stop(self):
+        self._stop_control()
+        if self.pump_actor_id is not None:
+            await self.actor_off(self.pump_actor_id)
+        self.summary = ""
+        await self.push_update()
 
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                self.api.notify(headline="Execution Error", message=str(e), timeout=10)
+    async def reset(self):
+        self._stop_control()
+        self.pid.reset()
+        self.fit = ExponentialFit()
+        self.output = None
 
+    @monitored
+    async def run(self):
+        if self.pump_actor_id is not None:
+            await self.actor_on(self.pump_actor_id)
+        scheduler = ControlScheduler.get()
+        self._started = scheduler.time()
+        self._control_job = scheduler.every(self.time_base, self._control_step, name=f"arduinoPumpCoolStep:{self.id}")
+        await scheduler.park(self)
+        self._stop_control()
+        return StepResult.DONE
@@ -0,0 +1,155 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Pin capabilities
+DIGITAL = "digital"
+PWM = "pwm"
+ANALOG = "analog"
+I2C = "i2c"
+SERIAL = "serial"
+
+SERIAL_OWNER = "serial link"
+
+
+class PinConflict(ValueError):
+    """A device asked for a pin its board does not have, or one another device holds."""
+
+
+class BoardProfile:
+    """
+    Pin map of one Arduino model, indexed both ways: capability -> pins for the dropdowns and
+    pin -> capabilities for claim checks.
+
+    Pins are numbered like Telemetrix numbers them: digital pins by their pin number, analog
+    inputs by channel (A0 = 0). `analog_pins` holds the digital number of each channel, so an
+    analog input and a digital use of the same physical pin are recognised as a conflict.
+    """
+
+    def __init__(self, name, digital_pins, pwm_pins, analog_pins, i2c_pins, serial_pins=(0, 1)):
+        self.name = name
+        self.analog_pins = list(analog_pins)
+        self.capabilities = {}
+        for capability, pins in ((DIGITAL, digital_pins), (PWM, pwm_pins), (ANALOG, analog_pins),
+                                 (I2C, i2c_pins), (SERIAL, serial_pins)):
+            for pin in pins:
+                self.capabilities.setdefault(pin, set()).add(capability)
+        self.pins = {capability: sorted(pin for pin, capabilities in self.capabilities.items() if capability in capabilities)
+                     for capability in (DIGITAL, PWM, ANALOG, I2C, SERIAL)}
+
+    def physical_pin(self, pin, capability):
+        """Digital pin number behind `pin` as given for `capability`."""
+        if capability == ANALOG:
+            if not 0 <= pin < len(self.analog_pins):
+                raise PinConflict(f"The {self.name} has no analog input A{pin}")
+            return self.analog_pins[pin]
+        return pin
+
+    def supports(self, pin, capability):
+        if capability == ANALOG and not 0 <= pin < len(self.analog_pins):
+            return False
+        return capability in self.capabilities.get(self.physical_pin(pin, capability), ())
+
+    def options(self, capability):
+        """Pins to offer for `capability`; analog inputs by channel, the serial link pins never."""
+        if capability == ANALOG:
+            return list(range(len(self.analog_pins)))
+        return [pin for pin in self.pins[capability] if pin not in self.pins[SERIAL]]
+
+    def snapshot(self):
+        return {"name": self.name, "analog_pins": self.analog_pins,
+                **{capability: pins for capability, pins in self.pins.items()}}
+
+
+# A0-A5 double as digital pins 14-19; the Nano's A6/A7 are analog only
+BOARD_PROFILES = {
+    "Uno": BoardProfile("Uno", range(20), [3, 5, 6, 9, 10, 11], range(14, 20), [18, 19]),
+    "Nano": BoardProfile("Nano", range(20), [3, 5, 6, 9, 10, 11], range(14, 22), [18, 19]),
+    "Mega": BoardProfile("Mega", range(70), [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 44, 45, 46], range(54, 70), [20, 21]),
+}
+
+DEFAULT_BOARD = "Mega"
+
+# Option lists handed to the Property.Select pin dropdowns. They start out with the default board
+# and are refilled in place by select_options() once the configured board is known.
+_options = {capability: BOARD_PROFILES[DEFAULT_BOARD].options(capability) for capability in (DIGITAL, PWM, ANALOG)}
+
+
+def get_profile(name):
+    profile = BOARD_PROFILES.get(str(name))
+    if profile is None:
+        logger.error(f"Unknown board '{name}', using the {DEFAULT_BOARD} pin map")
+        profile = BOARD_PROFILES[DEFAULT_BOARD]
+    return profile
+
+
+def pin_options(capability):
+    return _options[capability]
+
+
+def select_options(profile):
+    for capability, options in _options.items():
+        options[:] = profile.options(capability)
+
+
+class PinClaims:
+    """
+    Claim table of one board: which device holds which physical pin.
+
+    claim() checks every requested pin against the profile and the table before reserving any, so
+    a misconfigured device is rejected as a whole before it sends a single pin mode command. Each
+    check is a couple of dict lookups. Pins can be shared by devices that name the same `share`
+    key, e.g. the probes of one OneWire bus. Claiming again replaces the owner's earlier claim;
+    `token` ties a claim to one device instance, so a stopping instance does not release the pins
+    its reconfigured successor has just claimed under the same owner name.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._pins = {}       # physical pin -> (capability, share, {owner: token})
+        self._owners = {}     # owner -> (token, [physical pins])
+        for pin in profile.pins[SERIAL]:
+            self._pins[pin] = (SERIAL, None, {SERIAL_OWNER: None})
+
+    def claim(self, owner, pins, share=None, token=None):
+        """Reserve `pins`, a list of (pin, capability); raises PinConflict and reserves nothing on failure."""
+        physical = []
+        for pin, capability in pins:
+            if not self.profile.supports(pin, capability):
+                raise PinConflict(f"{owner}: pin {pin} of the {self.profile.name} cannot be used as {capability}")
+            number = self.profile.physical_pin(pin, capability)
+            entry = self._pins.get(number)
+            if entry is not None:
+                others = [other for other in entry[2] if other != owner]
+                if others and (share is None or entry[0] != capability or entry[1] != share):
+                    raise PinConflict(f"{owner}: pin {number} is already used by {', '.join(others)}")
+            physical.append((number, capability))
+
+        self.release(owner)
+        for number, capability in physical:
+            self._pins.setdefault(number, (capability, share, {}))[2][owner] = token
+        self._owners[owner] = (token, [number for number, _ in physical])
+
+    def release(self, owner, token=None):
+        """Free the pins of `owner`; with `token`, only if the claim was made with that token."""
+        claimed = self._owners.get(owner)
+        if claimed is None or (token is not None and claimed[0] is not token):
+            return
+        del self._owners[owner]
+        for number in claimed[1]:
+            entry = self._pins.get(number)
+            if entry is not None:
+                entry[2].pop(owner, None)
+                if not entry[2]:
+                    del self._pins[number]
+
+    def owners(self, pin):
+        entry = self._pins.get(pin)
+        return list(entry[2]) if entry is not None else []
+
+    def snapshot(self):
+        return {
+            "board": self.profile.snapshot(),
+            "claims": {number: {"capability": capability, "share": share, "owners": list(owners)}
+                       for number, (capability, share, owners) in sorted(self._pins.items())},
+        }
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from cbpi.api.dataclasses import NotificationType
+
+from .TelemetrixAioService import TelemetrixAioService
+from .linkBudget import ANALOG_REPORT_BYTES
+from .loopMonitor import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+# Telemetrix4Arduino's analog scan interval at power-up, in ms
+DEFAULT_SCAN_INTERVAL = 19
+
+# A measured mean rate further than this from the scan rate means the board did not keep up
+RATE_TOLERANCE = 0.1
+
+# Frequency bands reported by analyze(), in Hz; the last one ends at Nyquist
+BANDS = ((0.0, 1.0), (1.0, 10.0), (10.0, 100.0), (100.0, None))
+
+_executor = None
+
+
+def welch(x, rate, segment=256):
+    """Welch PSD estimate: Hann-windowed, mean-detrended segments with 50 % overlap, one-sided."""
+    size = 1 << int(np.log2(min(segment, len(x))))
+    step = max(size // 2, 1)
+    window = np.hanning(size)
+    segments = np.lib.stride_tricks.sliding_window_view(x, size)[::step]
+    segments = (segments - segments.mean(axis=1, keepdims=True)) * window
+    power = (np.abs(np.fft.rfft(segments, axis=1)) ** 2).mean(axis=0)
+    psd = power / (rate * (window ** 2).sum())
+    # Power of two segments: every bin except DC and Nyquist folds in the negative frequencies
+    psd[1:-1] *= 2
+    return np.fft.rfftfreq(size, 1.0 / rate), psd
+
+
+def analyze(samples, rate):
+    """Summary statistics and Welch PSD of one burst; runs in the worker process."""
+    x = np.asarray(samples, dtype=np.float64)
+    freqs, psd = welch(x, rate)
+    df = freqs[1] - freqs[0] if len(freqs) > 1 else 0.0
+    dominant = int(np.argmax(psd[1:])) + 1 if len(psd) > 1 else 0
+    bands = {}
+    for low, high in BANDS:
+        mask = (freqs > 0) & (freqs >= low)
+        if high is not None:
+            mask &= freqs < high
+        label = f"{low:g}-{high:g} Hz" if high is not None else f">{low:g} Hz"
+        bands[label] = float(psd[mask].sum() * df)
+    std = float(x.std())
+    return {
+        "samples": len(x),
+        "rate": rate,
+        "mean": float(x.mean()),
+        "std": std,
+        "min": float(x.min()),
+        "max": float(x.max()),
+        "peak_to_peak": float(x.max() - x.min()),
+        "p01": float(np.percentile(x, 1)),
+        "p99": float(np.percentile(x, 99)),
+        "crest_factor": float(np.abs(x - x.mean()).max() / std) if std > 0 else None,
+        "dominant_frequency": float(freqs[dominant]),
+        "band_power": bands,
+        "psd": {"frequency": freqs.tolist(), "power": psd.tolist()},
+    }
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class BurstCapture:
+    """
+    Samples one analog pin at the board's maximum report rate for `seconds`.
+
+    The pin is switched to report every scan (differential 0) with the scan interval at
+    `scan_interval` ms, and every report is written into preallocated arrays from the report
+    callback. Boards without set_analog_scan_interval (simulator, replay) are captured at their
+    own report rate. The caller restores the sensor's regular pin setup afterwards.
+
+    While the burst runs, its report stream is claimed on the link budget so elastic reporters
+    back off. The report timestamps are host receive times, jittered and bunched by USB, so they
+    only serve to check the rate: see timing().
+    """
+
+    def __init__(self, board, pin, seconds, scan_interval=1):
+        self.board = board
+        self.pin = pin
+        self.seconds = seconds
+        self.scan_interval = scan_interval
+        capacity = int(seconds * 1000 / max(scan_interval, 1) * 1.5) + 16
+        self.values = np.empty(capacity, dtype=np.float32)
+        self.times = np.empty(capacity, dtype=np.float64)
+        self.count = 0
+        self.dropped = 0
+        self.scanned = False
+
+    async def _on_sample(self, data):
+        if self.count < len(self.values):
+            self.values[self.count] = data[2]
+            self.times[self.count] = data[3]
+            self.count += 1
+        else:
+            self.dropped += 1
+
+    async def run(self):
+        set_scan_interval = getattr(self.board, "set_analog_scan_interval", None)
+        self.scanned = set_scan_interval is not None
+        claim = None
+        if self.scanned:
+            claim = TelemetrixAioService.claim_link(f"burst:{self.pin}", 1000.0 / max(self.scan_interval, 1),
+                                                    in_bytes=ANALOG_REPORT_BYTES)
+        try:
+            await self.board.set_pin_mode_analog_input(self.pin, 0, self._on_sample)
+            if set_scan_interval is not None:
+                await set_scan_interval(self.scan_interval)
+            await self.board.enable_analog_reporting(self.pin)
+            try:
+                await asyncio.sleep(self.seconds)
+            finally:
+                await self.board.disable_analog_reporting(self.pin)
+                if set_scan_interval is not None:
+                    await set_scan_interval(DEFAULT_SCAN_INTERVAL)
+        finally:
+            if claim is not None:
+                claim.release()
+        return self.values[:self.count], self.times[:self.count]
+
+    def timing(self, times):
+        """
+        (rate, measured rate, jitter in s) of a capture. The board samples on its scan clock, so
+        the configured scan rate is used as long as the mean receive rate confirms it; otherwise
+        the board fell behind and the measured mean rate is the better estimate. Jitter is the
+        standard deviation of the receive intervals.
+        """
+        measured = float((len(times) - 1) / (times[-1] - times[0]))
+        jitter = float(np.diff(times).std())
+        rate = measured
+        if self.scanned:
+            nominal = 1000.0 / max(self.scan_interval, 1)
+            if abs(measured - nominal) <= RATE_TOLERANCE * nominal:
+                rate = nominal
+            else:
+                logger.warning(f"Burst on pin {self.pin}: {measured:.0f} Hz received, scan rate {nominal:.0f} Hz")
+        return rate, measured, jitter
+
+
+class BurstStore:
+    """Burst results as <name>.json (statistics and PSD) plus <name>.npy (raw samples)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def save(self, sensor_id, samples, result):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{sensor_id}-{time.strftime('%Y%m%d-%H%M%S')}"
+        with loop_monitor.measure("BurstStore.save"):
+            np.save(os.path.join(self.directory, name + ".npy"), samples)
+            with open(os.path.join(self.directory, name + ".json"), "w") as file:
+                json.dump(result, file)
+        return name
+
+    def list(self):
+        try:
+            return sorted(entry[:-5] for entry in os.listdir(self.directory) if entry.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def load(self, name):
+        if os.path.basename(name) != name:
+            return None
+        try:
+            with open(os.path.join(self.directory, name + ".json"), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+bursts = BurstStore(os.path.join(os.path.dirname(__file__), 'bursts'))
+
+_active_pins = set()
+
+
+async def run_burst(cbpi, sensor_id, pin, seconds, restore=None):
+    """
+    Capture a burst on `pin`, await `restore()` to give the pin back to the sensor, analyze it in
+    the worker process and store the result. Reports the outcome as a CraftBeerPi notification.
+    """
+    sensor = cbpi.sensor.find_by_id(sensor_id)
+    title = sensor.name if sensor is not None else f"Sensor {sensor_id}"
+    board = TelemetrixAioService.get_arduino_instance()
+    if board is None:
+        cbpi.notify(title, "Burst capture needs a connected Arduino.", NotificationType.ERROR)
+        return None
+    if pin in _active_pins:
+        cbpi.notify(title, f"A burst capture on pin {pin} is already running.", NotificationType.WARNING)
+        return None
+    _active_pins.add(pin)
+    try:
+        capture = BurstCapture(board, pin, seconds)
+        try:
+            values, times = await capture.run()
+        finally:
+            if restore is not None:
+                await restore()
+        if len(values) < 16 or times[-1] <= times[0]:
+            cbpi.notify(title, f"Burst capture got only {len(values)} samples.", NotificationType.ERROR)
+            return None
+        rate, measured, jitter = capture.timing(times)
+        result = await asyncio.get_running_loop().run_in_executor(get_executor(), analyze, values, rate)
+        result.update(sensor=sensor_id, pin=pin, started=float(times[0]), dropped=capture.dropped,
+                      measured_rate=measured, jitter=jitter)
+        name = bursts.save(sensor_id, values, result)
+        logger.info(f"Burst {name}: {len(values)} samples at {rate:.0f} Hz")
+        cbpi.notify(title, f"Burst captured: {len(values)} samples at {rate:.0f} Hz, std {result['std']:.2f}, "
+                           f"dominant {result['dominant_frequency']:.1f} Hz ({name}).", NotificationType.SUCCESS)
+        return name
+    except Exception as e:
+        logger.error(f"Burst capture on pin {pin} failed: {e}")
+        cbpi.notify(title, f"Burst capture failed: {e}", NotificationType.ERROR)
+        return None
+    finally:
+        _active_pins.discard(pin)
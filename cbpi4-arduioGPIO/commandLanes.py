@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .linkStats import PIN_COMMANDS, LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Transmit lanes, highest priority first
+EMERGENCY = 0
+STATE = 1
+CONTROL = 2
+CONFIG = 3
+LANE_NAMES = ("emergency", "state", "control", "config")
+
+_lane_override = contextvars.ContextVar("arduinogpio_command_lane", default=None)
+
+
+@contextmanager
+def command_lane(lane):
+    """
+    Send every board command issued inside the block on `lane`, e.g. an actor's off() runs under
+    command_lane(EMERGENCY) so a digital 0 that means "off" is not mistaken for a state change.
+    The override follows the awaiting coroutine, including ramps and helpers it calls.
+    """
+    token = _lane_override.set(lane)
+    try:
+        yield
+    finally:
+        _lane_override.reset(token)
+
+
+def classify(command):
+    """Lane for a Telemetrix command list without the length prefix."""
+    override = _lane_override.get()
+    if override is not None:
+        return override
+    kind = command[0]
+    if kind == 3:  # analog_write: 0 stops a pump, anything else is a control update
+        return EMERGENCY if len(command) > 3 and command[2] == 0 and command[3] == 0 else CONTROL
+    if kind in (0, 2, 6, 11, 12, 26, 27, 28, 29):  # loop back, digital write, are-you-there, I2C, OneWire I/O
+        return STATE
+    return CONFIG
+
+
+def lane_pin(command):
+    """
+    Pin a command is queued under. An analog input pin mode names an analog channel, not a digital
+    pin, so it is keyed as ("a", channel) and never discards control updates of digital pin N.
+    """
+    if command[0] not in PIN_COMMANDS or len(command) < 2:
+        return None
+    if command[0] == 1 and len(command) > 2 and command[2] == 3:  # set_pin_mode analog_input
+        return ("a", command[1])
+    return command[1]
+
+
+class _Pending:
+    __slots__ = ("lane", "transmit", "pin", "future", "queued")
+
+    def __init__(self, lane, transmit, pin, future, queued):
+        self.lane = lane
+        self.transmit = transmit
+        self.pin = pin
+        self.future = future
+        self.queued = queued
+
+
+class CommandLanes:
+    """
+    Prioritized transmit queues in front of the serial port.
+
+    Every command is submitted with an async `transmit` callable and its lane; a single writer task
+    always sends the oldest item of the highest non-empty lane, so an emergency stop never waits
+    behind more than the one command already on the wire. Each lane except emergency is bounded
+    by `depth`:
+
+    * control updates are coalesced per pin (a newer analog value replaces a queued one in place)
+      and, when the lane is full, the oldest one is dropped;
+    * state and config submissions wait for room instead of being dropped.
+
+    Any other command for a pin discards control updates still queued for that pin, so a PID tick
+    can never be sent after the off() that followed it.
+    """
+
+    def __init__(self, depth=32):
+        self.depth = depth
+        self._lanes = [deque() for _ in LANE_NAMES]
+        self._control_by_pin = {}
+        self._wakeup = None
+        self._space = None
+        self._busy = False
+        self._task = None
+        self.wait = [LatencyHistogram() for _ in LANE_NAMES]
+        self.sent = [0] * len(LANE_NAMES)
+        self.dropped = [0] * len(LANE_NAMES)
+        self.coalesced = 0
+        self.max_depth = [0] * len(LANE_NAMES)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for lane in self._lanes:
+            while lane:
+                item = lane.popleft()
+                if not item.future.done():
+                    item.future.cancel()
+        self._control_by_pin.clear()
+
+    async def submit(self, lane, transmit, pin=None):
+        """Queue `transmit` on `lane` and wait until it has been written (or superseded)."""
+        self._ensure_running()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        now = time.perf_counter()
+
+        if pin is not None:
+            if lane == CONTROL:
+                pending = self._control_by_pin.get(pin)
+                if pending is not None:
+                    # Keep the queue position, send only the newest value
+                    if not pending.future.done():
+                        pending.future.set_result(None)
+                    pending.transmit, pending.future = transmit, future
+                    self.coalesced += 1
+                    return await future
+            else:
+                self.discard_control(pin)
+
+        queue = self._lanes[lane]
+        if lane != EMERGENCY:
+            while len(queue) >= self.depth:
+                if lane == CONTROL:
+                    self._drop(queue.popleft())
+                    continue
+                async with self._space:
+                    await self._space.wait()
+
+        item = _Pending(lane, transmit, pin, future, now)
+        queue.append(item)
+        if lane == CONTROL and pin is not None:
+            self._control_by_pin[pin] = item
+        self.max_depth[lane] = max(self.max_depth[lane], len(queue))
+        self._wakeup.set()
+        return await future
+
+    async def drain(self, timeout):
+        """Wait until every queued command has been written; False if `timeout` ran out first."""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + max(timeout, 0)
+        while self._busy or any(self._lanes):
+            if self._task is None or self._task.done() or loop.time() >= end:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    def discard_control(self, pin):
+        """Forget a queued control update for `pin`; it has been overtaken by another command."""
+        pending = self._control_by_pin.pop(pin, None)
+        if pending is not None:
+            self._lanes[CONTROL].remove(pending)
+            self.dropped[CONTROL] += 1
+            if not pending.future.done():
+                pending.future.set_result(None)
+
+    def _drop(self, item):
+        if self._control_by_pin.get(item.pin) is item:
+            del self._control_by_pin[item.pin]
+        self.dropped[item.lane] += 1
+        if not item.future.done():
+            item.future.set_result(None)
+
+    def _pop(self):
+        for queue in self._lanes:
+            if queue:
+                item = queue.popleft()
+                if item.lane == CONTROL and self._control_by_pin.get(item.pin) is item:
+                    del self._control_by_pin[item.pin]
+                return item
+        return None
+
+    async def _run(self):
+        while True:
+            item = self._pop()
+            if item is None:
+                self._busy = False
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._busy = True
+            if item.lane != EMERGENCY:
+                async with self._space:
+                    self._space.notify_all()
+            self.wait[item.lane].record(time.perf_counter() - item.queued)
+            try:
+                await item.transmit()
+                self.sent[item.lane] += 1
+                if not item.future.done():
+                    item.future.set_result(None)
+            except Exception as e:
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+    def snapshot(self):
+        lanes = {
+            name: dict(self.wait[lane].snapshot(), sent=self.sent[lane], dropped=self.dropped[lane],
+                       queued=len(self._lanes[lane]), max_queued=self.max_depth[lane])
+            for lane, name in enumerate(LANE_NAMES)
+        }
+        lanes["coalesced"] = self.coalesced
+        return lanes
@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    """Handle returned by ControlScheduler; cancel() removes the job lazily from the heap."""
+
+    def __init__(self, when, interval, callback, name):
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.name = name
+        self.cancelled = False
+        self.runs = 0
+        self.overruns = 0
+        self.task = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    @property
+    def active(self):
+        return not self.cancelled
+
+
+class ControlScheduler:
+    """
+    One task that runs all periodic and one-shot control work of the plugin.
+
+    Timers live in a heap keyed on event-loop time, so each wakeup costs O(log n) in the number of
+    *active* jobs and idle actors cost nothing at all. Actors with no periodic work park their
+    run() here instead of looping on asyncio.sleep(). Callbacks may be plain functions or
+    coroutine functions. Plain functions run inline and must not block. A coroutine is started as
+    its own task, so a slow serial write in one job never delays the timers of the others; a
+    periodic job whose previous run is still in progress skips the tick (counted in `overruns`)
+    instead of overlapping itself.
+    """
+
+    _instance = None
+
+    def __init__(self, park_poll_interval=2.0):
+        self.park_poll_interval = park_poll_interval
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._parked = {}
+        self._park_job = None
+        self._running = set()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def time(self):
+        return asyncio.get_event_loop().time()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _push(self, job):
+        self._ensure_running()
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (job.when, next(self._counter), job))
+        if earliest is None or job.when < earliest:
+            self._wakeup.set()
+        return job
+
+    def stop(self):
+        """Cancel every job and the scheduler task; used on shutdown so no control loop writes again."""
+        for _, _, job in self._heap:
+            job.cancel()
+        self._heap.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        for _, future in self._parked.values():
+            if not future.done():
+                future.set_result(None)
+        self._park_job = None
+
+    def call_at(self, when, callback, name=None):
+        """Run `callback` once at event-loop time `when`."""
+        return self._push(ScheduledJob(when, None, callback, name))
+
+    def call_later(self, delay, callback, name=None):
+        return self.call_at(self.time() + delay, callback, name)
+
+    def every(self, interval, callback, name=None, start_delay=0.0):
+        """Run `callback` every `interval` seconds at a fixed rate until the job is cancelled."""
+        return self._push(ScheduledJob(self.time() + start_delay, interval, callback, name))
+
+    async def _run(self):
+        while True:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - self.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            when, _, job = heapq.heappop(self._heap)
+            self._execute(job)
+            if job.interval is not None and not job.cancelled:
+                job.when = when + job.interval
+                now = self.time()
+                if job.when <= now:
+                    # Fell behind: skip the missed ticks instead of bursting to catch up
+                    job.when = now + job.interval
+                heapq.heappush(self._heap, (job.when, next(self._counter), job))
+
+    def _execute(self, job):
+        if job.task is not None and not job.task.done():
+            job.overruns += 1
+            return
+        job.runs += 1
+        try:
+            result = job.callback()
+            if inspect.isawaitable(result):
+                job.task = asyncio.ensure_future(result)
+                self._running.add(job.task)
+                job.task.add_done_callback(lambda task: self._finished(job, task))
+        except Exception as e:
+            logger.error(f"Scheduled job {job.name or job.callback} failed: {e}")
+
+    def _finished(self, job, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Scheduled job {job.name or job.callback} failed: {task.exception()}")
+
+    async def park(self, owner):
+        """
+        Block an idle run() loop until `owner.running` goes False, without waking it periodically.
+        All parked owners share a single low-rate check.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._parked[id(owner)] = (owner, future)
+        if self._park_job is None or self._park_job.cancelled:
+            self._park_job = self.every(self.park_poll_interval, self._check_parked, name="park",
+                                        start_delay=self.park_poll_interval)
+        try:
+            await future
+        finally:
+            self._parked.pop(id(owner), None)
+
+    def _check_parked(self):
+        for owner, future in list(self._parked.values()):
+            if not getattr(owner, "running", False) and not future.done():
+                future.set_result(None)
+        if not self._parked and self._park_job is not None:
+            self._park_job.cancel()
+            self._park_job = None
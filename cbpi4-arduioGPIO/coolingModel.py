@@ -0,0 +1,67 @@
+import math
+from collections import deque
+
+
+class ExponentialFit:
+    """
+    Sliding-window fit of a temperature decaying exponentially towards an unknown asymptote,
+    T(t) = T_inf + (T0 - T_inf) * exp(-t / tau).
+
+    The model satisfies dT/dt = (T_inf - T) / tau, so a straight-line least-squares fit of the
+    slope between samples `lag` apart against their mean temperature gives -1/tau as the gradient
+    and T_inf/tau as the intercept. Using slopes over `lag` seconds rather than between adjacent
+    samples keeps sensor quantization from dominating the fit.
+    """
+
+    def __init__(self, window=300.0, lag=15.0, min_points=5):
+        self.window = window
+        self.lag = lag
+        self.min_points = min_points
+        self.samples = deque()
+        self.t_inf = None
+        self.tau = None
+
+    def add(self, t, temperature):
+        self.samples.append((t, float(temperature)))
+        while self.samples and t - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def fit(self):
+        """Refit from the current window; returns (T_inf, tau) or (None, None) without a decay."""
+        points = []
+        samples = list(self.samples)
+        j = 0
+        for t0, temp0 in samples:
+            while j < len(samples) and samples[j][0] - t0 < self.lag:
+                j += 1
+            if j >= len(samples):
+                break
+            t1, temp1 = samples[j]
+            points.append(((temp0 + temp1) / 2, (temp1 - temp0) / (t1 - t0)))
+
+        self.t_inf = self.tau = None
+        if len(points) < self.min_points:
+            return None, None
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        sxx = sum((x - mean_x) ** 2 for x, _ in points)
+        if sxx <= 0:
+            return None, None
+        gradient = sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+        if gradient >= 0:
+            return None, None
+        self.tau = -1.0 / gradient
+        self.t_inf = (mean_y - gradient * mean_x) * self.tau
+        return self.t_inf, self.tau
+
+    def time_to(self, target):
+        """Seconds until the fitted curve reaches `target` from the last sample, or None if it never does."""
+        if self.tau is None or not self.samples:
+            return None
+        current = self.samples[-1][1]
+        if current <= target:
+            return 0.0
+        if target <= self.t_inf:
+            return None
+        return self.tau * math.log((current - self.t_inf) / (target - self.t_inf))
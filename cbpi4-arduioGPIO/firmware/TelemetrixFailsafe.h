@@ -0,0 +1,96 @@
+/*
+ * Heartbeat failsafe extension for Telemetrix4Arduino.
+ *
+ * Drives a declared set of pins to safe values when the host stops sending heartbeats
+ * (the loop_back command the cbpi4-arduinoGPIO plugin sends every second by default).
+ *
+ * Installation into Telemetrix4Arduino.ino:
+ *
+ *   1. #include "TelemetrixFailsafe.h" above the command_table definition.
+ *   2. Append two entries at the end of command_table, after {&sonar_enable}, so that they land
+ *      on command ids 57 and 58 (ids up to 56 are taken by the stock commands; pad with
+ *      {&loop_back} entries if your firmware version has fewer commands):
+ *          {&failsafe_config},
+ *          {&failsafe_pin},
+ *   3. Call failsafe_heartbeat(); at the top of loop_back().
+ *   4. Call failsafe_check(); in loop(), right after get_next_command().
+ *
+ * Then set arduinogpio_failsafe_firmware to Yes in the CraftBeerPi settings. Never enable that
+ * setting on a board without this extension: stock firmware does not range-check command ids.
+ *
+ * Protocol (host -> board, after the usual length byte):
+ *   FAILSAFE_CONFIG (57): timeout_ms_msb, timeout_ms_lsb      0 disarms the failsafe
+ *   FAILSAFE_PIN    (58): pin, analog (0/1), value_msb, value_lsb
+ */
+
+#ifndef TELEMETRIX_FAILSAFE_H
+#define TELEMETRIX_FAILSAFE_H
+
+#include <Arduino.h>
+
+#define FAILSAFE_MAX_PINS 16
+
+extern byte command_buffer[];
+
+struct failsafe_entry {
+  byte pin;
+  byte analog;
+  unsigned int value;
+};
+
+static failsafe_entry failsafe_pins[FAILSAFE_MAX_PINS];
+static byte failsafe_count = 0;
+static unsigned long failsafe_timeout_ms = 0;
+static unsigned long failsafe_last_heartbeat = 0;
+static bool failsafe_tripped = false;
+
+// Called from loop_back(): every heartbeat re-arms the failsafe
+void failsafe_heartbeat() {
+  failsafe_last_heartbeat = millis();
+  failsafe_tripped = false;
+}
+
+void failsafe_config() {
+  failsafe_timeout_ms = ((unsigned long)command_buffer[0] << 8) + command_buffer[1];
+  failsafe_heartbeat();
+}
+
+void failsafe_pin() {
+  byte pin = command_buffer[0];
+  byte slot = failsafe_count;
+  for (byte i = 0; i < failsafe_count; i++) {
+    if (failsafe_pins[i].pin == pin) {
+      slot = i;
+      break;
+    }
+  }
+  if (slot >= FAILSAFE_MAX_PINS) {
+    return;
+  }
+  failsafe_pins[slot].pin = pin;
+  failsafe_pins[slot].analog = command_buffer[1];
+  failsafe_pins[slot].value = ((unsigned int)command_buffer[2] << 8) + command_buffer[3];
+  if (slot == failsafe_count) {
+    failsafe_count++;
+  }
+}
+
+// Called from loop(): trips once per outage; the host writes its outputs again when heartbeats resume
+void failsafe_check() {
+  if (failsafe_timeout_ms == 0 || failsafe_tripped) {
+    return;
+  }
+  if (millis() - failsafe_last_heartbeat < failsafe_timeout_ms) {
+    return;
+  }
+  for (byte i = 0; i < failsafe_count; i++) {
+    if (failsafe_pins[i].analog) {
+      analogWrite(failsafe_pins[i].pin, failsafe_pins[i].value);
+    } else {
+      digitalWrite(failsafe_pins[i].pin, failsafe_pins[i].value ? HIGH : LOW);
+    }
+  }
+  failsafe_tripped = true;
+}
+
+#endif
@@ -0,0 +1,113 @@
+import logging
+import time
+
+from .controlScheduler import ControlScheduler
+from .linkStats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Commands added by firmware/TelemetrixFailsafe.h, appended after get_features in the command table
+FAILSAFE_CONFIG = 57
+FAILSAFE_PIN = 58
+
+
+class Heartbeat:
+    """
+    Periodic loop-back ping to the board with round-trip tracking.
+
+    Every `interval` seconds one loop_back command (2 bytes out, 3 bytes back) is sent with a
+    rolling sequence byte; the echo gives the round-trip time. Echoes missing for longer than
+    `timeout` count as missed and flip `link_ok` until the next echo arrives.
+
+    With `failsafe_firmware` the board runs the TelemetrixFailsafe extension: on start() the
+    timeout and every pin in `failsafes` ({pin: (analog, value)}) are sent to the board, which
+    then drives those pins to their safe values by itself once it has not seen a heartbeat for
+    `timeout` seconds. Stock Telemetrix4Arduino firmware does not bounds-check command ids, so
+    the failsafe commands are only ever sent when the extension is declared present.
+
+    When echoes come back after an outage, `on_restored` is awaited so the host can write its
+    outputs again over the safe values the board may have switched to.
+    """
+
+    def __init__(self, board, failsafes, interval=1.0, timeout=3.0, failsafe_firmware=False, on_restored=None):
+        self.board = board
+        self.failsafes = failsafes
+        self.interval = interval
+        self.timeout = max(timeout, 2 * interval)
+        self.failsafe_firmware = failsafe_firmware
+        self.on_restored = on_restored
+        self.rtt = LatencyHistogram()
+        self.sent = 0
+        self.received = 0
+        self.missed = 0
+        self.last_rtt = None
+        self.link_ok = True
+        self._sequence = 0
+        self._pending = {}
+        self._job = None
+
+    async def start(self):
+        if self.failsafe_firmware:
+            timeout_ms = min(int(self.timeout * 1000), 0xffff)
+            await self.board._send_command([FAILSAFE_CONFIG, timeout_ms >> 8, timeout_ms & 0xff])
+            for pin in list(self.failsafes):
+                await self.send_failsafe(pin)
+        self._job = ControlScheduler.get().every(self.interval, self._beat, name="heartbeat")
+        logger.info(f"Heartbeat every {self.interval}s, failsafe timeout {self.timeout}s"
+                    f"{' (board-side failsafe armed)' if self.failsafe_firmware else ''}")
+
+    @property
+    def active(self):
+        return self._job is not None
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    async def send_failsafe(self, pin):
+        if not self.failsafe_firmware:
+            return
+        analog, value = self.failsafes[pin]
+        await self.board._send_command([FAILSAFE_PIN, pin, 1 if analog else 0, value >> 8, value & 0xff])
+
+    async def _beat(self):
+        now = time.perf_counter()
+        for sequence, sent in list(self._pending.items()):
+            if now - sent > self.timeout:
+                del self._pending[sequence]
+                self.missed += 1
+                if self.link_ok:
+                    self.link_ok = False
+                    logger.warning(f"No heartbeat echo from the board for {self.timeout}s")
+        self._sequence = (self._sequence + 1) & 0xff
+        self._pending[self._sequence] = now
+        self.sent += 1
+        await self.board.loop_back(chr(self._sequence), self._on_echo)
+
+    async def _on_echo(self, data):
+        sent = self._pending.pop(data[0], None) if data else None
+        if sent is None:
+            return
+        self.last_rtt = time.perf_counter() - sent
+        self.rtt.record(self.last_rtt)
+        self.received += 1
+        if not self.link_ok:
+            self.link_ok = True
+            logger.info("Heartbeat echo from the board restored")
+            if self.on_restored is not None:
+                await self.on_restored()
+
+    def snapshot(self):
+        return {
+            "interval_s": self.interval,
+            "timeout_s": self.timeout,
+            "sent": self.sent,
+            "received": self.received,
+            "missed": self.missed,
+            "link_ok": self.link_ok,
+            "last_rtt_us": int(self.last_rtt * 1e6) if self.last_rtt is not None else None,
+            "rtt": self.rtt.snapshot(),
+            "failsafe_firmware": self.failsafe_firmware,
+            "failsafe_pins": len(self.failsafes),
+        }
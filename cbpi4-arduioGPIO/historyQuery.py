@@ -0,0 +1,226 @@
+import logging
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from .loopMonitor import loop_monitor
+from .timeSeries import history
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths of the pyramid levels in seconds
+LEVEL_WIDTHS = (1.0, 10.0, 60.0, 600.0, 3600.0)
+
+
+def lttb(t, v, points):
+    """
+    Largest-Triangle-Three-Buckets: indices of `points` samples of (t, v) that keep the visual
+    shape of the curve. First and last sample are always kept; every bucket in between keeps the
+    sample forming the largest triangle with the previously kept one and the next bucket's mean.
+    """
+    size = len(t)
+    if points >= size or points < 3:
+        return np.arange(size)
+    # Relative times keep the triangle areas well-conditioned
+    t = t - t[0]
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_t, next_v = t[hi:edges[i + 2]].mean(), v[hi:edges[i + 2]].mean()
+        else:
+            next_t, next_v = t[-1], v[-1]
+        if hi <= lo:
+            selected[i + 1] = a
+            continue
+        area = np.abs((t[a] - next_t) * (v[lo:hi] - v[a]) - (t[a] - t[lo:hi]) * (next_v - v[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+class PyramidLevel:
+    """min/max/sum/count of a series over fixed, time-aligned buckets of `width` seconds."""
+
+    def __init__(self, width, capacity=64):
+        self.width = width
+        self.n = 0
+        self._key = None
+        self.start = np.empty(capacity)
+        self.min = np.empty(capacity)
+        self.max = np.empty(capacity)
+        self.sum = np.empty(capacity)
+        self.count = np.empty(capacity, dtype=np.int64)
+
+    def _reserve(self, size):
+        if size <= len(self.start):
+            return
+        capacity = max(size, 2 * len(self.start))
+        for name in ("start", "min", "max", "sum", "count"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def build(self, t, v):
+        """Bulk-load from raw samples; used once when the pyramid is created."""
+        if len(t) == 0:
+            return
+        keys = np.floor(t / self.width)
+        firsts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        self.n = 0
+        self._reserve(len(firsts))
+        self.n = len(firsts)
+        self.start[:self.n] = keys[firsts] * self.width
+        self.min[:self.n] = np.minimum.reduceat(v, firsts)
+        self.max[:self.n] = np.maximum.reduceat(v, firsts)
+        self.sum[:self.n] = np.add.reduceat(v, firsts)
+        self.count[:self.n] = np.diff(np.append(firsts, len(t)))
+        self._key = float(keys[-1])
+
+    def add(self, t, value):
+        key = math.floor(t / self.width)
+        if key != self._key:
+            self._reserve(self.n + 1)
+            i = self.n
+            self.n += 1
+            self._key = key
+            self.start[i] = key * self.width
+            self.min[i] = self.max[i] = self.sum[i] = value
+            self.count[i] = 1
+        else:
+            i = self.n - 1
+            if value < self.min[i]:
+                self.min[i] = value
+            if value > self.max[i]:
+                self.max[i] = value
+            self.sum[i] += value
+            self.count[i] += 1
+
+    def range(self, start, end):
+        """Index range of the buckets overlapping [start, end]."""
+        starts = self.start[:self.n]
+        lo = 0 if start is None else int(np.searchsorted(starts, start - self.width, side="right"))
+        hi = self.n if end is None else int(np.searchsorted(starts, end, side="right"))
+        return lo, hi
+
+
+class Pyramid:
+    """
+    Multi-resolution min/max/mean summary of one Series. Built from the raw records once, then
+    kept current by the series' append listener at O(levels) per sample.
+    """
+
+    def __init__(self, series, widths=LEVEL_WIDTHS):
+        self.series = series
+        self.levels = [PyramidLevel(width) for width in widths]
+        records = series.records
+        with loop_monitor.measure("Pyramid.build"):
+            t = np.asarray(records["t"], dtype=np.float64)
+            v = np.asarray(records["value"], dtype=np.float64)
+            for level in self.levels:
+                level.build(t, v)
+        if not series.readonly:
+            series.listeners.append(self.add)
+
+    def add(self, t, value):
+        for level in self.levels:
+            level.add(t, value)
+
+    def detach(self):
+        if self.add in self.series.listeners:
+            self.series.listeners.remove(self.add)
+
+
+class HistoryService:
+    """
+    Chart queries over the recorded history.
+
+    A query for `points` points over [start, end] reads the raw samples when there are at most
+    OVERSAMPLE * points of them, otherwise the finest pyramid level with few enough buckets, and
+    reduces that to `points` with LTTB on the bucket means (or the next finer level when that one
+    has fewer buckets than `points`). The min/max envelope of each output
+    point comes from the same buckets. Either way the work is proportional to `points`, not to
+    the number of raw samples in the window.
+    """
+
+    OVERSAMPLE = 4
+    MAX_POINTS = 5000
+
+    def __init__(self, recorder, cache_size=8):
+        self.recorder = recorder
+        self.cache_size = cache_size
+        self._pyramids = OrderedDict()
+
+    def pyramid(self, session_name, series_name):
+        key = (session_name, series_name)
+        pyramid = self._pyramids.get(key)
+        if pyramid is not None and pyramid.series.closed:
+            # The series was closed with its session; reopen it read-only
+            pyramid.detach()
+            del self._pyramids[key]
+            pyramid = None
+        if pyramid is None:
+            session = self.recorder.open_session(session_name)
+            series = session.series.get(series_name) if session is not None else None
+            if series is None:
+                return None
+            pyramid = self._pyramids[key] = Pyramid(series)
+            while len(self._pyramids) > self.cache_size:
+                _, evicted = self._pyramids.popitem(last=False)
+                evicted.detach()
+        self._pyramids.move_to_end(key)
+        return pyramid
+
+    def query(self, session_name, series_name, start=None, end=None, points=500):
+        """Downsampled series as {"t", "value", "min", "max", "resolution", "samples"}, or None."""
+        pyramid = self.pyramid(session_name, series_name)
+        if pyramid is None:
+            return None
+        points = min(max(int(points), 3), self.MAX_POINTS)
+        budget = self.OVERSAMPLE * points
+        with loop_monitor.measure("HistoryService.query"):
+            raw = pyramid.series.slice(start, end)
+            if len(raw) <= budget:
+                t = np.asarray(raw["t"], dtype=np.float64)
+                v = np.asarray(raw["value"], dtype=np.float64)
+                low = high = v
+                resolution = 0.0
+            else:
+                level = pyramid.levels[-1]
+                for finer, candidate in zip([None] + pyramid.levels, pyramid.levels):
+                    lo, hi = candidate.range(start, end)
+                    if hi - lo <= budget:
+                        # Too coarse to fill the chart; the finer level is one level ratio over budget at most
+                        level = finer if hi - lo < points and finer is not None else candidate
+                        break
+                lo, hi = level.range(start, end)
+                counts = level.count[lo:hi]
+                t = level.start[lo:hi] + level.width / 2
+                v = level.sum[lo:hi] / counts
+                low, high = level.min[lo:hi], level.max[lo:hi]
+                resolution = level.width
+            selected = lttb(t, v, points)
+            if len(selected) and len(selected) < len(t):
+                # Envelope of every output point over the input samples it stands for
+                bounds = np.concatenate(([0], (selected[:-1] + selected[1:] + 1) // 2))
+                low = np.minimum.reduceat(low, bounds)
+                high = np.maximum.reduceat(high, bounds)
+            else:
+                low, high = low[selected], high[selected]
+            return {
+                "t": t[selected].tolist(),
+                "value": v[selected].tolist(),
+                "min": low.tolist(),
+                "max": high.tolist(),
+                "resolution": resolution,
+                "samples": len(raw),
+            }
+
+
+history_service = HistoryService(history)
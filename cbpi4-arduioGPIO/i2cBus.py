@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class I2CBus:
+    """
+    Shared access to one I2C port of a Telemetrix board.
+
+    TelemetrixAIO keeps a single read callback per port, replaced on every i2c_read(), so two
+    devices read through it directly would receive each other's data. The bus always passes its
+    own dispatcher and hands every read report to the oldest pending read of the same address and
+    register, which also lets read() be awaited like a plain function.
+    """
+
+    _buses = {}
+
+    def __init__(self, board, port=0):
+        self.board = board
+        self.port = port
+        self._started = False
+        self._pending = {}
+
+    @classmethod
+    def get(cls, board, port=0):
+        bus = cls._buses.get((id(board), port))
+        if bus is None or bus.board is not board:
+            bus = cls._buses[(id(board), port)] = cls(board, port)
+        return bus
+
+    async def start(self):
+        if not self._started:
+            await self.board.set_pin_mode_i2c(self.port)
+            self._started = True
+
+    async def write(self, address, data):
+        await self.board.i2c_write(address, list(data), i2c_port=self.port)
+
+    async def read(self, address, register, count, timeout=0.5):
+        """Read `count` bytes from `register`; raises asyncio.TimeoutError if no report arrives."""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._pending.setdefault((address, register), deque())
+        queue.append(future)
+        try:
+            await self.board.i2c_read(address, register, count, self._dispatch, i2c_port=self.port)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if future in queue:
+                queue.remove(future)
+
+    async def _dispatch(self, data):
+        # [I2C_READ_REPORT, port, count, address, register, bytes..., timestamp]
+        address, register = data[3], data[4]
+        queue = self._pending.get((address, register))
+        while queue:
+            future = queue.popleft()
+            if not future.done():
+                future.set_result(list(data[5:-1]))
+                return
+        logger.debug(f"Unexpected I2C report from 0x{address:02x} register {register}")
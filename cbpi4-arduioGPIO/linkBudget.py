@@ -0,0 +1,134 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes on the wire per Telemetrix message, length byte included
+ANALOG_WRITE_BYTES = 5       # length, ANALOG_WRITE, pin, value msb, value lsb
+DIGITAL_WRITE_BYTES = 4      # length, DIGITAL_WRITE, pin, value
+MODIFY_REPORTING_BYTES = 4   # length, MODIFY_REPORTING, report type, pin
+ANALOG_REPORT_BYTES = 5      # length, ANALOG_REPORT, pin, value msb, value lsb
+LOOP_BACK_BYTES = 3          # length, LOOP_COMMAND / LOOP_REPORT, character
+I2C_READ_BYTES = 8           # length, I2C_READ, address, register, count, stop, port, write flag
+I2C_WRITE_BYTES = 5          # length, I2C_WRITE, count, address, port; plus the payload
+I2C_REPORT_BYTES = 6         # length, I2C_READ_REPORT, port, count, address, register; plus the data
+ONE_WIRE_COMMAND_BYTES = 2   # length, ONE_WIRE_RESET / ONE_WIRE_SKIP / ONE_WIRE_READ
+ONE_WIRE_WRITE_BYTES = 4     # length, ONE_WIRE_WRITE, data, power
+ONE_WIRE_SELECT_BYTES = 10   # length, ONE_WIRE_SELECT, 8 ROM code bytes
+ONE_WIRE_REPORT_BYTES = 4    # length, ONE_WIRE_REPORT, subtype, data byte
+DHT_REPORT_BYTES = 11        # length, DHT_REPORT, error, pin, type, 2 sign flags, humidity and temperature
+
+
+class LinkClaim:
+    """
+    A share of the serial link: `rate` events per second, each costing `out_bytes` host -> board
+    and `in_bytes` board -> host. Elastic claims (max_rate above rate) may be granted anything
+    between `rate` and `requested`, fixed claims always get `rate`.
+    """
+
+    def __init__(self, budget, name, rate, out_bytes=0, in_bytes=0, max_rate=None):
+        self.budget = budget
+        self.name = name
+        self.min_rate = rate
+        self.max_rate = max(max_rate, rate) if max_rate is not None else rate
+        self.requested = rate
+        self.out_bytes = out_bytes
+        self.in_bytes = in_bytes
+
+    def request(self, rate):
+        """Ask for `rate` events per second, clamped to the claim's range."""
+        self.requested = min(max(rate, self.min_rate), self.max_rate)
+
+    @property
+    def granted(self):
+        return self.budget.grant(self)
+
+    def release(self):
+        self.budget.release(self)
+
+    def snapshot(self):
+        return {
+            "min_rate": round(self.min_rate, 3),
+            "requested": round(self.requested, 3),
+            "granted": round(self.granted, 3),
+            "out_bytes": self.out_bytes,
+            "in_bytes": self.in_bytes,
+        }
+
+
+class LinkBudget:
+    """
+    Model of one board's serial link and allocator of its capacity.
+
+    Each direction of the full-duplex UART carries baud / 10 bytes per second (8N1); `headroom`
+    of that is handed out so command latency stays low. Every subscribed pin and control loop
+    holds a LinkClaim. Minimum rates are reserved first; the capacity left in the tighter of the
+    two directions is shared between the elastic claims in proportion to how much more than their
+    minimum they request. claim() warns when the minimum rates alone oversubscribe the link.
+    """
+
+    def __init__(self, baud_rate=115200, headroom=0.7):
+        self.claims = {}
+        self.configure(baud_rate, headroom)
+
+    def configure(self, baud_rate, headroom):
+        self.baud_rate = baud_rate
+        self.headroom = headroom
+        self.capacity = baud_rate / 10.0 * headroom
+        self._check()
+
+    def claim(self, name, rate, out_bytes=0, in_bytes=0, max_rate=None):
+        """Register (or replace) the claim `name`."""
+        claim = LinkClaim(self, name, rate, out_bytes, in_bytes, max_rate)
+        self.claims[name] = claim
+        self._check(claim)
+        return claim
+
+    def release(self, claim):
+        if self.claims.get(claim.name) is claim:
+            del self.claims[claim.name]
+
+    def release_name(self, name):
+        self.claims.pop(name, None)
+
+    def _load(self, attribute):
+        """Minimum and elastic bytes/s per direction."""
+        load = {}
+        for direction in ("out_bytes", "in_bytes"):
+            reserved = extra = 0.0
+            for claim in self.claims.values():
+                cost = getattr(claim, direction)
+                reserved += claim.min_rate * cost
+                extra += (getattr(claim, attribute) - claim.min_rate) * cost
+            load[direction] = (reserved, extra)
+        return load
+
+    def _check(self, claim=None):
+        for direction, (reserved, _) in self._load("requested").items():
+            if reserved > self.capacity:
+                culprit = f" after adding {claim.name}" if claim is not None else ""
+                logger.warning(f"Serial link oversubscribed{culprit}: minimum {direction.split('_')[0]} load "
+                               f"{reserved:.0f} B/s exceeds the {self.capacity:.0f} B/s budget")
+
+    def scale(self):
+        """Fraction of the elastic requests above the minimums that fits, 0..1."""
+        scale = 1.0
+        for reserved, extra in self._load("requested").values():
+            if extra > 0:
+                scale = min(scale, max(self.capacity - reserved, 0.0) / extra)
+        return scale
+
+    def grant(self, claim):
+        if claim.requested <= claim.min_rate:
+            return claim.min_rate
+        return claim.min_rate + (claim.requested - claim.min_rate) * self.scale()
+
+    def snapshot(self):
+        load = self._load("requested")
+        scale = self.scale()
+        return {
+            "capacity": round(self.capacity),
+            "load_out": round(load["out_bytes"][0] + load["out_bytes"][1] * scale, 1),
+            "load_in": round(load["in_bytes"][0] + load["in_bytes"][1] * scale, 1),
+            "scale": round(scale, 3),
+            "claims": {name: claim.snapshot() for name, claim in self.claims.items()},
+        }
@@ -0,0 +1,199 @@
+import time
+
+COMMAND_NAMES = {
+    0: "loop_back",
+    1: "set_pin_mode",
+    2: "digital_write",
+    3: "analog_write",
+    4: "modify_reporting",
+    5: "get_firmware_version",
+    6: "are_you_there",
+    10: "i2c_begin",
+    11: "i2c_read",
+    12: "i2c_write",
+    14: "dht_new",
+    15: "stop_all_reports",
+    16: "set_analog_scan_interval",
+    17: "enable_all_reports",
+    18: "reset",
+    24: "onewire_init",
+    54: "get_features",
+    55: "sonar_disable",
+    56: "sonar_enable",
+    57: "failsafe_config",
+    58: "failsafe_pin",
+}
+
+PIN_MODE_NAMES = {0: "digital_input", 1: "output", 2: "digital_input_pullup", 3: "analog_input"}
+
+REPORT_NAMES = {0: "loop_back", 2: "digital", 3: "analog", 10: "i2c_read", 12: "dht", 14: "onewire", 20: "features"}
+
+# Commands whose first argument is a pin number
+PIN_COMMANDS = {1, 2, 3}
+PIN_REPORTS = {2, 3}
+
+
+def command_key(command):
+    """Return (name, pin) for a Telemetrix command list without the length prefix."""
+    kind = command[0]
+    name = COMMAND_NAMES.get(kind, f"command_{kind}")
+    if kind == 1 and len(command) > 2:
+        name = "set_pin_mode_" + PIN_MODE_NAMES.get(command[2], str(command[2]))
+    pin = command[1] if kind in PIN_COMMANDS and len(command) > 1 else None
+    return name, pin
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of integer microsecond values, in the spirit of HdrHistogram.
+
+    Values below 32 us get exact buckets; above that every power of two is split into 16
+    sub-buckets, so any recorded value is reproduced within ~6 % with a fixed bucket array and an
+    O(1) record().
+    """
+
+    SUB_BUCKETS = 16
+    MAX_SHIFT = 28  # values up to ~2^32 us (over an hour)
+
+    def __init__(self):
+        self.counts = [0] * (2 * self.SUB_BUCKETS + self.MAX_SHIFT * self.SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < 2 * self.SUB_BUCKETS:
+            return value
+        shift = min(value.bit_length() - 5, self.MAX_SHIFT)
+        top = min(value >> shift, 2 * self.SUB_BUCKETS - 1)
+        return 2 * self.SUB_BUCKETS + (shift - 1) * self.SUB_BUCKETS + (top - self.SUB_BUCKETS)
+
+    def _lower_bound(self, index):
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        offset = index - 2 * self.SUB_BUCKETS
+        shift = offset // self.SUB_BUCKETS + 1
+        return (self.SUB_BUCKETS + offset % self.SUB_BUCKETS) << shift
+
+    def record(self, seconds):
+        value = max(int(seconds * 1e6), 0)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """Return the q-th percentile (0-100) in microseconds, or None when empty."""
+        if not self.count:
+            return None
+        threshold = self.count * q / 100.0
+        running = 0
+        for index, bucket in enumerate(self.counts):
+            running += bucket
+            if bucket and running >= threshold:
+                return self._lower_bound(index)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "min_us": self.min,
+            "max_us": self.max,
+            "mean_us": round(self.total / self.count, 1) if self.count else None,
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+        }
+
+
+class RateMeter:
+    """Bytes (or events) per second over the last completed `window` seconds."""
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.total = 0
+        self._current = 0
+        self._window_start = time.monotonic()
+        self.rate = 0.0
+
+    def add(self, amount, now=None):
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._window_start
+        if elapsed >= self.window:
+            self.rate = self._current / elapsed
+            self._current = 0
+            self._window_start = now
+        self._current += amount
+        self.total += amount
+
+    def current_rate(self, now=None):
+        now = time.monotonic() if now is None else now
+        if now - self._window_start >= 2 * self.window:
+            return 0.0
+        return self.rate
+
+
+class LinkStats:
+    """
+    Counters and latency histograms for the serial link of one board.
+
+    The service calls command_started()/command_finished() around every serial write and
+    on_report() for every inbound report. Everything is plain dict/int arithmetic so it is cheap
+    enough to leave on permanently; snapshot() turns it into a JSON-friendly dict.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.latency = {}
+        self.report_counts = {}
+        self.last_report = {}
+        self.tx = RateMeter()
+        self.rx = RateMeter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = time.monotonic()
+
+    def command_started(self):
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+        return time.perf_counter()
+
+    def command_finished(self, key, size, started):
+        self.in_flight -= 1
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = LatencyHistogram()
+        histogram.record(time.perf_counter() - started)
+        self.commands[key] = self.commands.get(key, 0) + 1
+        self.tx.add(size + 1)  # plus the length prefix
+
+    def on_report(self, report, data):
+        pin = data[0] if report in PIN_REPORTS and data else None
+        key = (REPORT_NAMES.get(report, f"report_{report}"), pin)
+        self.report_counts[key] = self.report_counts.get(key, 0) + 1
+        self.last_report[key] = time.monotonic()
+        self.rx.add(len(data) + 2)  # plus length and report id
+
+    def snapshot(self):
+        now = time.monotonic()
+
+        def label(key):
+            name, pin = key
+            return name if pin is None else f"{name}[{pin}]"
+
+        return {
+            "uptime_s": round(now - self.started, 1),
+            "tx_bytes": self.tx.total,
+            "rx_bytes": self.rx.total,
+            "tx_bytes_per_s": round(self.tx.current_rate(now), 1),
+            "rx_bytes_per_s": round(self.rx.current_rate(now), 1),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "commands": {label(key): dict(self.latency[key].snapshot(), count=count)
+                         for key, count in self.commands.items()},
+            "reports": {label(key): {"count": count, "age_s": round(now - self.last_report[key], 3)}
+                        for key, count in self.report_counts.items()},
+        }
@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+from .linkStats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStats:
+    """Wakeup count and CPU/wall time of one instrumented run() loop."""
+
+    def __init__(self, name):
+        self.name = name
+        self.wakeups = 0
+        self.cpu_time = 0.0
+        self.busy_time = 0.0
+        self.max_step = 0.0
+        self.slow_steps = 0
+        self.running = False
+
+    def snapshot(self):
+        return {
+            "wakeups": self.wakeups,
+            "cpu_s": round(self.cpu_time, 4),
+            "busy_s": round(self.busy_time, 4),
+            "max_step_ms": round(self.max_step * 1000, 2),
+            "slow_steps": self.slow_steps,
+            "running": self.running,
+        }
+
+
+class _InstrumentedCoroutine:
+    """
+    Awaitable that drives a coroutine step by step and times every step.
+
+    Each send() into the wrapped coroutine is one wakeup of the task; the time spent inside it is
+    exactly the time the task held the event loop, so slow steps can be attributed to it.
+    """
+
+    def __init__(self, coro, stats, monitor):
+        self._coro = coro
+        self._stats = stats
+        self._monitor = monitor
+
+    def __await__(self):
+        coro, stats, monitor = self._coro, self._stats, self._monitor
+        value, error = None, None
+        stats.running = True
+        try:
+            while True:
+                started, started_cpu = time.perf_counter(), time.thread_time()
+                try:
+                    if error is not None:
+                        yielded = coro.throw(error)
+                    else:
+                        yielded = coro.send(value)
+                except StopIteration as e:
+                    monitor._record_step(stats, time.perf_counter() - started, time.thread_time() - started_cpu)
+                    return e.value
+                monitor._record_step(stats, time.perf_counter() - started, time.thread_time() - started_cpu)
+                try:
+                    value, error = (yield yielded), None
+                except GeneratorExit:
+                    coro.close()
+                    raise
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            stats.running = False
+
+
+class LoopMonitor:
+    """
+    Measures event-loop lag continuously and keeps per-task step statistics.
+
+    The lag probe sleeps for `interval` and records how late it wakes up. Plugin run() loops are
+    instrumented with the @monitored decorator; any single step longer than `slow_threshold` is
+    logged with the name of the task that caused it.
+    """
+
+    def __init__(self, interval=0.1, slow_threshold=0.05):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lag = LatencyHistogram()
+        self.max_lag = 0.0
+        self.tasks = {}
+        self.blocking = {}
+        self._task = None
+
+    def start(self, interval=None, slow_threshold=None):
+        if interval is not None:
+            self.interval = interval
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._probe())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.lag.record(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def task_stats(self, name):
+        stats = self.tasks.get(name)
+        if stats is None:
+            stats = self.tasks[name] = TaskStats(name)
+        return stats
+
+    def _record_step(self, stats, elapsed, cpu):
+        stats.wakeups += 1
+        stats.busy_time += elapsed
+        stats.cpu_time += cpu
+        if elapsed > stats.max_step:
+            stats.max_step = elapsed
+        if elapsed > self.slow_threshold:
+            stats.slow_steps += 1
+            logger.warning(f"Slow step in {stats.name}: held the event loop for {elapsed * 1000:.1f} ms")
+
+    @contextmanager
+    def measure(self, name):
+        """Time a synchronous block (file I/O, curve fitting) that runs on the event loop thread."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.blocking.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+            if elapsed > self.slow_threshold:
+                logger.warning(f"Blocking call {name} took {elapsed * 1000:.1f} ms on the event loop")
+
+    def snapshot(self):
+        return {
+            "lag": dict(self.lag.snapshot(), max_us=int(self.max_lag * 1e6)),
+            "tasks": {name: stats.snapshot() for name, stats in self.tasks.items()},
+            "blocking": {name: {key: round(value, 3) for key, value in stats.items()}
+                         for name, stats in self.blocking.items()},
+        }
+
+
+loop_monitor = LoopMonitor()
+
+
+def monitored(run):
+    """Decorator for actor/sensor/step run() methods: account every wakeup to the instance."""
+    @functools.wraps(run)
+    async def wrapper(self, *args, **kwargs):
+        name = f"{type(self).__name__}:{getattr(self, 'id', '?')}"
+        return await _InstrumentedCoroutine(run(self, *args, **kwargs), loop_monitor.task_stats(name), loop_monitor)
+    return wrapper
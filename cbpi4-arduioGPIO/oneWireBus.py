@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+
+from .TelemetrixAioService import TelemetrixAioService
+from .controlScheduler import ControlScheduler
+from .linkBudget import ONE_WIRE_COMMAND_BYTES, ONE_WIRE_REPORT_BYTES, ONE_WIRE_SELECT_BYTES, ONE_WIRE_WRITE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# ROM and function commands
+CONVERT_T = 0x44
+READ_SCRATCHPAD = 0xBE
+DS18B20_FAMILY = 0x28
+
+# Telemetrix ONE_WIRE_REPORT subtypes
+REPORT_RESET = 25
+REPORT_READ = 29
+REPORT_SEARCH = 31
+
+# 12-bit conversion time of a DS18B20
+CONVERSION_TIME = 0.75
+
+
+def crc8(data):
+    """Dallas/Maxim CRC-8 (x^8 + x^5 + x^4 + 1) used for ROM codes and scratchpads."""
+    crc = 0
+    for byte in data:
+        for _ in range(8):
+            mix = (crc ^ byte) & 0x01
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
+
+
+def format_address(address):
+    return "-".join(f"{byte:02x}" for byte in address)
+
+
+def parse_address(text):
+    return [int(part, 16) for part in str(text).replace(":", "-").split("-") if part]
+
+
+class OneWireBus:
+    """
+    The OneWire bus of a Telemetrix board and the DS18B20 probes on it.
+
+    Telemetrix4Arduino drives a single OneWire pin per board and answers every bus command with a
+    report on one shared callback, so commands go through a lock and each awaits its own report.
+
+    Conversions are pipelined across probes: every cycle starts a conversion on all probes at
+    once (skip ROM + CONVERT T), and one conversion time later the scratchpads are read back one
+    probe after the other. No probe is ever waited on by itself, so the bus cycle costs one
+    conversion time however many probes are fitted. Every probe read in a cycle is stamped with
+    the time its conversion started and handed to the subscribers of its address.
+    """
+
+    _buses = {}
+
+    def __init__(self, board, pin):
+        self.board = board
+        self.pin = pin
+        self.addresses = []
+        self.subscribers = {}   # address string -> (callback, period)
+        self.errors = 0
+        self._started = False
+        self._lock = asyncio.Lock()
+        self._reply = None
+        self._job = None
+        self._busy = False
+
+    @classmethod
+    def get(cls, board, pin):
+        bus = cls._buses.get(id(board))
+        if bus is None or bus.board is not board:
+            bus = cls._buses[id(board)] = cls(board, pin)
+        elif bus.pin != pin:
+            raise ValueError(f"OneWire is already running on pin {bus.pin}; the firmware supports one bus per board")
+        return bus
+
+    @property
+    def name(self):
+        return f"onewire:{self.pin}"
+
+    async def start(self):
+        if self._started:
+            return
+        await self.board.set_pin_mode_one_wire(self.pin)
+        self._started = True
+        self.addresses = await self.search()
+        logger.info(f"OneWire pin {self.pin}: found {', '.join(self.addresses) or 'no devices'}")
+
+    async def _report(self, data):
+        # [ONE_WIRE_REPORT, subtype, data..., timestamp]
+        if self._reply is not None and not self._reply.done():
+            self._reply.set_result(data[1:-1])
+
+    async def _request(self, command, timeout=0.5):
+        self._reply = asyncio.get_running_loop().create_future()
+        await command(self._report)
+        return await asyncio.wait_for(self._reply, timeout)
+
+    async def _reset(self):
+        _, present = await self._request(self.board.onewire_reset)
+        # The firmware reports OneWire.reset(): 1 when a presence pulse was seen
+        if not present:
+            raise IOError(f"No OneWire device answered on pin {self.pin}")
+
+    async def _read_bytes(self, count):
+        return [(await self._request(self.board.onewire_read))[1] for _ in range(count)]
+
+    async def search(self):
+        """ROM codes of all DS18B20 on the bus."""
+        found = []
+        async with self._lock:
+            await self.board.onewire_reset_search()
+            for _ in range(64):
+                reply = await self._request(self.board.onewire_search)
+                address = list(reply[1:9])
+                if address == [0xFF] * 8:
+                    break
+                if crc8(address[:7]) != address[7] or address[0] != DS18B20_FAMILY:
+                    continue
+                found.append(format_address(address))
+        return found
+
+    def subscribe(self, address, callback, period):
+        """Deliver (temperature, timestamp) for `address` to `callback` at least every `period` s."""
+        self.subscribers[address] = (callback, period)
+        self._reschedule()
+
+    def unsubscribe(self, address):
+        self.subscribers.pop(address, None)
+        self._reschedule()
+
+    def _reschedule(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        TelemetrixAioService.link_budget.release_name(self.name)
+        if not self.subscribers:
+            return
+        period = max(min(period for _, period in self.subscribers.values()), CONVERSION_TIME + 0.25)
+        probes = len(self.subscribers)
+        # Convert: reset, skip, write. Per probe: reset, select, write, 9 reads
+        out_bytes = 2 * ONE_WIRE_COMMAND_BYTES + ONE_WIRE_WRITE_BYTES + \
+            probes * (ONE_WIRE_COMMAND_BYTES + ONE_WIRE_SELECT_BYTES + ONE_WIRE_WRITE_BYTES + 9 * ONE_WIRE_COMMAND_BYTES)
+        in_bytes = (1 + probes * 10) * ONE_WIRE_REPORT_BYTES
+        TelemetrixAioService.claim_link(self.name, 1.0 / period, out_bytes, in_bytes)
+        self._job = ControlScheduler.get().every(period, self._cycle, name=self.name)
+
+    async def _cycle(self):
+        if self._busy:
+            return
+        self._busy = True
+        try:
+            stamp = time.time()
+            async with self._lock:
+                await self._reset()
+                await self.board.onewire_skip()
+                await self.board.onewire_write(CONVERT_T)
+            await asyncio.sleep(CONVERSION_TIME)
+            for address, (callback, _) in list(self.subscribers.items()):
+                try:
+                    temperature = await self._read_probe(address)
+                except (asyncio.TimeoutError, IOError, ValueError) as e:
+                    self.errors += 1
+                    logger.warning(f"{self.name}: probe {address} read failed ({e or 'timeout'})")
+                    continue
+                await callback(temperature, stamp)
+        except (asyncio.TimeoutError, IOError) as e:
+            self.errors += 1
+            logger.warning(f"{self.name}: conversion failed ({e or 'timeout'})")
+        finally:
+            self._busy = False
+
+    async def _read_probe(self, address):
+        async with self._lock:
+            await self._reset()
+            await self.board.onewire_select(parse_address(address))
+            await self.board.onewire_write(READ_SCRATCHPAD)
+            scratchpad = await self._read_bytes(9)
+        if crc8(scratchpad[:8]) != scratchpad[8]:
+            raise ValueError("scratchpad CRC mismatch")
+        raw = scratchpad[0] | (scratchpad[1] << 8)
+        if raw & 0x8000:
+            raw -= 0x10000
+        return raw / 16.0
@@ -0,0 +1,97 @@
+import logging
+
+from .controlScheduler import ControlScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class OutputRamp:
+    """
+    Slew-rate limiter for a PWM output.
+
+    move_to() starts (or retargets) a ramp from the current output towards the target at no
+    more than `slew_rate` output units per second. Intermediate values are written from a job on
+    the shared ControlScheduler every `period` seconds, and only when the rounded output actually
+    changes. With `s_curve` the ramp follows a smoothstep profile so it starts and ends with zero
+    slope; its duration is stretched so the steepest point still respects `slew_rate`.
+    A slew rate of 0 disables ramping and writes the target immediately.
+    """
+
+    def __init__(self, write, slew_rate=0.0, s_curve=False, period=0.05, name=None):
+        self.write = write
+        self.slew_rate = float(slew_rate)
+        self.s_curve = s_curve
+        self.period = period
+        self.name = name
+        self.position = 0
+        self.target = 0
+        self._start_value = 0
+        self._start_time = 0.0
+        self._duration = 0.0
+        self._job = None
+
+    @property
+    def active(self):
+        return self._job is not None
+
+    def _value_at(self, now):
+        if self._duration <= 0:
+            return self.target
+        fraction = min(max((now - self._start_time) / self._duration, 0.0), 1.0)
+        if self.s_curve:
+            fraction = fraction * fraction * (3 - 2 * fraction)
+        return self._start_value + (self.target - self._start_value) * fraction
+
+    async def _emit(self, value):
+        value = int(round(value))
+        if value != self.position:
+            self.position = value
+            await self.write(value)
+
+    async def move_to(self, target):
+        """Ramp to `target`; a ramp already in progress is retargeted from where it is now."""
+        target = int(round(target))
+        scheduler = ControlScheduler.get()
+        now = scheduler.time()
+        if self.active:
+            self.position = int(round(self._value_at(now)))
+        self.target = target
+
+        if self.slew_rate <= 0 or target == self.position:
+            self.cancel()
+            await self._emit(target)
+            return
+
+        distance = abs(target - self.position)
+        self._start_value = self.position
+        self._start_time = now
+        # Smoothstep peaks at 1.5x the average slope
+        self._duration = distance / self.slew_rate * (1.5 if self.s_curve else 1.0)
+        if self._job is None:
+            self._job = scheduler.every(self.period, self._step, name=self.name, start_delay=self.period)
+
+    async def _step(self):
+        now = ControlScheduler.get().time()
+        await self._emit(self._value_at(now))
+        if now - self._start_time >= self._duration:
+            await self._emit(self.target)
+            self.cancel()
+
+    def cancel(self):
+        """Stop ramping where the output is now; the caller decides what to write next."""
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    async def jump_to(self, value):
+        """Cancel any ramp and write `value` immediately (used for off / emergency stop)."""
+        self.cancel()
+        self.target = int(round(value))
+        self.position = self.target
+        await self.write(self.target)
+
+    def sync(self, value):
+        """Record an output that was written outside the ramp (e.g. by a group batch write)."""
+        self.cancel()
+        self.target = int(round(value))
+        self.position = self.target
@@ -4,6 +4,10 @@ from cbpi.api import parameters, Property, CBPiActor
 from cbpi.api import *
 import logging
 
+from .actorUpdates import ActorUpdateCoalescer
+from .controlScheduler import ControlScheduler
+from .loopMonitor import monitored
+
 @parameters([Property.Text(label="Topic", configurable=True, description = "MQTT Topic"),
              Property.Number(label="MaxOutput",configurable=True,description="Max Output Value")])
 class OutputMQTTActor(CBPiActor):
@@ -31,6 +35,8 @@ class OutputMQTTActor(CBPiActor):
 
     def __init__(self, cbpi, id, props):
         super(OutputMQTTActor, self).__init__(cbpi, id, props)
+        self.state = False
+        self.ui_updates = ActorUpdateCoalescer.for_actor(self)
 
     async def on_start(self):
         self.topic = self.props.get("Topic", None)
@@ -42,6 +48,7 @@ class OutputMQTTActor(CBPiActor):
         self.state = False
 
     async def on(self, power=None, output=None):
+        was_on = self.state
         if power is not None:
             if power != self.power:
                 power = min(100, power)
@@ -52,9 +59,8 @@ class OutputMQTTActor(CBPiActor):
                 output = min(self.maxoutput, output)
                 output = max(0, output)
                 self.output = round(output)
-        await self.cbpi.actor.actor_update(self.id,self.power)
-        await self.cbpi.actor.actor_update(self.id,self.output)
         self.state = True
+        await self.ui_updates.push(self.power, self.output, force=not was_on)
         pass
 
     async def off(self):
@@ -63,9 +69,9 @@ class OutputMQTTActor(CBPiActor):
             {"state": "off", "power": 0, "output": 0}), True)
         pass
 
+    @monitored
     async def run(self):
-        while self.running:
-            await asyncio.sleep(1)
+        await ControlScheduler.get().park(self)
 
     def get_state(self):
         return self.state
@@ -77,7 +83,7 @@ class OutputMQTTActor(CBPiActor):
             await self.on(power, self.output)
         else:
             await self.off()
-        await self.cbpi.actor.actor_update(self.id,self.power, self.output)
+        await self.ui_updates.push(self.power, self.output)
         pass
 
     async def set_output(self, output):
@@ -87,5 +93,5 @@ class OutputMQTTActor(CBPiActor):
             await self.on(self.power, self.output)
         else:
             await self.off()
-        await self.cbpi.actor.actor_update(self.id,self.power, self.output)
+        await self.ui_updates.push(self.power, self.output)
         pass
\ No newline at end of file
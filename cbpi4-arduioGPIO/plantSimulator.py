@@ -0,0 +1,342 @@
+import asyncio
+import bisect
+import logging
+import math
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock:
+    """
+    A monotonic clock that runs `speed` times faster than wall time.
+
+    The clock can also be stepped manually with advance(), which is what the closed-loop
+    helpers below do so that a whole brew-day step replays in a fraction of a second.
+    Pass clock.time as the `time_fn` of a PID to put the controller on the same timebase.
+    """
+
+    def __init__(self, speed=100.0, start=0.0):
+        self.speed = float(speed)
+        self._offset = float(start)
+        self._real_start = time.monotonic()
+        self._manual = False
+
+    def time(self):
+        if self._manual:
+            return self._offset
+        return self._offset + (time.monotonic() - self._real_start) * self.speed
+
+    def advance(self, seconds):
+        """Switch the clock to manual mode and move it forward by `seconds` of virtual time."""
+        if not self._manual:
+            self._offset = self.time()
+            self._manual = True
+        self._offset += seconds
+        return self._offset
+
+    async def sleep(self, seconds):
+        """Sleep for `seconds` of virtual time."""
+        if self._manual:
+            self.advance(seconds)
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(seconds / self.speed)
+
+
+class PumpCurve:
+    """
+    Centrifugal pump against a fixed system curve.
+
+    Shut-off head scales with the square of the PWM duty (affinity laws), the system head is
+    static lift plus a quadratic friction term, and the operating flow is where the two meet.
+    """
+
+    def __init__(self, max_output=255, shutoff_head=6.0, static_head=0.5, pump_k=0.004, system_k=0.008):
+        self.max_output = max_output
+        self.shutoff_head = shutoff_head  # m at full duty and zero flow
+        self.static_head = static_head  # m of lift the pump has to overcome
+        self.pump_k = pump_k  # m / (L/min)^2 droop of the pump curve
+        self.system_k = system_k  # m / (L/min)^2 friction of the piping
+
+    def flow(self, output):
+        """Return the operating flow in L/min for a PWM output value."""
+        duty = min(max(output / self.max_output, 0.0), 1.0)
+        available = self.shutoff_head * duty ** 2 - self.static_head
+        if available <= 0:
+            return 0.0
+        return math.sqrt(available / (self.pump_k + self.system_k))
+
+
+class PipeDeadTime:
+    """Pure transport delay: returns the value that entered the pipe `dead_time` seconds ago."""
+
+    def __init__(self, dead_time=2.0, initial=0.0):
+        self.dead_time = dead_time
+        self._times = deque()
+        self._values = deque()
+        self._initial = initial
+
+    def push(self, t, value):
+        self._times.append(t)
+        self._values.append(value)
+        # Keep one sample older than the horizon so the delayed value is always defined
+        while len(self._times) > 1 and self._times[1] <= t - self.dead_time:
+            self._times.popleft()
+            self._values.popleft()
+
+    def value(self, t):
+        target = t - self.dead_time
+        index = bisect.bisect_right(self._times, target) - 1
+        if index < 0:
+            return self._initial
+        return self._values[index]
+
+
+class Kettle:
+    """Cylindrical vessel; tracks volume in litres and exposes the liquid level in metres."""
+
+    def __init__(self, diameter=0.4, volume=0.0, max_volume=None, temperature=20.0):
+        self.diameter = diameter
+        self.volume = volume
+        self.max_volume = max_volume
+        self.temperature = temperature
+
+    @property
+    def area(self):
+        return math.pi * (self.diameter / 2) ** 2
+
+    @property
+    def level(self):
+        return (self.volume / 1000) / self.area if self.area else 0.0
+
+    def add(self, litres):
+        self.volume = max(0.0, self.volume + litres)
+        if self.max_volume is not None:
+            self.volume = min(self.volume, self.max_volume)
+
+
+class HeatExchanger:
+    """
+    Counterflow chiller with an effectively infinite coolant stream.
+
+    The steady-state outlet temperature follows effectiveness-NTU (eps = 1 - exp(-UA / m_dot cp));
+    the thermal mass of the plates adds a first-order lag with time constant `tau`.
+    """
+
+    def __init__(self, ua=400.0, coolant_temperature=12.0, tau=8.0, initial=20.0):
+        self.ua = ua  # W/K
+        self.coolant_temperature = coolant_temperature
+        self.tau = tau
+        self.outlet_temperature = initial
+
+    def steady_outlet(self, inlet_temperature, flow):
+        if flow <= 0:
+            return self.coolant_temperature
+        m_dot_cp = (flow / 60.0) * 4186.0  # L/min of wort -> W/K
+        effectiveness = 1.0 - math.exp(-self.ua / m_dot_cp)
+        return inlet_temperature - effectiveness * (inlet_temperature - self.coolant_temperature)
+
+    def step(self, dt, inlet_temperature, flow):
+        target = self.steady_outlet(inlet_temperature, flow)
+        alpha = 1.0 - math.exp(-dt / self.tau) if self.tau > 0 else 1.0
+        self.outlet_temperature += alpha * (target - self.outlet_temperature)
+        return self.outlet_temperature
+
+
+class PlantSimulator:
+    """
+    Transfer/cooling plant: source kettle -> pump -> pipe -> heat exchanger -> destination kettle.
+
+    step(dt) advances the physics by dt seconds of virtual time. The simulator holds no event-loop
+    state of its own, so it can be stepped from a closed-loop benchmark or from SimulatedBoard.
+    """
+
+    def __init__(self, clock=None, pump=None, pipe=None, source=None, destination=None, exchanger=None,
+                 flow_adc_per_lpm=1000 / 22.0, level_adc_per_m=1024.0, noise=0.0):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.pump = pump if pump is not None else PumpCurve()
+        self.pipe = pipe if pipe is not None else PipeDeadTime()
+        self.source = source if source is not None else Kettle(volume=60.0, temperature=95.0)
+        self.destination = destination if destination is not None else Kettle()
+        self.exchanger = exchanger if exchanger is not None else HeatExchanger()
+        self.flow_adc_per_lpm = flow_adc_per_lpm
+        self.level_adc_per_m = level_adc_per_m
+        self.noise = noise
+
+        self.pump_output = 0
+        self.pump_flow = 0.0
+        self.delivered_flow = 0.0
+        self.delivered_volume = 0.0
+        self.digital_outputs = {}
+        self._last_time = self.clock.time()
+
+    def set_pump_output(self, output):
+        self.pump_output = output
+
+    def step(self, dt=None):
+        now = self.clock.time()
+        if dt is None:
+            dt = now - self._last_time
+        self._last_time = now
+        if dt <= 0:
+            return
+
+        self.pump_flow = self.pump.flow(self.pump_output) if self.source.volume > 0 else 0.0
+        self.pipe.push(now, self.pump_flow)
+        self.delivered_flow = self.pipe.value(now)
+
+        self.source.add(-self.pump_flow * dt / 60.0)
+        delivered = self.delivered_flow * dt / 60.0
+        self.destination.add(delivered)
+        self.delivered_volume += delivered
+        self.exchanger.step(dt, self.source.temperature, self.delivered_flow)
+
+    def _with_noise(self, value):
+        if self.noise:
+            import random
+            value += random.gauss(0, self.noise)
+        return value
+
+    def flow_adc(self):
+        """ADC counts a flow meter on the outlet would report."""
+        return int(min(max(self._with_noise(self.delivered_flow * self.flow_adc_per_lpm), 0), 1023))
+
+    def level_adc(self, kettle=None):
+        """ADC counts a pressure sensor at the bottom of `kettle` (default: source) would report."""
+        kettle = kettle if kettle is not None else self.source
+        return int(min(max(self._with_noise(kettle.level * self.level_adc_per_m), 0), 1023))
+
+
+class SimulatedBoard:
+    """
+    Drop-in stand-in for telemetrix_aio.TelemetrixAIO backed by a PlantSimulator.
+
+    Only the subset of the board API used by this plugin is implemented. `wiring` maps pins to
+    plant signals: {"pump": 9, "flow_adc": 0, "source_level_adc": 1, "destination_level_adc": 2,
+    "source_temperature": 4, "outlet_temperature": 5}.
+    Analog callbacks fire whenever the reported value moves by at least the pin's differential,
+    just like the real firmware, every `report_interval` seconds of virtual time.
+    """
+
+    def __init__(self, plant, wiring=None, report_interval=0.05):
+        self.plant = plant
+        self.wiring = wiring if wiring is not None else {}
+        self.report_interval = report_interval
+        self.serial_port = "simulator"
+        self.analog_callbacks = {}
+        self._differentials = {}
+        self._reporting = set()
+        self._last_reported = {}
+        self.pin_modes = {}
+        self._task = None
+
+    async def start_aio(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self.plant.clock.sleep(self.report_interval)
+            self.plant.step()
+            await self.report_analog()
+
+    def read_analog(self, pin):
+        if pin == self.wiring.get("flow_adc"):
+            return self.plant.flow_adc()
+        if pin == self.wiring.get("source_level_adc"):
+            return self.plant.level_adc(self.plant.source)
+        if pin == self.wiring.get("destination_level_adc"):
+            return self.plant.level_adc(self.plant.destination)
+        return 0
+
+    def read_temperature(self, pin):
+        """Temperature a probe on `pin` would measure, None for unwired pins."""
+        if pin == self.wiring.get("source_temperature"):
+            return self.plant.source.temperature
+        if pin == self.wiring.get("outlet_temperature"):
+            return self.plant.exchanger.outlet_temperature
+        return None
+
+    async def report_analog(self):
+        for pin in list(self._reporting):
+            callback = self.analog_callbacks.get(pin)
+            if callback is None:
+                continue
+            value = self.read_analog(pin)
+            last = self._last_reported.get(pin)
+            if last is not None and abs(value - last) < self._differentials.get(pin, 0):
+                continue
+            self._last_reported[pin] = value
+            await callback([3, pin, value, time.time()])
+
+    async def set_pin_mode_analog_output(self, pin_number):
+        self.pin_modes[pin_number] = "pwm"
+
+    async def set_pin_mode_digital_output(self, pin_number):
+        self.pin_modes[pin_number] = "output"
+
+    async def set_pin_mode_analog_input(self, pin_number, differential=0, callback=None):
+        self.pin_modes[pin_number] = "analog"
+        self.analog_callbacks[pin_number] = callback
+        self._differentials[pin_number] = differential
+        self._reporting.add(pin_number)
+
+    async def enable_analog_reporting(self, pin):
+        self._reporting.add(pin)
+        self._last_reported.pop(pin, None)
+
+    async def disable_analog_reporting(self, pin):
+        self._reporting.discard(pin)
+
+    async def analog_write(self, pin, value):
+        if pin == self.wiring.get("pump"):
+            self.plant.set_pump_output(value)
+
+    async def digital_write(self, pin, value):
+        self.plant.digital_outputs[pin] = value
+        if pin == self.wiring.get("pump"):
+            self.plant.set_pump_output(self.plant.pump.max_output if value else 0)
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def run_closed_loop(plant, controller, duration, dt=0.1, control_period=1.0):
+    """
+    Run `controller` against `plant` for `duration` seconds of virtual time without touching the
+    event loop. `controller(plant)` is called every `control_period` and returns a pump output.
+
+    Returns a list of (time, pump_output, delivered_flow, delivered_volume, outlet_temperature).
+    """
+    trace = []
+    next_control = plant.clock.time()
+    end = plant.clock.time() + duration
+    while plant.clock.time() < end:
+        now = plant.clock.time()
+        if now >= next_control:
+            plant.set_pump_output(controller(plant))
+            next_control += control_period
+        plant.clock.advance(dt)
+        plant.step(dt)
+        trace.append((plant.clock.time(), plant.pump_output, plant.delivered_flow,
+                      plant.delivered_volume, plant.exchanger.outlet_temperature))
+    return trace
+
+
+def benchmark_flow_pid(pid, setpoint, duration=300.0, dt=0.1, plant=None):
+    """
+    Score a flow PID tuning on the simulated transfer: integrated absolute error, overshoot and
+    the time to first reach 95 % of setpoint. `pid` should be built with time_fn=plant.clock.time.
+    """
+    plant = plant if plant is not None else PlantSimulator(clock=VirtualClock())
+    pid.setpoint = setpoint
+    trace = run_closed_loop(plant, lambda p: pid(p.delivered_flow) or 0, duration, dt, pid.sample_time or dt)
+
+    start = trace[0][0] if trace else 0.0
+    iae = sum(abs(setpoint - flow) * dt for _, _, flow, _, _ in trace)
+    peak = max((flow for _, _, flow, _, _ in trace), default=0.0)
+    rise = next((t - start for t, _, flow, _, _ in trace if flow >= 0.95 * setpoint), None)
+    return {"iae": iae, "overshoot": max(0.0, peak - setpoint), "rise_time": rise, "trace": trace}
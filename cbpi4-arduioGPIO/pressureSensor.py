@@ -7,28 +7,47 @@ from cbpi.api.dataclasses import NotificationAction, NotificationType
 from collections import deque
 
 from .TelemetrixAioService import TelemetrixAioService
+from .adaptiveSampling import AdaptiveSampler
+from .boardProfiles import ANALOG, I2C, PinConflict, pin_options
+from .controlScheduler import ControlScheduler
+from .linkBudget import ANALOG_REPORT_BYTES, MODIFY_REPORTING_BYTES
+from .ads1115 import ADS1115
+from .burstCapture import run_burst
+from .i2cBus import I2CBus
+from .loopMonitor import monitored
+from .timeSeries import history
 
 logger = logging.getLogger(__name__)
 
 
 
+def level_properties(adc_high=1024):
+    """Conversion, filter and rate properties shared by the level sensors of this module."""
+    return [
+        Property.Select("sensorType", options=["Liquid Level", "Volume"], description="Select the output data type"),
+        Property.Number("adcLow", configurable=True, default_value=0, description="ADC value at minimum liquid level, usually 0"),
+        Property.Number("adcHigh", configurable=True, default_value=adc_high, description=f"ADC value at maximum liquid level, usually {adc_high}"),
+
+        # Sensor Height and Kettle Diameter
+        Property.Number("sensorHeight", configurable=True, default_value=0, description="Location of the sensor from the bottom of the kettle"),
+        Property.Number("kettleDiameter", configurable=True, default_value=0, description="Diameter of the kettle"),
+
+        # Unified Length Unit Selection (applies to both height and diameter)
+        Property.Select(label="Length Unit", options=["Centimeters", "Inches"], description="Select the unit for both sensor height and kettle diameter"),
+
+        Property.Select(label="Simulation Mode", options=["True", "False"], description="Enable simulation mode"),
+        Property.Select(label="Volume Unit", options=["Liters", "Gallons"], description="Select the unit for volume measurement"),
+        Property.Number("sampleRate", configurable=True, default_value=1, description="Sample rate in Hz"),
+        Property.Number("averageWindowSize", configurable=True, default_value=5, description="Number of samples to average for running average"),
+        Property.Select("adaptiveRate", options=["No", "Yes"], description="Raise the sample rate up to maxSampleRate while the level is moving"),
+        Property.Number("maxSampleRate", configurable=True, default_value=5, description="Highest sample rate in Hz with adaptive rate"),
+        Property.Number("rateResolution", configurable=True, default_value=0.1, description="Output change per sample the adaptive rate aims for")
+    ]
+
+
 @parameters([
-    Property.Select(label="ADCPin", options=[0, 1, 2, 3, 4, 5], description="Select the ADC pin (1-5)"),
-    Property.Select("sensorType", options=["Liquid Level", "Volume"], description="Select the output data type"),
-    Property.Number("adcLow", configurable=True, default_value=0, description="ADC value at minimum liquid level, usually 0"),
-    Property.Number("adcHigh", configurable=True, default_value=1024, description="ADC value at maximum liquid level, usually 1024"),
-    
-    # Sensor Height and Kettle Diameter
-    Property.Number("sensorHeight", configurable=True, default_value=0, description="Location of the sensor from the bottom of the kettle"),
-    Property.Number("kettleDiameter", configurable=True, default_value=0, description="Diameter of the kettle"),
-    
-    # Unified Length Unit Selection (applies to both height and diameter)
-    Property.Select(label="Length Unit", options=["Centimeters", "Inches"], description="Select the unit for both sensor height and kettle diameter"),
-    
-    Property.Select(label="Simulation Mode", options=["True", "False"], description="Enable simulation mode"),
-    Property.Select(label="Volume Unit", options=["Liters", "Gallons"], description="Select the unit for volume measurement"),
-    Property.Number("sampleRate", configurable=True, default_value=1, description="Sample rate in Hz"),
-    Property.Number("averageWindowSize", configurable=True, default_value=5, description="Number of samples to average for running average")
+    Property.Select(label="ADCPin", options=pin_options(ANALOG), description="Select the analog input (A0 = 0)"),
+    *level_properties()
 ])
 class PressureSensor(CBPiSensor):
 
@@ -38,6 +57,8 @@ class PressureSensor(CBPiSensor):
         self.adc_pin = int(props.get("ADCPin", 1))
         self.simulation_mode = str(props.get("Simulation Mode", "False")).lower() == "true"
         self.current_adc_value = None
+        self.simulated_adc_value = 0
+        self.fault = None
         
         # Variables for conversions and calculations
         self.GRAVITY = 9.807
@@ -48,6 +69,16 @@ class PressureSensor(CBPiSensor):
         self.sample_interval = 1 / self.sample_rate  # Calculate interval based on rate
         self.average_window_size = int(self.props.get("averageWindowSize", 5))
         self.adc_values = deque(maxlen=self.average_window_size)
+        self.differential = 5
+        out_bytes, in_bytes = self._sample_cost()
+        self.sampler = None
+        self.link_claim = None
+        if str(self.props.get("adaptiveRate", "No")) == "Yes":
+            self.sampler = AdaptiveSampler(f"sensor:{id}", self.sample_rate,
+                                           float(self.props.get("maxSampleRate", 5)),
+                                           float(self.props.get("rateResolution", 0.1)), out_bytes, in_bytes)
+        else:
+            self.link_claim = TelemetrixAioService.claim_link(f"sensor:{id}", self.sample_rate, out_bytes, in_bytes)
 
     def convert_length_to_meters(self, length):
         """
@@ -75,15 +106,26 @@ class PressureSensor(CBPiSensor):
         kettle_diameter = float(self.props.get("kettleDiameter", 0))
         return self.convert_length_to_meters(kettle_diameter)
 
+    def _sample_cost(self):
+        """Serial bytes (out, in) per sample: reporting is enabled and disabled around one analog report."""
+        if self.simulation_mode:
+            return 0, 0
+        return 2 * MODIFY_REPORTING_BYTES, ANALOG_REPORT_BYTES
+
     async def on_start(self):
         """
         Initialize the TelemetrixAioService and set up the ADC pin.
         """
         if not self.simulation_mode:
+            try:
+                TelemetrixAioService.claim_pins(self.cbpi.config.get, f"sensor:{self.id}", [(self.adc_pin, ANALOG)], token=self)
+            except PinConflict as e:
+                self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"sensor:{self.id}", e, token=self)
+                return
             try:
                 await TelemetrixAioService.initialize(self.cbpi.config.get)
                 self.board = TelemetrixAioService.get_arduino_instance()
-                await self.board.set_pin_mode_analog_input(self.adc_pin, 5, self.analog_callback)
+                await self.board.set_pin_mode_analog_input(self.adc_pin, self.differential, self.analog_callback)
                 logger.info(f"ADC pin {self.adc_pin} initialized successfully")
                 await self.board.disable_analog_reporting(self.adc_pin)  # Disable reporting initially
             except Exception as e:
@@ -91,6 +133,24 @@ class PressureSensor(CBPiSensor):
         else:
             logger.info("Pressure sensor running in simulation mode")
 
+    @action(key="BurstCapture", parameters=[Property.Number(label="Seconds", configurable=True, default_value=5,
+                                                            description="Capture length at maximum report rate")])
+    async def burst_capture(self, Seconds=5, **kwargs):
+        """
+        Sample the ADC pin at the board's maximum rate and store statistics and PSD of the burst.
+        """
+        if self.fault:
+            logger.warning(f"Burst capture not started for sensor {self.id}: {self.fault}")
+            return
+        self._burst_task = asyncio.create_task(run_burst(self.cbpi, self.id, self.adc_pin, float(Seconds),
+                                                         restore=self._restore_pin))
+
+    async def _restore_pin(self):
+        # The burst replaced the pin's callback and differential
+        if not self.simulation_mode:
+            await self.board.set_pin_mode_analog_input(self.adc_pin, self.differential, self.analog_callback)
+            await self.board.disable_analog_reporting(self.adc_pin)
+
     async def analog_callback(self, data):
         """
         Callback for handling ADC data when using TelemetrixAioService.
@@ -107,6 +167,10 @@ class PressureSensor(CBPiSensor):
         Read the ADC value, either from simulation or actual hardware.
         """
         if self.simulation_mode:
+            # Read the kettle level from the plant simulator when one is attached
+            if TelemetrixAioService.get_simulator() is not None:
+                return TelemetrixAioService.get_arduino_instance().read_analog(self.adc_pin)
+
             # Increment the simulated ADC value
             self.simulated_adc_value += 1
             if self.simulated_adc_value >= 1024:
@@ -133,14 +197,28 @@ class PressureSensor(CBPiSensor):
         logger.debug(f"Running Average ADC Value: {average_value}")
         return average_value
 
+    @monitored
     async def run(self):
         """
         Main run loop for processing the ADC values and calculating liquid level and volume.
         """
+        try:
+            if self.fault:
+                # The pin carries another device's signal
+                await ControlScheduler.get().park(self)
+            else:
+                await self._sample_loop()
+        finally:
+            if self.sampler is not None:
+                self.sampler.close()
+            if self.link_claim is not None:
+                self.link_claim.release()
+            TelemetrixAioService.release_pins(f"sensor:{self.id}", self)
+
+    async def _sample_loop(self):
         while self.running:
             try:
-                await self.board.enable_analog_reporting(self.adc_pin)
-                await asyncio.sleep(0.1)  # Allow a brief time to capture a single sample
+                await self._request_sample()
                 adc_value = await self.read_adc()
 
                 average_adc_value = self.calculate_running_average(adc_value)
@@ -156,13 +234,30 @@ class PressureSensor(CBPiSensor):
                     self.value = volume
 
                 self.push_update(self.value)
+                history.record(f"sensor:{self.id}", self.value)
+                if self.sampler is not None:
+                    self.sampler.update(time.time(), self.value)
+                    await self._apply_differential(self.sampler.threshold(5))
 
             except Exception as e:
                 logger.error(f"Error during run loop: {str(e)}")
                 self.value = None
                 self.push_update(self.value)
 
-            await asyncio.sleep(self.sample_interval)
+            await asyncio.sleep(self.sampler.interval if self.sampler is not None else self.sample_interval)
+
+    async def _request_sample(self):
+        if not self.simulation_mode:
+            await self.board.enable_analog_reporting(self.adc_pin)
+            await asyncio.sleep(0.1)  # Allow a brief time to capture a single sample
+
+    async def _apply_differential(self, differential):
+        """Re-arm the pin with a new report-on-change threshold; a pin mode command, so only on change."""
+        if differential == self.differential or self.simulation_mode:
+            return
+        self.differential = differential
+        await self.board.set_pin_mode_analog_input(self.adc_pin, differential, self.analog_callback)
+        await self.board.disable_analog_reporting(self.adc_pin)
 
     def calculate_liquid_level(self, adc_value):
         """
@@ -214,6 +309,93 @@ class PressureSensor(CBPiSensor):
         logger.debug("Pressure sensor reset")
         return "OK"
 
+
+@parameters([
+    Property.Select(label="I2C Address", options=["0x48", "0x49", "0x4A", "0x4B"], description="ADS1115 address set by its ADDR pin"),
+    Property.Select(label="Channel", options=[0, 1, 2, 3], description="Single-ended input AIN0-AIN3"),
+    Property.Select(label="Gain", options=[6.144, 4.096, 2.048, 1.024, 0.512, 0.256], description="Full-scale range in volts"),
+    Property.Select(label="Data Rate", options=[8, 16, 32, 64, 128, 250, 475, 860], description="Conversions per second"),
+    *level_properties(adc_high=32767)
+])
+class ADS1115LevelSensor(PressureSensor):
+    """
+    PressureSensor reading a 16-bit ADS1115 over I2C instead of the 10-bit onboard ADC. Raw
+    conversions (0-32767 single-ended) go through the same running average and level/volume
+    conversion, so adcLow/adcHigh are set in ADS1115 counts.
+    """
+
+    def __init__(self, cbpi, id, props):
+        self.channel = int(props.get("Channel", 0))
+        self.address = int(str(props.get("I2C Address", "0x48")), 16)
+        self.gain = float(props.get("Gain", 4.096))
+        self.data_rate = int(props.get("Data Rate", 128))
+        super(ADS1115LevelSensor, self).__init__(cbpi, id, props)
+        self.adc_pin = self.channel
+        self.chip = None
+
+    def _sample_cost(self):
+        # The chip claims its own I2C traffic on the link budget
+        return 0, 0
+
+    async def on_start(self):
+        if self.simulation_mode:
+            await super(ADS1115LevelSensor, self).on_start()
+            return
+        try:
+            i2c_pins = TelemetrixAioService.get_pin_claims(self.cbpi.config.get).profile.pins[I2C]
+            TelemetrixAioService.claim_pins(self.cbpi.config.get, f"sensor:{self.id}", [(pin, I2C) for pin in i2c_pins],
+                                            share="i2c", token=self)
+        except PinConflict as e:
+            self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"sensor:{self.id}", e, token=self)
+            return
+        try:
+            await TelemetrixAioService.initialize(self.cbpi.config.get)
+            self.board = TelemetrixAioService.get_arduino_instance()
+            bus = I2CBus.get(self.board)
+            await bus.start()
+            self.chip = ADS1115.get(bus, self.address, self.data_rate)
+            rate = self.sampler.max_rate if self.sampler is not None else self.sample_rate
+            self.chip.subscribe(self.channel, self.gain, rate)
+            logger.info(f"ADS1115 0x{self.address:02x} channel {self.channel} initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize ADS1115 0x{self.address:02x} channel {self.channel}: {str(e)}")
+
+    async def burst_capture(self, Seconds=5, **kwargs):
+        # Not an action here: a burst samples an onboard analog pin, and adc_pin is an ADS1115 channel
+        logger.warning(f"Burst capture is not available for ADS1115 sensor {self.id}")
+        sensor = self.cbpi.sensor.find_by_id(self.id)
+        title = sensor.name if sensor is not None else f"Sensor {self.id}"
+        self.cbpi.notify(title, "Burst capture only works on onboard analog pins.", NotificationType.WARNING)
+
+    async def _restore_pin(self):
+        # No onboard pin to restore; it may belong to another sensor
+        pass
+
+    async def _request_sample(self):
+        # The chip is polled on its own schedule; the latest conversion is always current
+        pass
+
+    async def _apply_differential(self, differential):
+        pass
+
+    async def read_adc(self):
+        if self.simulation_mode:
+            # Scale the simulator's 10-bit reading to the 15-bit single-ended range
+            return await super(ADS1115LevelSensor, self).read_adc() * 32
+        value = self.chip.values.get(self.channel) if self.chip is not None else None
+        if value is None:
+            logger.error(f"No ADS1115 conversion for channel {self.channel} yet")
+            return 0
+        return max(value, 0)
+
+    async def run(self):
+        # PressureSensor.run is already instrumented under this class name
+        try:
+            await super(ADS1115LevelSensor, self).run()
+        finally:
+            if self.chip is not None:
+                self.chip.unsubscribe(self.channel)
+
 @parameters([
     Property.Sensor(label="Volume Sensor", description="Select the volume sensor to calculate flow from."),
     Property.Select(label="Flow Unit", options=['Liters/min', 'Gallons/min'], description="Select the unit of flow measurement."),
@@ -239,6 +421,7 @@ class FlowFromVolumeSensor(CBPiSensor):
     def get_state(self):
         return dict(value=self.flow_rate)
 
+    @monitored
     async def run(self):
         while self.running:
             try:
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# File layout: a 16 byte header followed by fixed 32 byte records.
+#   header: magic (8s) | record size (I) | reserved (I)
+#   record: monotonic ns (q) | flags (B) | command/report id (B) | payload length (B) | payload (21s)
+# Payloads longer than 21 bytes spill into continuation records (FLAG_CONTINUATION) that follow
+# immediately, so every record stays fixed-width and the file can be mmap'ed and sliced directly.
+MAGIC = b'CBPITLX1'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<qBBB21s')
+PAYLOAD_SIZE = 21
+
+OUTBOUND = 0
+INBOUND = 1
+FLAG_CONTINUATION = 0x80
+
+
+class SerialRecorder:
+    """
+    Append-only log of every command sent to and every report received from the board.
+
+    Attach with TelemetrixAioService.add_tap(recorder); the service calls on_command() and
+    on_report() from its serial hooks. Writes go through a buffered file object and are flushed
+    every `flush_interval` seconds, so recording costs one struct.pack per packet.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new_file:
+            self._file.write(HEADER.pack(MAGIC, RECORD.size, 0))
+        self._last_flush = time.monotonic()
+
+    def _append(self, direction, kind, payload):
+        timestamp = time.monotonic_ns()
+        payload = bytes(payload)
+        length = min(len(payload), 255)
+        self._file.write(RECORD.pack(timestamp, direction, kind, length, payload[:PAYLOAD_SIZE]))
+        for offset in range(PAYLOAD_SIZE, length, PAYLOAD_SIZE):
+            self._file.write(RECORD.pack(timestamp, direction | FLAG_CONTINUATION, kind, length,
+                                         payload[offset:offset + PAYLOAD_SIZE]))
+        self.records += 1
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
+
+    def on_command(self, command):
+        """`command` is the Telemetrix command list without the length prefix."""
+        self._append(OUTBOUND, command[0], command[1:])
+
+    def on_report(self, report, data):
+        self._append(INBOUND, report, data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            self._file.close()
+            self._file = None
+
+
+def read_records(path):
+    """
+    Yield (timestamp_ns, direction, kind, payload) tuples from a recording, reassembling
+    continuation records. The file is memory-mapped, not read into memory.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size <= HEADER.size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, record_size, _ = HEADER.unpack_from(view, 0)
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f"{path} is not a serial recording")
+            count = (len(view) - HEADER.size) // RECORD.size
+            current = None
+            for index in range(count):
+                timestamp, flags, kind, length, chunk = RECORD.unpack_from(view, HEADER.size + index * RECORD.size)
+                if flags & FLAG_CONTINUATION:
+                    if current is not None:
+                        current[3].extend(chunk)
+                    continue
+                if current is not None:
+                    yield current[0], current[1], current[2], bytes(current[3][:current[4]])
+                current = [timestamp, flags, kind, bytearray(chunk), length]
+            if current is not None:
+                yield current[0], current[1], current[2], bytes(current[3][:current[4]])
+
+
+class ReplayBoard:
+    """
+    Stand-in board for replays: routes recorded reports to the callbacks that sensors register and
+    captures every command the actors send, so a replayed session can be diffed against the trace.
+    """
+
+    def __init__(self):
+        self.serial_port = "replay"
+        self.analog_callbacks = {}
+        self.digital_callbacks = {}
+        self.loop_back_callback = None
+        self.commands = []
+        self.report_dispatch = {
+            2: self._digital_report,
+            3: self._analog_report,
+            0: self._loop_report,
+        }
+
+    async def _analog_report(self, data):
+        callback = self.analog_callbacks.get(data[0])
+        if callback is not None:
+            await callback([3, data[0], (data[1] << 8) + data[2], time.time()])
+
+    async def _digital_report(self, data):
+        callback = self.digital_callbacks.get(data[0])
+        if callback is not None:
+            await callback([2, data[0], data[1], time.time()])
+
+    async def _loop_report(self, data):
+        if self.loop_back_callback is not None:
+            await self.loop_back_callback(data)
+
+    async def set_pin_mode_analog_input(self, pin_number, differential=0, callback=None):
+        self.analog_callbacks[pin_number] = callback
+        self.commands.append([1, pin_number, 3, differential >> 8, differential & 0xff, 1])
+
+    async def set_pin_mode_digital_input(self, pin_number, callback):
+        self.digital_callbacks[pin_number] = callback
+        self.commands.append([1, pin_number, 0, 1])
+
+    async def set_pin_mode_analog_output(self, pin_number):
+        self.commands.append([1, pin_number, 1, 1])
+
+    async def set_pin_mode_digital_output(self, pin_number):
+        self.commands.append([1, pin_number, 1, 1])
+
+    async def analog_write(self, pin, value):
+        self.commands.append([3, pin, value >> 8, value & 0xff])
+
+    async def digital_write(self, pin, value):
+        self.commands.append([2, pin, value])
+
+    async def enable_analog_reporting(self, pin):
+        self.commands.append([4, 1, pin])
+
+    async def disable_analog_reporting(self, pin):
+        self.commands.append([4, 3, pin])
+
+    async def loop_back(self, start_character, callback):
+        self.loop_back_callback = callback
+
+    async def shutdown(self):
+        pass
+
+
+class SerialReplay:
+    """
+    Feed the inbound reports of a recording back into a board's report handlers.
+
+    `speed` scales the recorded inter-report gaps (50 replays a session 50x faster than it was
+    recorded, 0 replays as fast as the event loop allows). Gaps shorter than `min_sleep` are
+    accumulated rather than slept individually to keep the replay cheap.
+    """
+
+    def __init__(self, path, speed=50.0, min_sleep=0.001):
+        self.path = path
+        self.speed = speed
+        self.min_sleep = min_sleep
+        self.reports = 0
+
+    async def run(self, board):
+        previous = None
+        owed = 0.0
+        for timestamp, direction, kind, payload in read_records(self.path):
+            if direction != INBOUND:
+                continue
+            if previous is not None and self.speed:
+                owed += (timestamp - previous) / 1e9 / self.speed
+                if owed >= self.min_sleep:
+                    await asyncio.sleep(owed)
+                    owed = 0.0
+            previous = timestamp
+            handler = board.report_dispatch.get(kind)
+            if handler is None:
+                continue
+            await handler(list(payload))
+            self.reports += 1
+        logger.info(f"Replayed {self.reports} reports from {self.path}")
+        return self.reports
+
+
+def outbound_commands(path):
+    """Return the commands recorded in `path` as lists, in the same shape ReplayBoard captures."""
+    return [[kind] + list(payload) for _, direction, kind, payload in read_records(path) if direction == OUTBOUND]
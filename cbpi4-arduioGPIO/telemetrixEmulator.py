@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import tty
+
+logger = logging.getLogger(__name__)
+
+# Telemetrix4Arduino command and report identifiers (see telemetrix_aio.private_constants)
+LOOP_COMMAND = 0
+SET_PIN_MODE = 1
+DIGITAL_WRITE = 2
+ANALOG_WRITE = 3
+MODIFY_REPORTING = 4
+GET_FIRMWARE_VERSION = 5
+ARE_U_THERE = 6
+STOP_ALL_REPORTS = 15
+SET_ANALOG_SCANNING_INTERVAL = 16
+ENABLE_ALL_REPORTS = 17
+RESET = 18
+GET_FEATURES = 54
+FAILSAFE_CONFIG = 57  # firmware/TelemetrixFailsafe.h
+FAILSAFE_PIN = 58
+
+DIGITAL_REPORT = DIGITAL_WRITE
+ANALOG_REPORT = ANALOG_WRITE
+FIRMWARE_REPORT = GET_FIRMWARE_VERSION
+I_AM_HERE_REPORT = ARE_U_THERE
+FEATURES_REPORT = 20
+
+AT_INPUT = 0
+AT_OUTPUT = 1
+AT_INPUT_PULLUP = 2
+AT_ANALOG = 3
+
+REPORTING_DISABLE_ALL = 0
+REPORTING_ANALOG_ENABLE = 1
+REPORTING_DIGITAL_ENABLE = 2
+REPORTING_ANALOG_DISABLE = 3
+REPORTING_DIGITAL_DISABLE = 4
+
+
+class TelemetrixEmulator:
+    """
+    Loopback Telemetrix4Arduino board on a Linux pseudo-terminal.
+
+    The emulator opens a pty pair and serves the Telemetrix serial protocol on the master side;
+    `port` is the slave device path that the unmodified TelemetrixAIO client connects to, e.g.
+    TelemetrixAIO(com_port=emulator.port, arduino_wait=0, autostart=False).
+
+    Pin modes and PWM/digital values are tracked in `pin_modes` and `outputs`. Analog reports are
+    generated from `signals`, a dict mapping analog pin -> callable(t) returning 0-1023, or from a
+    PlantSimulator when `plant` and `wiring` are given. Latency, jitter and byte loss are applied to
+    everything the board sends back, so the host sees a realistic, reproducible link.
+    """
+
+    def __init__(self, signals=None, plant=None, wiring=None, latency=0.0, jitter=0.0, byte_loss=0.0,
+                 instance_id=1, firmware=(5, 4, 0), features=0x3f, seed=None):
+        self.signals = signals if signals is not None else {}
+        self.plant = plant
+        self.wiring = wiring if wiring is not None else {}
+        self.latency = latency
+        self.jitter = jitter
+        self.byte_loss = byte_loss
+        self.instance_id = instance_id
+        self.firmware = firmware
+        self.features = features
+        self.random = random.Random(seed)
+
+        self.port = None
+        self.pin_modes = {}
+        self.outputs = {}
+        self.analog_differentials = {}
+        self.analog_reporting = set()
+        self.reporting_enabled = True
+        self.scan_interval = 0.019
+        self.failsafe_pins = {}
+        self.failsafe_timeout = 0.0
+        self.failsafe_tripped = False
+        self.stats = {"rx_bytes": 0, "tx_bytes": 0, "rx_commands": 0, "tx_reports": 0, "dropped_bytes": 0}
+
+        self._master = None
+        self._slave = None
+        self._buffer = bytearray()
+        self._last_analog = {}
+        self._scan_task = None
+        self._stalled_until = 0.0
+        self._start_time = time.monotonic()
+        self._last_heartbeat = self._start_time
+        self._handlers = {
+            LOOP_COMMAND: self._loop_back,
+            SET_PIN_MODE: self._set_pin_mode,
+            DIGITAL_WRITE: self._digital_write,
+            ANALOG_WRITE: self._analog_write,
+            MODIFY_REPORTING: self._modify_reporting,
+            GET_FIRMWARE_VERSION: self._firmware_version,
+            ARE_U_THERE: self._are_you_there,
+            STOP_ALL_REPORTS: self._stop_all_reports,
+            SET_ANALOG_SCANNING_INTERVAL: self._set_scan_interval,
+            ENABLE_ALL_REPORTS: self._enable_all_reports,
+            RESET: self._reset,
+            GET_FEATURES: self._get_features,
+            FAILSAFE_CONFIG: self._failsafe_config,
+            FAILSAFE_PIN: self._failsafe_pin,
+        }
+
+    async def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self._master, self._on_readable)
+        self._scan_task = asyncio.create_task(self._scan_analog())
+        logger.info(f"Telemetrix emulator listening on {self.port}")
+        return self.port
+
+    async def stop(self):
+        if self._scan_task is not None:
+            self._scan_task.cancel()
+            self._scan_task = None
+        if self._master is not None:
+            asyncio.get_running_loop().remove_reader(self._master)
+            os.close(self._master)
+            os.close(self._slave)
+            self._master = self._slave = None
+
+    def stall(self, seconds):
+        """Fault injection: stop answering anything for `seconds`, as if the board hung."""
+        self._stalled_until = time.monotonic() + seconds
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        self.stats["rx_bytes"] += len(data)
+        self._buffer.extend(data)
+        while self._buffer:
+            length = self._buffer[0]
+            if len(self._buffer) < length + 1:
+                break
+            packet = bytes(self._buffer[1:length + 1])
+            del self._buffer[:length + 1]
+            if not packet:
+                continue
+            self.stats["rx_commands"] += 1
+            handler = self._handlers.get(packet[0])
+            if handler is None:
+                logger.debug(f"Emulator ignoring unsupported command {packet[0]}")
+                continue
+            handler(packet[1:])
+
+    def _send(self, report):
+        if self._master is None or time.monotonic() < self._stalled_until:
+            return
+        message = bytes([len(report)] + list(report))
+        if self.byte_loss:
+            kept = bytes(b for b in message if self.random.random() >= self.byte_loss)
+            self.stats["dropped_bytes"] += len(message) - len(kept)
+            message = kept
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._write, message)
+        else:
+            self._write(message)
+
+    def _write(self, message):
+        if self._master is None or not message:
+            return
+        try:
+            os.write(self._master, message)
+            self.stats["tx_bytes"] += len(message)
+            self.stats["tx_reports"] += 1
+        except OSError as e:
+            logger.debug(f"Emulator write failed: {e}")
+
+    def _loop_back(self, data):
+        self._last_heartbeat = time.monotonic()
+        self.failsafe_tripped = False
+        self._send([LOOP_COMMAND] + list(data[:1]))
+
+    def _failsafe_config(self, data):
+        self.failsafe_timeout = ((data[0] << 8) + data[1]) / 1000.0
+        self._last_heartbeat = time.monotonic()
+        self.failsafe_tripped = False
+
+    def _failsafe_pin(self, data):
+        self.failsafe_pins[data[0]] = (data[1], (data[2] << 8) + data[3])
+
+    def _check_failsafe(self):
+        if not self.failsafe_timeout or self.failsafe_tripped:
+            return
+        if time.monotonic() - self._last_heartbeat < self.failsafe_timeout:
+            return
+        for pin, (analog, value) in self.failsafe_pins.items():
+            if analog:
+                self._analog_write([pin, value >> 8, value & 0xff])
+            else:
+                self._digital_write([pin, value])
+        self.failsafe_tripped = True
+        logger.info(f"Emulator failsafe tripped, {len(self.failsafe_pins)} pins driven to safe values")
+
+    def _are_you_there(self, data):
+        self._send([I_AM_HERE_REPORT, self.instance_id])
+
+    def _firmware_version(self, data):
+        self._send([FIRMWARE_REPORT] + list(self.firmware))
+
+    def _get_features(self, data):
+        self._send([FEATURES_REPORT, self.features])
+
+    def _set_pin_mode(self, data):
+        pin, mode = data[0], data[1]
+        self.pin_modes[pin] = mode
+        if mode == AT_ANALOG:
+            self.analog_differentials[pin] = (data[2] << 8) + data[3]
+            if data[4]:
+                self.analog_reporting.add(pin)
+            self._last_analog.pop(pin, None)
+
+    def _digital_write(self, data):
+        pin, value = data[0], data[1]
+        self.outputs[pin] = value
+        if self.plant is not None and pin == self.wiring.get("pump"):
+            self.plant.set_pump_output(self.plant.pump.max_output if value else 0)
+
+    def _analog_write(self, data):
+        pin, value = data[0], (data[1] << 8) + data[2]
+        self.outputs[pin] = value
+        if self.plant is not None and pin == self.wiring.get("pump"):
+            self.plant.set_pump_output(value)
+
+    def _modify_reporting(self, data):
+        action, pin = data[0], data[1]
+        if action == REPORTING_DISABLE_ALL:
+            self.analog_reporting.clear()
+        elif action == REPORTING_ANALOG_ENABLE:
+            self.analog_reporting.add(pin)
+            self._last_analog.pop(pin, None)
+        elif action == REPORTING_ANALOG_DISABLE:
+            self.analog_reporting.discard(pin)
+
+    def _stop_all_reports(self, data):
+        self.reporting_enabled = False
+
+    def _enable_all_reports(self, data):
+        self.reporting_enabled = True
+
+    def _set_scan_interval(self, data):
+        self.scan_interval = max(data[0], 1) / 1000.0
+
+    def _reset(self, data):
+        self.pin_modes.clear()
+        self.outputs.clear()
+        self.analog_differentials.clear()
+        self.analog_reporting.clear()
+        self._last_analog.clear()
+
+    def read_analog(self, pin):
+        signal = self.signals.get(pin)
+        if signal is not None:
+            return int(min(max(signal(time.monotonic() - self._start_time), 0), 1023))
+        if self.plant is not None:
+            if pin == self.wiring.get("flow_adc"):
+                return self.plant.flow_adc()
+            if pin == self.wiring.get("source_level_adc"):
+                return self.plant.level_adc(self.plant.source)
+            if pin == self.wiring.get("destination_level_adc"):
+                return self.plant.level_adc(self.plant.destination)
+        return 0
+
+    async def _scan_analog(self):
+        while True:
+            await asyncio.sleep(self.scan_interval)
+            if self.plant is not None:
+                self.plant.step()
+            self._check_failsafe()
+            if not self.reporting_enabled:
+                continue
+            for pin in list(self.analog_reporting):
+                value = self.read_analog(pin)
+                last = self._last_analog.get(pin)
+                if last is not None and abs(value - last) < self.analog_differentials.get(pin, 0):
+                    continue
+                self._last_analog[pin] = value
+                self._send([ANALOG_REPORT, pin, value >> 8, value & 0xff])
+
+
+async def benchmark_round_trip(board, count=100, timeout=1.0):
+    """
+    Measure command round-trip latency through `board` using the Telemetrix loop-back command.
+    Returns a sorted list of round-trip times in seconds; lost echoes are counted as timeouts.
+    """
+    samples = []
+    echo = asyncio.Event()
+
+    async def on_echo(data):
+        echo.set()
+
+    for _ in range(count):
+        echo.clear()
+        start = time.perf_counter()
+        await board.loop_back('A', on_echo)
+        try:
+            await asyncio.wait_for(echo.wait(), timeout)
+            samples.append(time.perf_counter() - start)
+        except asyncio.TimeoutError:
+            samples.append(float('inf'))
+    return sorted(samples)
@@ -0,0 +1,271 @@
+import logging
+import time
+from cbpi.api import *
+
+from .TelemetrixAioService import TelemetrixAioService
+from .boardProfiles import DIGITAL, PinConflict, pin_options
+from .controlScheduler import ControlScheduler
+from .linkBudget import DHT_REPORT_BYTES
+from .loopMonitor import monitored
+from .oneWireBus import OneWireBus
+from .timeSeries import history
+
+logger = logging.getLogger(__name__)
+
+
+class TemperatureCache:
+    """
+    Latest reading of every temperature sensor of this plugin with the time it was taken.
+
+    Controllers read it directly instead of going through the sensor manager, so they see when a
+    reading was taken and can refuse one that is older than `max_age` rather than acting on it.
+    """
+
+    def __init__(self):
+        self._readings = {}     # sensor id -> (value, timestamp, max_age)
+
+    def __contains__(self, sensor_id):
+        return sensor_id in self._readings
+
+    def update(self, sensor_id, value, timestamp, max_age):
+        self._readings[sensor_id] = (value, timestamp, max_age)
+
+    def remove(self, sensor_id):
+        self._readings.pop(sensor_id, None)
+
+    def reading(self, sensor_id):
+        """(value, timestamp) of the latest reading, or None."""
+        entry = self._readings.get(sensor_id)
+        return entry[:2] if entry is not None else None
+
+    def get(self, sensor_id, now=None):
+        """Latest value, or None when there is none or it is older than its max_age."""
+        entry = self._readings.get(sensor_id)
+        if entry is None:
+            return None
+        value, timestamp, max_age = entry
+        now = time.time() if now is None else now
+        if now - timestamp > max_age:
+            return None
+        return value
+
+    def snapshot(self, now=None):
+        now = time.time() if now is None else now
+        return {sensor_id: {"value": value, "age": round(now - timestamp, 2), "max_age": max_age}
+                for sensor_id, (value, timestamp, max_age) in self._readings.items()}
+
+
+temperatures = TemperatureCache()
+
+
+class BoardTemperatureSensor(CBPiSensor):
+    """
+    Common part of the temperature sensors read through the Arduino: readings are corrected by
+    the offset, published, written to the cache and recorded in the history with the time they
+    were taken, so they line up with the flow signals. A reading older than three intervals is
+    stale for the cache.
+    """
+
+    def __init__(self, cbpi, id, props):
+        super(BoardTemperatureSensor, self).__init__(cbpi, id, props)
+        self.value = None
+        self.simulation_mode = str(props.get("Simulation Mode", "False")).lower() == "true"
+        self.offset = float(props.get("Offset", 0) or 0)
+        self.interval = max(float(props.get("Interval", 2) or 2), 1.0)
+        self.board = None
+        self.fault = None
+        self._simulation_job = None
+
+    @property
+    def pin(self):
+        raise NotImplementedError
+
+    async def publish(self, value, timestamp):
+        self.value = round(value + self.offset, 2)
+        temperatures.update(self.id, self.value, timestamp, 3 * self.interval)
+        self.push_update(self.value)
+        history.record(f"sensor:{self.id}", self.value, t=timestamp)
+
+    def simulated_value(self):
+        # The plant simulator's temperatures when one is attached, else room temperature
+        if TelemetrixAioService.get_simulator() is not None:
+            value = TelemetrixAioService.get_arduino_instance().read_temperature(self.pin)
+            if value is not None:
+                return value
+        return 20.0
+
+    async def _simulate(self):
+        await self.publish(self.simulated_value(), time.time())
+
+    async def on_start(self):
+        if self.simulation_mode:
+            self._simulation_job = ControlScheduler.get().every(self.interval, self._simulate, name=f"sensor:{self.id}")
+            logger.info("Temperature sensor running in simulation mode")
+            return
+        try:
+            # Every probe of a bus, and every reading of a DHT, shares its data pin
+            TelemetrixAioService.claim_pins(self.cbpi.config.get, f"sensor:{self.id}", [(self.pin, DIGITAL)],
+                                            share=self.share, token=self)
+        except PinConflict as e:
+            self.fault = TelemetrixAioService.pin_fault(self.cbpi, f"sensor:{self.id}", e, token=self)
+            return
+        try:
+            await TelemetrixAioService.initialize(self.cbpi.config.get)
+            self.board = TelemetrixAioService.get_arduino_instance()
+            await self._attach()
+        except Exception as e:
+            logger.error(f"Failed to initialize temperature sensor on pin {self.pin}: {str(e)}")
+
+    @property
+    def share(self):
+        raise NotImplementedError
+
+    async def _attach(self):
+        raise NotImplementedError
+
+    def _detach(self):
+        pass
+
+    @monitored
+    async def run(self):
+        try:
+            await ControlScheduler.get().park(self)
+        finally:
+            if self._simulation_job is not None:
+                self._simulation_job.cancel()
+                self._simulation_job = None
+            self._detach()
+            TelemetrixAioService.release_pins(f"sensor:{self.id}", self)
+            temperatures.remove(self.id)
+
+    def get_state(self):
+        return dict(value=self.value)
+
+
+@parameters([
+    Property.Select(label="OneWire Pin", options=pin_options(DIGITAL), description="Digital pin of the OneWire bus (one bus per board)"),
+    Property.Text(label="Address", configurable=True, default_value="", description="Probe ROM code, e.g. 28-ff-64-1e-...; empty for the only probe on the bus"),
+    Property.Number("Interval", configurable=True, default_value=2, description="Seconds between conversions, at least 1"),
+    Property.Number("Offset", configurable=True, default_value=0, description="Calibration offset added to every reading"),
+    Property.Select(label="Simulation Mode", options=["True", "False"], description="Enable simulation mode")
+])
+class DS18B20Sensor(BoardTemperatureSensor):
+    """
+    DS18B20 probe on the board's OneWire bus. All probes of the bus share one conversion cycle,
+    see oneWireBus.OneWireBus.
+    """
+
+    def __init__(self, cbpi, id, props):
+        super(DS18B20Sensor, self).__init__(cbpi, id, props)
+        self.onewire_pin = int(props.get("OneWire Pin", 4))
+        self.address = str(props.get("Address", "") or "").strip().lower()
+        self.bus = None
+
+    @property
+    def pin(self):
+        return self.onewire_pin
+
+    @property
+    def share(self):
+        return "onewire"
+
+    async def _attach(self):
+        self.bus = OneWireBus.get(self.board, self.onewire_pin)
+        await self.bus.start()
+        if not self.address:
+            if len(self.bus.addresses) != 1:
+                raise ValueError(f"{len(self.bus.addresses)} probes on the bus, set the probe address")
+            self.address = self.bus.addresses[0]
+        elif self.address not in self.bus.addresses:
+            logger.warning(f"DS18B20 {self.address} was not found on OneWire pin {self.onewire_pin}")
+        self.bus.subscribe(self.address, self.publish, self.interval)
+        logger.info(f"DS18B20 {self.address} on OneWire pin {self.onewire_pin} initialized successfully")
+
+    def _detach(self):
+        if self.bus is not None:
+            self.bus.unsubscribe(self.address)
+
+
+class DHTDevice:
+    """
+    One DHT11/DHT22 on a board pin. The firmware reads it by itself about every two seconds and
+    sends a report; the pin cannot be released again, so the device lives as long as the board and
+    any number of sensors (temperature, humidity) can listen to it.
+    """
+
+    REPORT_INTERVAL = 2.0
+
+    _devices = {}
+
+    def __init__(self, board, pin, dht_type):
+        self.board = board
+        self.pin = pin
+        self.dht_type = dht_type
+        self.listeners = []
+        self.errors = 0
+        self._started = False
+
+    @classmethod
+    def get(cls, board, pin, dht_type=22):
+        device = cls._devices.get((id(board), pin))
+        if device is None or device.board is not board:
+            device = cls._devices[(id(board), pin)] = cls(board, pin, dht_type)
+        return device
+
+    async def start(self):
+        if not self._started:
+            await self.board.set_pin_mode_dht(self.pin, self._report, self.dht_type)
+            TelemetrixAioService.claim_link(f"dht:{self.pin}", 1.0 / self.REPORT_INTERVAL, 0, DHT_REPORT_BYTES)
+            self._started = True
+
+    async def _report(self, data):
+        # Valid: [DHT_REPORT, 0, pin, type, humidity, temperature, time]; error: [DHT_REPORT, error, pin, type, time]
+        if data[1]:
+            self.errors += 1
+            logger.warning(f"DHT{self.dht_type} on pin {self.pin}: read error {data[1]}")
+            return
+        for listener in list(self.listeners):
+            await listener(data[4], data[5], data[-1])
+
+
+@parameters([
+    Property.Select(label="DHT Pin", options=pin_options(DIGITAL), description="Digital pin of the DHT data line"),
+    Property.Select(label="DHT Type", options=[22, 11], description="DHT22 / AM2302 or DHT11"),
+    Property.Select(label="Reading", options=["Temperature", "Humidity"], description="Value reported by this sensor"),
+    Property.Number("Offset", configurable=True, default_value=0, description="Calibration offset added to every reading"),
+    Property.Select(label="Simulation Mode", options=["True", "False"], description="Enable simulation mode")
+])
+class DHTSensor(BoardTemperatureSensor):
+    """Temperature or humidity of a DHT11/DHT22, as reported by the firmware every two seconds."""
+
+    def __init__(self, cbpi, id, props):
+        super(DHTSensor, self).__init__(cbpi, id, props)
+        self.dht_pin = int(props.get("DHT Pin", 7))
+        self.dht_type = int(props.get("DHT Type", 22))
+        self.humidity = str(props.get("Reading", "Temperature")) == "Humidity"
+        self.interval = DHTDevice.REPORT_INTERVAL
+        self.device = None
+
+    @property
+    def pin(self):
+        return self.dht_pin
+
+    @property
+    def share(self):
+        return "dht"
+
+    async def _attach(self):
+        self.device = DHTDevice.get(self.board, self.dht_pin, self.dht_type)
+        await self.device.start()
+        self.device.listeners.append(self._on_reading)
+        logger.info(f"DHT{self.dht_type} on pin {self.dht_pin} initialized successfully")
+
+    def simulated_value(self):
+        return 50.0 if self.humidity else super(DHTSensor, self).simulated_value()
+
+    async def _on_reading(self, humidity, temperature, timestamp):
+        await self.publish(humidity if self.humidity else temperature, timestamp)
+
+    def _detach(self):
+        if self.device is not None and self._on_reading in self.device.listeners:
+            self.device.listeners.remove(self._on_reading)
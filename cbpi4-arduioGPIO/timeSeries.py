@@ -0,0 +1,259 @@
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from .controlScheduler import ControlScheduler
+from .loopMonitor import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+# One fixed-size record per sample; p/i/d/output are NaN for plain sensors
+RECORD_DTYPE = np.dtype([
+    ("t", "<f8"),
+    ("value", "<f4"),
+    ("output", "<f4"),
+    ("p", "<f4"),
+    ("i", "<f4"),
+    ("d", "<f4"),
+])
+
+NAN = float("nan")
+
+
+class Series:
+    """
+    One time series of a session, stored as a preallocated memory-mapped record array.
+
+    append() writes a single record straight into the mapped file: no serialization, no copy,
+    O(1) per sample. The file grows by doubling, so remapping is amortized. Timestamps must be
+    non-decreasing, which lets slice() find any time range with a binary search and return a
+    view into the map.
+    """
+
+    def __init__(self, path, capacity=4096, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.capacity = capacity
+        self.count = 0
+        self._map = None
+        # Called with (t, value) after every append, e.g. by the history pyramids
+        self.listeners = []
+        if os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        size = os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        if size == 0:
+            return
+        self.capacity = size
+        self._map = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r" if self.readonly else "r+", shape=(size,))
+        # Unused records are zero, so the length survives a crash between index updates
+        empty = np.flatnonzero(self._map["t"] == 0)
+        self.count = int(empty[0]) if len(empty) else size
+
+    def _grow(self):
+        capacity = self.capacity if self._map is None else self.capacity * 2
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+        with loop_monitor.measure("Series.grow"):
+            with open(self.path, "ab") as file:
+                file.truncate(capacity * RECORD_DTYPE.itemsize)
+        self.capacity = capacity
+        self._map = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r+", shape=(capacity,))
+
+    def append(self, value, output=NAN, components=None, t=None):
+        if self.readonly:
+            raise ValueError(f"{self.path} is opened read-only")
+        t = time.time() if t is None else t
+        if self._map is None or self.count >= self.capacity:
+            self._grow()
+        p, i, d = components if components is not None else (NAN, NAN, NAN)
+        self._map[self.count] = (t, value, output, p, i, d)
+        self.count += 1
+        for listener in self.listeners:
+            listener(t, value)
+
+    @property
+    def closed(self):
+        return self._map is None and self.count > 0
+
+    @property
+    def records(self):
+        """View of all records written so far."""
+        if self._map is None:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return self._map[:self.count]
+
+    def slice(self, start=None, end=None):
+        """View of the records with start <= t <= end."""
+        records = self.records
+        times = records["t"]
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = len(records) if end is None else int(np.searchsorted(times, end, side="right"))
+        return records[lo:hi]
+
+    def flush(self):
+        if self._map is not None and not self.readonly:
+            self._map.flush()
+
+    def close(self):
+        self.flush()
+        self._map = None
+
+
+class Session:
+    """A directory of Series files plus index.json describing them."""
+
+    def __init__(self, directory, readonly=False):
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        self.readonly = readonly
+        self.series = {}
+        self.started = time.time()
+        index = self._read_index()
+        if index is not None:
+            self.started = index.get("started", self.started)
+            for name, entry in index.get("series", {}).items():
+                self.series[name] = Series(os.path.join(directory, entry["file"]), readonly=readonly)
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, "index.json"), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.error(f"Invalid history index in {self.directory}: {e}")
+            return None
+
+    @staticmethod
+    def _file_name(name):
+        return "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + ".rec"
+
+    def get(self, name):
+        series = self.series.get(name)
+        if series is None and not self.readonly:
+            os.makedirs(self.directory, exist_ok=True)
+            series = self.series[name] = Series(os.path.join(self.directory, self._file_name(name)))
+        return series
+
+    def index(self):
+        return {
+            "session": self.name,
+            "started": self.started,
+            "dtype": RECORD_DTYPE.descr,
+            "series": {
+                name: {
+                    "file": os.path.basename(series.path),
+                    "count": series.count,
+                    "capacity": series.capacity,
+                    "first": float(series.records["t"][0]) if series.count else None,
+                    "last": float(series.records["t"][-1]) if series.count else None,
+                }
+                for name, series in self.series.items()
+            },
+        }
+
+    def flush(self):
+        if self.readonly or not self.series:
+            return
+        with loop_monitor.measure("Session.flush"):
+            for series in self.series.values():
+                series.flush()
+            path = os.path.join(self.directory, "index.json")
+            with open(path + ".tmp", "w") as file:
+                json.dump(self.index(), file, indent=1)
+            os.replace(path + ".tmp", path)
+
+    def close(self):
+        self.flush()
+        for series in self.series.values():
+            series.close()
+
+
+class TimeSeriesRecorder:
+    """
+    Per-session recorder that steps, sensors and actors of this plugin write traces to.
+
+    record(name, value, output, components) appends to the series `name` of the current session.
+    Every step of this plugin starts a new session named after its start time and the step; writes
+    outside a step go to the current session, or start one on the first write. Data is flushed and
+    the index rewritten every `flush_interval` seconds from the ControlScheduler.
+    """
+
+    def __init__(self, base_directory, flush_interval=10.0):
+        self.base_directory = base_directory
+        self.flush_interval = flush_interval
+        self.enabled = True
+        self.session = None
+        self._flush_job = None
+
+    def start_session(self, label=None):
+        self.close()
+        name = time.strftime("%Y%m%d-%H%M%S")
+        if label:
+            name += "-" + "".join(c if c.isalnum() or c in "-_" else "_" for c in str(label))
+        self.session = Session(os.path.join(self.base_directory, name))
+        logger.info(f"Recording history to session {name}")
+        return self.session
+
+    def series(self, name):
+        if self.session is None:
+            self.start_session()
+        series = self.session.get(name)
+        if self._flush_job is None:
+            self._flush_job = ControlScheduler.get().every(self.flush_interval, self.flush, name="history:flush",
+                                                           start_delay=self.flush_interval)
+        return series
+
+    def record(self, name, value, output=NAN, components=None, t=None):
+        if not self.enabled or value is None:
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        if math.isnan(value):
+            return
+        self.series(name).append(value, NAN if output is None else float(output), components, t)
+
+    def flush(self):
+        if self.session is not None:
+            try:
+                self.session.flush()
+            except OSError as e:
+                logger.error(f"Failed to flush history: {e}")
+
+    def close(self):
+        if self._flush_job is not None:
+            self._flush_job.cancel()
+            self._flush_job = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def sessions(self):
+        try:
+            return sorted(entry for entry in os.listdir(self.base_directory)
+                          if os.path.isdir(os.path.join(self.base_directory, entry)))
+        except FileNotFoundError:
+            return []
+
+    def open_session(self, name):
+        """Read-only view of a session; the current one is returned as is."""
+        if self.session is not None and self.session.name == name:
+            return self.session
+        if os.path.basename(name) != name or name not in self.sessions():
+            return None
+        directory = os.path.join(self.base_directory, name)
+        if not os.path.isdir(directory):
+            return None
+        return Session(directory, readonly=True)
+
+
+history = TimeSeriesRecorder(os.path.join(os.path.dirname(__file__), 'history'))
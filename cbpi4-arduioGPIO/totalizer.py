@@ -0,0 +1,175 @@
+import logging
+import os
+import struct
+import zlib
+
+from .controlScheduler import ControlScheduler
+from .loopMonitor import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+
+class TotalizerJournal:
+    """
+    Crash-safe named counters backed by an append-only journal.
+
+    Every change is one small record: crc32, operation (ADD or SET), value and counter name. Records
+    are buffered and written with a single fsync every `fsync_interval` seconds, so a sensor adding
+    to its total every second costs one SD-card write per interval, not one per sample. Once the
+    journal grows past `compact_size` bytes it is rewritten as one SET record per counter into a
+    temporary file that atomically replaces it.
+
+    On load the journal is replayed up to the first record that is truncated or fails its
+    checksum (a write torn by a crash or power cut); the rest is cut off. At most the last
+    `fsync_interval` seconds of increments are lost.
+    """
+
+    ADD, SET = 0, 1
+    HEADER = struct.Struct("<IBdH")  # crc32, operation, value, name length
+
+    def __init__(self, path, fsync_interval=5.0, compact_size=64 * 1024):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_size = compact_size
+        self._values = None
+        self._buffer = bytearray()
+        self._size = 0
+        self._flush_job = None
+
+    @classmethod
+    def _record(cls, operation, name, value):
+        encoded = name.encode("utf-8")
+        body = struct.pack("<BdH", operation, value, len(encoded)) + encoded
+        return struct.pack("<I", zlib.crc32(body)) + body
+
+    def _load(self):
+        if self._values is not None:
+            return self._values
+        self._values = {}
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return self._values
+        offset = 0
+        while offset + self.HEADER.size <= len(data):
+            crc, operation, value, length = self.HEADER.unpack_from(data, offset)
+            end = offset + self.HEADER.size + length
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                break
+            name = data[offset + self.HEADER.size:end].decode("utf-8", "replace")
+            if operation == self.ADD:
+                self._values[name] = self._values.get(name, 0.0) + value
+            else:
+                self._values[name] = value
+            offset = end
+        if offset < len(data):
+            logger.warning(f"Discarding {len(data) - offset} bytes of torn totalizer journal in {self.path}")
+            with open(self.path, "r+b") as file:
+                file.truncate(offset)
+        self._size = offset
+        return self._values
+
+    def get(self, name, default=0.0):
+        return self._load().get(name, default)
+
+    def add(self, name, delta):
+        values = self._load()
+        values[name] = values.get(name, 0.0) + delta
+        self._append(self._record(self.ADD, name, delta))
+
+    def set(self, name, value):
+        self._load()[name] = value
+        self._append(self._record(self.SET, name, value))
+
+    def _append(self, record):
+        self._buffer += record
+        if self._flush_job is None:
+            self._flush_job = ControlScheduler.get().call_later(self.fsync_interval, self.flush,
+                                                                name="TotalizerJournal:flush")
+
+    def flush(self):
+        """Write and fsync the buffered records; compacts the journal when it has grown too large."""
+        self._flush_job = None
+        if not self._buffer:
+            return
+        try:
+            with loop_monitor.measure("TotalizerJournal.flush"):
+                with open(self.path, "ab") as file:
+                    file.write(self._buffer)
+                    file.flush()
+                    os.fsync(file.fileno())
+            self._size += len(self._buffer)
+            self._buffer.clear()
+            if self._size > self.compact_size:
+                self.compact()
+        except OSError as e:
+            logger.error(f"Failed to write totalizer journal {self.path}: {e}")
+
+    def compact(self):
+        """Replace the journal by one SET record per counter."""
+        snapshot = b"".join(self._record(self.SET, name, value) for name, value in self._load().items())
+        temporary = self.path + ".tmp"
+        with loop_monitor.measure("TotalizerJournal.compact"):
+            with open(temporary, "wb") as file:
+                file.write(snapshot)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+            directory = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        self._size = len(snapshot)
+        logger.debug(f"Compacted totalizer journal to {self._size} bytes")
+
+    def close(self):
+        if self._flush_job is not None:
+            self._flush_job.cancel()
+        self.flush()
+
+
+class Totalizer:
+    """
+    Lifetime, batch and step totals of one sensor.
+
+    Only the lifetime total is accumulated; batch and step totals are the lifetime total minus a
+    mark set when they are reset. add() is one journal record and every total is O(1) to read.
+    """
+
+    def __init__(self, journal, name):
+        self.journal = journal
+        self.name = name
+        self._lifetime = f"{name}:lifetime"
+        self._batch_mark = f"{name}:batch_mark"
+        self._step_mark = f"{name}:step_mark"
+
+    def add(self, delta):
+        if delta:
+            self.journal.add(self._lifetime, delta)
+
+    @property
+    def lifetime(self):
+        return self.journal.get(self._lifetime)
+
+    @property
+    def batch(self):
+        return self.lifetime - self.journal.get(self._batch_mark)
+
+    @property
+    def step(self):
+        return self.lifetime - self.journal.get(self._step_mark)
+
+    def reset_step(self):
+        self.journal.set(self._step_mark, self.lifetime)
+
+    def reset_batch(self):
+        self.journal.set(self._batch_mark, self.lifetime)
+        self.reset_step()
+
+    def snapshot(self):
+        return {"lifetime": self.lifetime, "batch": self.batch, "step": self.step}
+
+
+totalizers = TotalizerJournal(os.path.join(os.path.dirname(__file__), 'totalizers.journal'))
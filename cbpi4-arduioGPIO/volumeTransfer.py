@@ -0,0 +1,291 @@
+import inspect
+import json
+import logging
+import os
+
+from .controlScheduler import ControlScheduler
+from .loopMonitor import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+
+class VolumeSource:
+    """
+    Mixin for volume sensors: transfer steps subscribe to every new reading instead of polling
+    the sensor value. notify_volume() is called from the sensor's run loop with the total volume
+    and the current flow in volume units per second.
+    """
+
+    _volume_listeners = ()
+
+    def add_volume_listener(self, listener):
+        if not self._volume_listeners:
+            self._volume_listeners = []
+        self._volume_listeners.append(listener)
+
+    def remove_volume_listener(self, listener):
+        if listener in self._volume_listeners:
+            self._volume_listeners.remove(listener)
+
+    def notify_volume(self, volume, flow):
+        for listener in list(self._volume_listeners):
+            try:
+                listener(volume, flow)
+            except Exception as e:
+                logger.error(f"Volume listener failed: {e}")
+
+
+async def set_actor_output(cbpi, actor_id, output):
+    """
+    Set the raw output of a pump actor. Flow-controlled pumps suspend their PID and hold the
+    output (hold_output) so the next control tick does not overwrite it; plain PWM actors get
+    set_output and any other actor cbpi's set_power.
+    """
+    actor = cbpi.actor.find_by_id(actor_id)
+    instance = getattr(actor, "instance", None)
+    if hasattr(instance, "hold_output"):
+        await instance.hold_output(output)
+    elif hasattr(instance, "set_output"):
+        await instance.set_output(output)
+    else:
+        await cbpi.actor.set_power(actor_id, output)
+
+
+async def reset_volume_sensor(instance):
+    """Reset a volume sensor whether its reset() is a plain method or a coroutine."""
+    reset = getattr(instance, "reset", None)
+    if reset is None:
+        return
+    result = reset()
+    if inspect.isawaitable(result):
+        await result
+
+
+class StopLatencies:
+    """
+    Learned stop latency per actor, in seconds: the time between issuing off and the flow
+    actually stopping, as seen by the volume sensor (sensor lag and valve closing included).
+    Stored as JSON next to the flow meter calibration.
+    """
+
+    def __init__(self, path, default=0.5, gain=0.5, maximum=10.0):
+        self.path = path
+        self.default = default
+        self.gain = gain
+        self.maximum = maximum
+        self._latencies = None
+
+    def _load(self):
+        if self._latencies is None:
+            try:
+                with open(self.path, 'r') as file:
+                    self._latencies = {str(key): float(value) for key, value in json.load(file).items()}
+            except FileNotFoundError:
+                self._latencies = {}
+            except (ValueError, AttributeError) as e:
+                logger.error(f"Ignoring invalid stop latency file {self.path}: {e}")
+                self._latencies = {}
+        return self._latencies
+
+    def get(self, actor_id):
+        with loop_monitor.measure("StopLatencies.load"):
+            return self._load().get(str(actor_id), self.default)
+
+    def learn(self, actor_id, latency_used, overshoot, flow):
+        """
+        Fold one transfer into the estimate. An overshoot of `overshoot` at `flow` units/s means
+        the flow kept going overshoot/flow seconds longer than `latency_used` assumed.
+        """
+        observed = min(max(latency_used + overshoot / flow, 0.0), self.maximum)
+        latencies = self._load()
+        previous = latencies.get(str(actor_id), self.default)
+        latencies[str(actor_id)] = round(previous + self.gain * (observed - previous), 3)
+        try:
+            with loop_monitor.measure("StopLatencies.save"):
+                with open(self.path, 'w') as file:
+                    json.dump(latencies, file, indent=4)
+        except IOError as e:
+            logger.error(f"Failed to save stop latencies: {e}")
+        return latencies[str(actor_id)]
+
+
+stop_latencies = StopLatencies(os.path.join(os.path.dirname(__file__), 'volume_transfer.json'))
+
+
+class VolumeTransfer:
+    """
+    Predictive cutoff for a volume transfer.
+
+    Every volume reading (pushed by a VolumeSource sensor, or polled every POLL_INTERVAL for any
+    other sensor) re-plans the stop: with the live flow the transfer reaches the target in
+    remaining/flow seconds, and the off command has to go out the learned stop latency earlier.
+    If that moment falls before the next expected reading it is scheduled on the ControlScheduler
+    to the exact time instead of waiting for a poll.
+
+    With `trim_fraction` the transfer runs in two stages: full speed until a point computed from
+    the measured flow, then `trim()` switches the pump to its low trim rate and the cutoff is
+    predicted from the trim flow. The switch is planned like the cutoff (the speed change takes
+    the stop latency to show up too) and is moved earlier if the trim stage would otherwise
+    last less than MIN_TRIM_TIME at the expected trim flow of `trim_ratio` times the fast flow.
+
+    After `stop()` the transfer waits for the flow to settle, learns the actor's stop latency from
+    the overshoot and calls `finished(volume, overshoot)`. `on_update(volume, flow)` is called
+    for every reading so the step can update its summary.
+    """
+
+    POLL_INTERVAL = 0.2
+    SETTLE_TIMEOUT = 10.0
+    MIN_TRIM_TIME = 5.0
+    RUNNING, SETTLING, DONE = "running", "settling", "done"
+
+    def __init__(self, cbpi, actor_id, sensor_id, target, stop, finished, on_update=None, learn=True,
+                 trim=None, trim_fraction=0.0, trim_ratio=0.25):
+        self.cbpi = cbpi
+        self.actor_id = actor_id
+        self.sensor_id = sensor_id
+        self.target = float(target)
+        self.stop = stop
+        self.finished = finished
+        self.on_update = on_update
+        self.learn = learn and actor_id is not None
+        self.trim = trim
+        self.trim_fraction = min(max(float(trim_fraction or 0), 0.0), 1.0) if trim is not None else 0.0
+        self.trim_ratio = trim_ratio
+        self.trimming = not 0 < self.trim_fraction < 1
+        self.trim_volume = None
+        self.latency = stop_latencies.get(actor_id) if actor_id is not None else 0.0
+        self.state = self.RUNNING
+        self.volume = 0.0
+        self.flow = 0.0
+        self.cut_volume = None
+        self.cut_flow = 0.0
+        self.cut_time = None
+        self._source = None
+        self._last_update = None
+        self._last_poll = None
+        self._poll_job = None
+        self._cutoff_job = None
+        self._settle_job = None
+        self._trim_job = None
+
+    def start(self):
+        scheduler = ControlScheduler.get()
+        sensor = self.cbpi.sensor.find_by_id(self.sensor_id)
+        instance = getattr(sensor, "instance", None)
+        if isinstance(instance, VolumeSource):
+            self._source = instance
+            instance.add_volume_listener(self.on_volume)
+        else:
+            self._poll_job = scheduler.every(self.POLL_INTERVAL, self._poll, name=f"VolumeTransfer:{self.sensor_id}")
+        logger.info(f"Volume transfer to {self.target} started, stop latency {self.latency}s"
+                    f"{'' if self._source else ' (polling sensor)'}")
+
+    def _detach(self):
+        if self._source is not None:
+            self._source.remove_volume_listener(self.on_volume)
+            self._source = None
+        for job in (self._poll_job, self._cutoff_job, self._settle_job, self._trim_job):
+            if job is not None:
+                job.cancel()
+        self._poll_job = self._cutoff_job = self._settle_job = self._trim_job = None
+
+    def cancel(self):
+        self.state = self.DONE
+        self._detach()
+
+    def _poll(self):
+        value = self.cbpi.sensor.get_sensor_value(self.sensor_id).get("value")
+        if value is None:
+            return
+        now = ControlScheduler.get().time()
+        flow = 0.0
+        if self._last_poll is not None and now > self._last_poll[0]:
+            flow = max((float(value) - self._last_poll[1]) / (now - self._last_poll[0]), 0.0)
+        self._last_poll = (now, float(value))
+        self.on_volume(float(value), flow)
+
+    def on_volume(self, volume, flow):
+        scheduler = ControlScheduler.get()
+        now = scheduler.time()
+        interval = now - self._last_update if self._last_update is not None else 1.0
+        self._last_update = now
+        self.volume = volume
+        self.flow = flow
+        if self.on_update is not None:
+            scheduler.call_later(0, lambda: self.on_update(volume, flow), name="VolumeTransfer:update")
+        if self.state == self.RUNNING:
+            if self.trimming:
+                self._plan_cutoff(now, interval)
+            else:
+                self._plan_trim(now, interval)
+        elif self.state == self.SETTLING:
+            if now - self.cut_time >= 1.0 and flow <= 0.05 * self.cut_flow:
+                if self._settle_job is not None:
+                    self._settle_job.cancel()
+                self._settle_job = scheduler.call_later(0, self._settled, name="VolumeTransfer:settled")
+
+    def _plan_cutoff(self, now, interval):
+        scheduler = ControlScheduler.get()
+        remaining = self.target - self.volume
+        fire_at = None
+        if remaining <= 0:
+            fire_at = now
+        elif self.flow > 0:
+            fire_at = now + remaining / self.flow - self.latency
+        if self._cutoff_job is not None:
+            self._cutoff_job.cancel()
+            self._cutoff_job = None
+        if fire_at is not None and fire_at < now + 1.5 * interval:
+            self._cutoff_job = scheduler.call_at(max(fire_at, now), self._cutoff, name="VolumeTransfer:cutoff")
+
+    def _plan_trim(self, now, interval):
+        scheduler = ControlScheduler.get()
+        switch = self.target * self.trim_fraction
+        if self.flow > 0:
+            switch = min(switch, self.target - self.flow * self.trim_ratio * self.MIN_TRIM_TIME)
+        remaining = switch - self.volume
+        fire_at = None
+        if remaining <= 0:
+            fire_at = now
+        elif self.flow > 0:
+            fire_at = now + remaining / self.flow - self.latency
+        if self._trim_job is not None:
+            self._trim_job.cancel()
+            self._trim_job = None
+        if fire_at is not None and fire_at < now + 1.5 * interval:
+            self._trim_job = scheduler.call_at(max(fire_at, now), self._start_trim, name="VolumeTransfer:trim")
+
+    async def _start_trim(self):
+        if self.state != self.RUNNING or self.trimming:
+            return
+        self._trim_job = None
+        self.trimming = True
+        self.trim_volume = self.volume + self.flow * (ControlScheduler.get().time() - self._last_update)
+        await self.trim()
+        logger.info(f"Volume transfer switched to trim rate at ~{self.trim_volume:.2f} of {self.target}")
+
+    async def _cutoff(self):
+        if self.state != self.RUNNING:
+            return
+        scheduler = ControlScheduler.get()
+        now = scheduler.time()
+        self.state = self.SETTLING
+        self._cutoff_job = None
+        self.cut_time = now
+        self.cut_flow = self.flow
+        self.cut_volume = self.volume + self.flow * (now - self._last_update)
+        # Scheduled before the stop write, so volume updates arriving during it find the job
+        self._settle_job = scheduler.call_later(self.SETTLE_TIMEOUT, self._settled, name="VolumeTransfer:settled")
+        await self.stop()
+        logger.info(f"Volume transfer cut off at ~{self.cut_volume:.2f} (flow {self.flow:.3f}/s), target {self.target}")
+
+    async def _settled(self):
+        if self.state != self.SETTLING:
+            return
+        self.state = self.DONE
+        self._detach()
+        overshoot = self.volume - self.target
+        if self.learn and self.cut_flow > 0:
+            latency = stop_latencies.learn(self.actor_id, self.latency, overshoot, self.cut_flow)
+            logger.info(f"Transfer overshoot {overshoot:+.3f}; stop latency of {self.actor_id} now {latency}s")
+        await self.finished(self.volume, overshoot)
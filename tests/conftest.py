@@ -0,0 +1,25 @@
+import os
+import sys
+import types
+
+import pytest
+
+# The plugin directory is not an importable name, and its __init__ registers the plugin with
+# CraftBeerPi. Expose the plugin modules as the package `arduinogpio` without running it.
+PLUGIN_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cbpi4-arduioGPIO")
+
+if "arduinogpio" not in sys.modules:
+    package = types.ModuleType("arduinogpio")
+    package.__path__ = [PLUGIN_DIRECTORY]
+    sys.modules["arduinogpio"] = package
+
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler():
+    """Every test gets its own ControlScheduler; the shared one is bound to the test's event loop."""
+    from arduinogpio.controlScheduler import ControlScheduler
+    ControlScheduler._instance = None
+    yield
+    if ControlScheduler._instance is not None:
+        ControlScheduler._instance.stop()
+        ControlScheduler._instance = None
@@ -0,0 +1,111 @@
+import asyncio
+
+from arduinogpio.commandLanes import CONFIG, CONTROL, EMERGENCY, STATE, CommandLanes, classify, command_lane, lane_pin
+
+
+def test_classify():
+    assert classify([3, 9, 0, 0]) == EMERGENCY    # analog_write 0 stops a pump
+    assert classify([3, 9, 0, 128]) == CONTROL
+    assert classify([2, 7, 1]) == STATE           # digital_write
+    assert classify([0, 42]) == STATE             # loop back
+    assert classify([1, 7, 1, 0]) == CONFIG       # set_pin_mode
+
+
+def test_command_lane_overrides_classification():
+    with command_lane(EMERGENCY):
+        assert classify([2, 7, 0]) == EMERGENCY
+    assert classify([2, 7, 0]) == STATE
+
+
+def test_lane_pin_keys_analog_inputs_by_channel():
+    assert lane_pin([3, 3, 0, 5]) == 3
+    assert lane_pin([1, 3, 1]) == 3
+    assert lane_pin([1, 3, 3, 1]) == ("a", 3)
+    assert lane_pin([0, 42]) is None
+
+
+class Wire:
+    """Transmit callables that record what reached the port; the first write can be held open."""
+
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    def blocking(self, label):
+        async def transmit():
+            await self.release.wait()
+            self.sent.append(label)
+        return transmit
+
+    def write(self, label):
+        async def transmit():
+            self.sent.append(label)
+        return transmit
+
+
+async def submit_behind_busy_writer(lanes, wire, submissions):
+    """Occupy the writer, queue `submissions` ((lane, label, pin)) in order, then let everything drain."""
+    tasks = [asyncio.ensure_future(lanes.submit(CONFIG, wire.blocking("busy")))]
+    await asyncio.sleep(0)
+    for lane, label, pin in submissions:
+        tasks.append(asyncio.ensure_future(lanes.submit(lane, wire.write(label), pin)))
+        await asyncio.sleep(0)
+    wire.release.set()
+    await asyncio.wait_for(asyncio.gather(*tasks), 1.0)
+    lanes.stop()
+
+
+def test_control_updates_are_coalesced_per_pin():
+    async def scenario():
+        lanes, wire = CommandLanes(), Wire()
+        await submit_behind_busy_writer(lanes, wire, [
+            (CONTROL, "pin9=10", 9), (CONTROL, "pin10=10", 10), (CONTROL, "pin9=20", 9)])
+        return lanes, wire
+
+    lanes, wire = asyncio.run(scenario())
+    # The newest value keeps the queue position of the first
+    assert wire.sent == ["busy", "pin9=20", "pin10=10"]
+    assert lanes.coalesced == 1
+
+
+def test_higher_lanes_go_first():
+    async def scenario():
+        lanes, wire = CommandLanes(), Wire()
+        await submit_behind_busy_writer(lanes, wire, [
+            (CONFIG, "config", None), (CONTROL, "control", 9), (STATE, "state", 7), (EMERGENCY, "stop", 8)])
+        return wire
+
+    assert asyncio.run(scenario()).sent == ["busy", "stop", "state", "control", "config"]
+
+
+def test_other_command_for_pin_discards_queued_control_update():
+    async def scenario():
+        lanes, wire = CommandLanes(), Wire()
+        await submit_behind_busy_writer(lanes, wire, [(CONTROL, "pid tick", 9), (EMERGENCY, "off", 9)])
+        return lanes, wire
+
+    lanes, wire = asyncio.run(scenario())
+    assert wire.sent == ["busy", "off"]
+    assert lanes.dropped[CONTROL] == 1
+
+
+def test_analog_input_pin_mode_keeps_control_update_of_digital_pin():
+    async def scenario():
+        lanes, wire = CommandLanes(), Wire()
+        await submit_behind_busy_writer(lanes, wire, [
+            (CONTROL, "pwm 3", lane_pin([3, 3, 0, 5])), (CONFIG, "A3 input", lane_pin([1, 3, 3, 1]))])
+        return wire
+
+    assert asyncio.run(scenario()).sent == ["busy", "pwm 3", "A3 input"]
+
+
+def test_full_control_lane_drops_oldest_update():
+    async def scenario():
+        lanes, wire = CommandLanes(depth=2), Wire()
+        await submit_behind_busy_writer(lanes, wire, [
+            (CONTROL, "pin1", 1), (CONTROL, "pin2", 2), (CONTROL, "pin3", 3)])
+        return lanes, wire
+
+    lanes, wire = asyncio.run(scenario())
+    assert wire.sent == ["busy", "pin2", "pin3"]
+    assert lanes.dropped[CONTROL] == 1
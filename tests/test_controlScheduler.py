@@ -0,0 +1,108 @@
+import asyncio
+
+from arduinogpio.controlScheduler import ControlScheduler
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_one_shot_jobs_run_in_time_order():
+    async def scenario():
+        scheduler = ControlScheduler.get()
+        order = []
+        now = scheduler.time()
+        scheduler.call_at(now + 0.03, lambda: order.append("c"))
+        scheduler.call_at(now + 0.01, lambda: order.append("a"))
+        scheduler.call_at(now + 0.02, lambda: order.append("b"))
+        await asyncio.sleep(0.06)
+        return order
+
+    assert run(scenario()) == ["a", "b", "c"]
+
+
+def test_cancelled_job_does_not_run():
+    async def scenario():
+        scheduler = ControlScheduler.get()
+        ran = []
+        job = scheduler.call_later(0.01, lambda: ran.append(True))
+        job.cancel()
+        await asyncio.sleep(0.03)
+        return ran
+
+    assert run(scenario()) == []
+
+
+def test_periodic_job_runs_at_fixed_rate_until_cancelled():
+    async def scenario():
+        scheduler = ControlScheduler.get()
+        ticks = []
+        job = scheduler.every(0.02, lambda: ticks.append(scheduler.time()))
+        await asyncio.sleep(0.11)
+        job.cancel()
+        count = len(ticks)
+        await asyncio.sleep(0.05)
+        return ticks, count
+
+    ticks, count = run(scenario())
+    assert 4 <= count <= 7
+    assert len(ticks) == count
+    assert all(0.015 < later - earlier < 0.035 for earlier, later in zip(ticks, ticks[1:]))
+
+
+def test_slow_coroutine_job_neither_delays_others_nor_overlaps_itself():
+    async def scenario():
+        scheduler = ControlScheduler.get()
+        ticks = []
+        running = []
+
+        async def slow():
+            running.append(1)
+            assert len(running) == 1
+            await asyncio.sleep(0.07)
+            running.pop()
+
+        slow_job = scheduler.every(0.02, slow)
+        scheduler.every(0.02, lambda: ticks.append(scheduler.time()))
+        await asyncio.sleep(0.2)
+        return slow_job, ticks
+
+    slow_job, ticks = run(scenario())
+    assert len(ticks) >= 8
+    assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.035
+    assert slow_job.overruns > 0
+    assert slow_job.runs < len(ticks)
+
+
+def test_failing_job_does_not_stop_the_scheduler():
+    async def scenario():
+        scheduler = ControlScheduler.get()
+        ran = []
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        scheduler.call_later(0.0, broken)
+        scheduler.call_later(0.01, lambda: ran.append(True))
+        await asyncio.sleep(0.03)
+        return ran
+
+    assert run(scenario()) == [True]
+
+
+def test_park_returns_when_owner_stops_running():
+    class Owner:
+        running = True
+
+    async def scenario():
+        scheduler = ControlScheduler(park_poll_interval=0.01)
+        owner = Owner()
+        parked = asyncio.ensure_future(scheduler.park(owner))
+        await asyncio.sleep(0.03)
+        still_parked = not parked.done()
+        owner.running = False
+        await asyncio.wait_for(parked, 0.1)
+        scheduler.stop()
+        return still_parked
+
+    assert run(scenario())
@@ -0,0 +1,46 @@
+import numpy as np
+
+from arduinogpio.historyQuery import PyramidLevel, lttb
+
+
+def test_lttb_keeps_everything_when_there_is_room():
+    t = np.arange(10.0)
+    assert list(lttb(t, t, 10)) == list(range(10))
+    assert list(lttb(t, t, 50)) == list(range(10))
+
+
+def test_lttb_selects_requested_number_of_ordered_samples():
+    t = np.arange(1000.0)
+    v = np.sin(t / 50)
+    selected = lttb(t, v, 100)
+    assert len(selected) == 100
+    assert selected[0] == 0 and selected[-1] == 999
+    assert np.all(np.diff(selected) > 0)
+
+
+def test_lttb_keeps_a_spike():
+    t = np.arange(1000.0) + 1.7e9
+    v = np.zeros(1000)
+    v[437] = 5.0
+    assert 437 in lttb(t, v, 20)
+
+
+def test_pyramid_level_build_matches_incremental_add():
+    rng = np.random.default_rng(1)
+    t = np.sort(rng.uniform(0, 100, 500))
+    v = rng.normal(size=500)
+    built, added = PyramidLevel(10.0), PyramidLevel(10.0, capacity=1)
+    built.build(t, v)
+    for sample_t, value in zip(t, v):
+        added.add(sample_t, value)
+    assert built.n == added.n == 10
+    for name in ("start", "min", "max", "sum", "count"):
+        assert np.allclose(getattr(built, name)[:built.n], getattr(added, name)[:added.n])
+
+
+def test_pyramid_level_range_covers_overlapping_buckets():
+    level = PyramidLevel(10.0)
+    level.build(np.arange(0.0, 100.0), np.ones(100))
+    lo, hi = level.range(25.0, 45.0)
+    assert list(level.start[lo:hi]) == [20.0, 30.0, 40.0]
+    assert level.range(None, None) == (0, 10)
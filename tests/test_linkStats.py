@@ -0,0 +1,38 @@
+from arduinogpio.linkStats import LatencyHistogram, command_key
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for microseconds in range(32):
+        histogram.record(microseconds / 1e6)
+    assert histogram.percentile(0.1) == 0
+    assert histogram.percentile(50) == 15
+    assert histogram.percentile(100) == 31
+
+
+def test_large_values_are_within_bucket_resolution():
+    for microseconds in (100, 1234, 98765, 3_000_000, 4_000_000_000):
+        histogram = LatencyHistogram()
+        histogram.record(microseconds / 1e6)
+        value = histogram.percentile(50)
+        assert value <= microseconds
+        assert microseconds - value <= microseconds / 16
+
+
+def test_snapshot():
+    histogram = LatencyHistogram()
+    assert histogram.snapshot()["p50_us"] is None
+    for milliseconds in (1, 2, 3, 4, 100):
+        histogram.record(milliseconds / 1e3)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["min_us"] == 1000 and snapshot["max_us"] == 100000
+    assert snapshot["mean_us"] == 22000.0
+    assert 2880 <= snapshot["p50_us"] <= 3000
+    assert snapshot["p99_us"] > 90000
+
+
+def test_command_key():
+    assert command_key([3, 9, 0, 128]) == ("analog_write", 9)
+    assert command_key([1, 3, 3, 1]) == ("set_pin_mode_analog_input", 3)
+    assert command_key([0, 42]) == ("loop_back", None)
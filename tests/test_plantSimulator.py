@@ -0,0 +1,75 @@
+import asyncio
+
+from arduinogpio.pid import PID
+from arduinogpio.plantSimulator import PipeDeadTime, PlantSimulator, PumpCurve, SimulatedBoard, VirtualClock
+
+
+def manual_plant(**kwargs):
+    clock = VirtualClock()
+    clock.advance(0)
+    return clock, PlantSimulator(clock=clock, **kwargs)
+
+
+def test_pump_curve():
+    pump = PumpCurve()
+    assert pump.flow(0) == 0.0
+    assert pump.flow(40) == 0.0   # below the static head
+    flows = [pump.flow(output) for output in range(80, 256, 25)]
+    assert all(lower < higher for lower, higher in zip(flows, flows[1:]))
+
+
+def test_pipe_dead_time_delays_the_flow():
+    pipe = PipeDeadTime(dead_time=2.0)
+    seen = []
+    for t in range(10):
+        pipe.push(float(t), 1.0 if t >= 3 else 0.0)
+        seen.append(pipe.value(float(t)))
+    assert seen == [0.0] * 5 + [1.0] * 5
+
+
+def test_delivered_volume_matches_the_pump_flow():
+    clock, plant = manual_plant()
+    plant.set_pump_output(255)
+    for _ in range(600):
+        clock.advance(0.1)
+        plant.step()
+    flow = plant.pump.flow(255)
+    # 60 s of pumping minus the 2 s the pipe takes to fill
+    assert abs(plant.delivered_volume - flow * 58 / 60) < 0.02 * flow
+    assert abs(plant.source.volume + plant.destination.volume - 60.0) < 1e-6 + flow * 2 / 60
+
+
+def test_flow_pid_settles_on_the_simulated_plant():
+    clock, plant = manual_plant()
+    pid = PID(2.0, 1.0, 0.0, setpoint=10.0, sample_time=None, output_limits=(0, 255), time_fn=clock.time)
+    trace = []
+    for _ in range(120):
+        clock.advance(1.0)
+        plant.step()
+        plant.set_pump_output(pid(plant.delivered_flow))
+        trace.append(plant.delivered_flow)
+    assert all(abs(flow - 10.0) < 0.1 for flow in trace[90:])
+
+
+def test_simulated_board_drives_the_plant_and_reports_the_flow():
+    async def scenario():
+        clock, plant = manual_plant()
+        board = SimulatedBoard(plant, {"pump": 9, "flow_adc": 0})
+        reports = []
+
+        async def on_report(data):
+            reports.append(data[2])
+
+        await board.set_pin_mode_analog_output(9)
+        await board.set_pin_mode_analog_input(0, 0, on_report)
+        await board.analog_write(9, 200)
+        for _ in range(100):
+            clock.advance(0.05)
+            plant.step()
+            await board.report_analog()
+        return plant, reports
+
+    plant, reports = asyncio.run(scenario())
+    assert plant.pump_output == 200
+    assert reports[0] == 0
+    assert reports[-1] == plant.flow_adc() > 0
@@ -0,0 +1,110 @@
+import asyncio
+import os
+
+from arduinogpio.totalizer import Totalizer, TotalizerJournal
+
+
+def run(function):
+    """Journal writes schedule their fsync on the ControlScheduler, which needs a running loop."""
+    async def scenario():
+        return function()
+    return asyncio.run(scenario())
+
+
+def test_values_survive_a_reload(tmp_path):
+    path = str(tmp_path / "totals.journal")
+
+    def write():
+        journal = TotalizerJournal(path)
+        journal.add("a", 1.5)
+        journal.add("a", 2.0)
+        journal.set("b", 7.0)
+        journal.close()
+
+    run(write)
+    reloaded = TotalizerJournal(path)
+    assert reloaded.get("a") == 3.5
+    assert reloaded.get("b") == 7.0
+    assert reloaded.get("missing", -1.0) == -1.0
+
+
+def test_nothing_is_written_before_the_flush(tmp_path):
+    path = str(tmp_path / "totals.journal")
+
+    def write():
+        journal = TotalizerJournal(path, fsync_interval=60)
+        journal.add("a", 1.0)
+        exists = os.path.exists(path)
+        journal.close()
+        return exists
+
+    assert not run(write)
+    assert TotalizerJournal(path).get("a") == 1.0
+
+
+def test_torn_tail_is_discarded_and_cut_off(tmp_path):
+    path = str(tmp_path / "totals.journal")
+
+    def write():
+        journal = TotalizerJournal(path)
+        journal.add("a", 1.0)
+        journal.add("a", 2.0)
+        journal.close()
+
+    run(write)
+    intact = os.path.getsize(path)
+    torn = TotalizerJournal._record(TotalizerJournal.ADD, "a", 100.0)
+    with open(path, "ab") as file:
+        file.write(torn[:len(torn) // 2])
+
+    assert TotalizerJournal(path).get("a") == 3.0
+    assert os.path.getsize(path) == intact
+
+
+def test_record_with_bad_checksum_ends_the_replay(tmp_path):
+    path = str(tmp_path / "totals.journal")
+    good = TotalizerJournal._record(TotalizerJournal.ADD, "a", 1.0)
+    bad = bytearray(TotalizerJournal._record(TotalizerJournal.ADD, "a", 2.0))
+    bad[6] ^= 0xFF
+    later = TotalizerJournal._record(TotalizerJournal.ADD, "a", 4.0)
+    with open(path, "wb") as file:
+        file.write(good + bytes(bad) + later)
+
+    assert TotalizerJournal(path).get("a") == 1.0
+    assert os.path.getsize(path) == len(good)
+
+
+def test_compaction_keeps_the_values(tmp_path):
+    path = str(tmp_path / "totals.journal")
+
+    def write():
+        journal = TotalizerJournal(path, compact_size=512)
+        for _ in range(200):
+            journal.add("a", 0.5)
+        journal.set("b", 2.0)
+        journal.close()
+
+    run(write)
+    assert os.path.getsize(path) < 512
+    reloaded = TotalizerJournal(path)
+    assert reloaded.get("a") == 100.0
+    assert reloaded.get("b") == 2.0
+
+
+def test_batch_and_step_totals_follow_their_resets(tmp_path):
+    def scenario():
+        journal = TotalizerJournal(str(tmp_path / "totals.journal"))
+        totalizer = Totalizer(journal, "sensor:1")
+        totalizer.add(5.0)
+        totalizer.reset_step()
+        totalizer.add(2.0)
+        first = totalizer.snapshot()
+        totalizer.reset_batch()
+        totalizer.add(1.0)
+        second = totalizer.snapshot()
+        journal.close()
+        return first, second
+
+    first, second = run(scenario)
+    assert first == {"lifetime": 7.0, "batch": 7.0, "step": 2.0}
+    assert second == {"lifetime": 8.0, "batch": 1.0, "step": 1.0}
@@ -0,0 +1,31 @@
+import json
+
+from arduinogpio.volumeTransfer import StopLatencies
+
+
+def test_unknown_actor_gets_the_default(tmp_path):
+    assert StopLatencies(str(tmp_path / "latencies.json"), default=0.5).get("pump") == 0.5
+
+
+def test_overshoot_moves_the_latency_towards_the_observed_one(tmp_path):
+    path = str(tmp_path / "latencies.json")
+    latencies = StopLatencies(path, default=0.5, gain=0.5)
+    # 0.3 units too many at 0.2 units/s: the flow ran 1.5 s longer than the 0.5 s assumed
+    assert latencies.learn("pump", 0.5, 0.3, 0.2) == 1.25
+    # An undershoot pulls it back
+    assert latencies.learn("pump", 1.25, -0.1, 0.2) == 1.0
+    with open(path) as file:
+        assert json.load(file) == {"pump": 1.0}
+    assert StopLatencies(path).get("pump") == 1.0
+
+
+def test_observed_latency_is_clamped(tmp_path):
+    latencies = StopLatencies(str(tmp_path / "latencies.json"), default=0.5, gain=1.0, maximum=10.0)
+    assert latencies.learn("pump", 0.5, 100.0, 0.1) == 10.0
+    assert latencies.learn("pump", 0.5, -100.0, 0.1) == 0.0
+
+
+def test_invalid_file_is_ignored(tmp_path):
+    path = tmp_path / "latencies.json"
+    path.write_text("not json")
+    assert StopLatencies(str(path), default=0.7).get("pump") == 0.7